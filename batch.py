@@ -0,0 +1,565 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from cache import cached_convert
+from converter import (
+    DEFAULT_PNG_PROFILE, ConversionCancelled, convert_animated_webp, convert_ico_to_png, convert_ico_to_pngs,
+    TimeRange, convert_mp4_to_gif, convert_video_animation, convert_webp_to_png, selected_duration,
+)
+from metrics import ConversionMetrics
+from probe import VideoInfo, estimated_cost
+
+
+# Conversion modes by key: input extension -> output extension. GIF modes go through ffmpeg.
+# The first mode listed for an extension is the one detected from file names.
+MODES = {
+    "mp4": (".mp4", ".gif"),
+    "mov": (".mov", ".gif"),
+    "webp": (".webp", ".png"),
+    "ico": (".ico", ".png"),
+    "webp_gif": (".webp", ".gif"),
+    "webp_apng": (".webp", ".png"),
+}
+GIF_MODES = ("mp4", "mov")
+IMAGE_MODES = ("webp", "ico")
+# Animated WEBP, streamed frame by frame with the size cap applied: output format by mode
+ANIMATION_MODES = {"webp_gif": "gif", "webp_apng": "apng"}
+
+# Below this many files a process pool costs more to start than it saves
+PROCESS_POOL_MIN_FILES = 64
+
+
+def default_workers() -> int:
+    """Default concurrency limit: one job per CPU core."""
+    return max(1, os.cpu_count() or 1)
+
+
+def should_race(gif_jobs: int, attempts: int = 2) -> bool:
+    """Race GIF attempts only when every file's attempts can each get a core of their own."""
+    return 0 < gif_jobs and gif_jobs * attempts <= default_workers()
+
+
+@dataclass
+class Job:
+    index: int  # position in the user's file list (0-based)
+    src: str
+    dst: str
+    mode: str = ""  # key into MODES
+    ranges: Optional[List[TimeRange]] = None  # MP4/MOV: convert only these (start, end) seconds
+
+
+@dataclass
+class JobResult:
+    job: Job
+    ok: bool = False
+    output: Optional[str] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    skipped: bool = False  # never started because the batch was cancelled
+    cancelled: bool = False  # stopped mid-conversion by the cancel event; no output left behind
+    log: List[str] = field(default_factory=list)  # converter log lines kept by a worker process
+    outputs: List[str] = field(default_factory=list)  # every file written, when more than `output`
+    cache_hit: Optional[bool] = None  # a worker process's own cache lookup (None: no lookup)
+
+
+def mode_for_path(path: str) -> Optional[str]:
+    """MODES key matching the file's extension, or None."""
+    ext = os.path.splitext(path.lower())[1]
+    for key, (in_ext, _) in MODES.items():
+        if ext == in_ext:
+            return key
+    return None
+
+
+def plan_jobs(files: Iterable[str], out_dir: str, mode: Optional[str] = None) -> List[Job]:
+    """
+    Build jobs for `files` writing into out_dir. With mode=None the mode is taken from each
+    file's extension. Same-named inputs from different folders get numbered outputs
+    (name_2.gif, ...) so parallel jobs never write the same file.
+    """
+    jobs = []
+    taken = set()
+    for idx, src in enumerate(files):
+        key = mode or mode_for_path(src) or ""
+        out_ext = MODES[key][1] if key in MODES else ".out"
+        base = os.path.splitext(os.path.basename(src))[0]
+        dst = os.path.join(out_dir, f"{base}{out_ext}")
+        n = 2
+        while dst.lower() in taken:
+            dst = os.path.join(out_dir, f"{base}_{n}{out_ext}")
+            n += 1
+        taken.add(dst.lower())
+        jobs.append(Job(index=idx, src=src, dst=dst, mode=key))
+    return jobs
+
+
+def chunk_workers(video_jobs: int, jobs: int) -> int:
+    """ffmpeg processes one chunked encode may run: the cores left for each of the videos
+    converting at the same time."""
+    return max(1, default_workers() // max(1, min(video_jobs, jobs)))
+
+
+def job_cost(job: Job, info: Optional[VideoInfo]) -> float:
+    """probe.estimated_cost of the part of the clip the job converts (its time ranges, if any)."""
+    cost = estimated_cost(info)
+    if job.ranges and info is not None and info.duration:
+        cost *= (selected_duration(job.ranges, info.duration) or 0.0) / info.duration
+    return cost
+
+
+def convert_job(
+    job: Job,
+    max_size_mb: float = 5.0,
+    logger: Optional[Callable[[str], None]] = None,
+    on_event: Optional[Callable[[str, dict], None]] = None,
+    size_model=None,
+    cache=None,
+    on_progress: Optional[Callable[[float, dict], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+    race: bool = False,
+    metrics: Optional[ConversionMetrics] = None,
+    png_profile: str = DEFAULT_PNG_PROFILE,
+    ico_sizes: Union[None, str, Sequence[int]] = None,
+    formats: Sequence[str] = ("gif",),
+    gif_diff: bool = False,
+    chunked: bool = False,
+    chunk_workers: int = 0,
+    outputs: Optional[List[str]] = None,
+) -> str:
+    """Run the converter for job.mode (through the output cache when one is given).
+    on_progress(fraction, info) gets live progress for GIF and animation modes; setting
+    cancel_event stops a running GIF or animation encode (ConversionCancelled is raised).
+    Animation modes (ANIMATION_MODES) apply max_size_mb as well; APNG uses png_profile.
+    race runs a GIF's attempts in parallel; it does not change the chosen output, so it
+    is not part of the cache key. metrics collects stage timings and counters (a PNG conversion is
+    one "convert" stage). png_profile selects the PNG output profile (converter.PNG_PROFILES).
+    ico_sizes: None writes the largest icon to job.dst; "all" or a list of edge sizes
+    writes `<name>_<w>x<h>.png` files from one open (not cached) and returns the largest.
+    formats: output formats allowed for MP4/MOV (converter.VIDEO_OUTPUT_FORMATS keys); with
+    more than GIF the best one under the cap is chosen and the returned path carries its
+    extension (not cached).
+    gif_diff encodes GIFs with the frame-difference pipeline (encode_mode "diff"), which is
+    much smaller for screen recordings and other mostly static content.
+    job.ranges limits MP4/MOV jobs to those time ranges (part of the cache key).
+    chunked encodes long MP4/MOV GIFs (60 s and more) in 30 s segments, up to chunk_workers
+    (0: one per core) at a time, against one palette (encode_mode "chunked"; gif_diff takes
+    precedence). The worker count does not change the output, so it is not part of the cache key.
+    outputs, if given, receives every file a multi-size ICO job (ico_sizes) wrote; the
+    returned path is the first of them."""
+    if job.mode in GIF_MODES:
+        params = dict(
+            max_size_mb=max_size_mb,
+            fast_first=True,
+            max_attempts=2,
+            palette_sample_sec=6.0,
+            palette_windows=4,
+            probe_encode=True,
+            # Phone MOVs are usually HEVC, where decoding dominates each retry
+            intermediate=(job.mode == "mov"),
+        )
+        if gif_diff:
+            params["encode_mode"] = "diff"  # only when set, so existing cache keys stay valid
+        elif chunked:
+            params.update(encode_mode="chunked", chunk_sec=30.0)
+        if job.ranges:
+            params["ranges"] = list(job.ranges)
+        if tuple(formats) != ("gif",):
+            # The output's extension depends on the chosen format, so it is not cached
+            return convert_video_animation(
+                job.src,
+                job.dst,
+                formats=formats,
+                logger=logger,
+                size_model=size_model,
+                on_event=on_event,
+                on_progress=on_progress,
+                cancel_event=cancel_event,
+                race=race,
+                metrics=metrics,
+                chunk_workers=chunk_workers,
+                **params,
+            ).path
+        return cached_convert(
+            cache, "mp4_to_gif", params, job.src, job.dst,
+            lambda: convert_mp4_to_gif(
+                input_path=job.src,
+                output_path=job.dst,
+                logger=logger,
+                size_model=size_model,
+                on_event=on_event,
+                on_progress=on_progress,
+                cancel_event=cancel_event,
+                race=race,
+                metrics=metrics,
+                chunk_workers=chunk_workers,
+                **params,
+            ),
+            logger=logger,
+        )
+    if job.mode in ANIMATION_MODES:
+        fmt = ANIMATION_MODES[job.mode]
+        params = {"format": fmt, "max_size_mb": max_size_mb}
+        if fmt == "apng":
+            params["profile"] = png_profile
+        return cached_convert(
+            cache, "webp_animation", params, job.src, job.dst,
+            lambda: convert_animated_webp(
+                job.src,
+                job.dst,
+                fmt=fmt,
+                max_size_mb=max_size_mb,
+                profile=png_profile,
+                logger=logger,
+                on_event=on_event,
+                on_progress=on_progress,
+                cancel_event=cancel_event,
+                metrics=metrics,
+            ),
+            logger=logger,
+        )
+    if job.mode == "ico" and ico_sizes is not None:
+        sizes = None if ico_sizes == "all" else list(ico_sizes)
+        with metrics.timer("convert") if metrics is not None else nullcontext():
+            outs = convert_ico_to_pngs(job.src, job.dst, sizes=sizes, logger=logger, profile=png_profile)
+        if metrics is not None:
+            metrics.count("bytes_in", os.path.getsize(job.src))
+            metrics.count("bytes_out", sum(os.path.getsize(o) for o in outs))
+        if outputs is not None:
+            outputs.extend(outs)
+        return outs[0]
+    if job.mode == "webp":
+        name, convert = "webp_to_png", convert_webp_to_png
+    elif job.mode == "ico":
+        name, convert = "ico_to_png", convert_ico_to_png
+    else:
+        raise RuntimeError(f"Unsupported file type: {job.src}")
+    with metrics.timer("convert") if metrics is not None else nullcontext():
+        out = cached_convert(
+            cache, name, {"profile": png_profile}, job.src, job.dst,
+            lambda: convert(job.src, job.dst, logger=logger, profile=png_profile), logger=logger,
+        )
+    if metrics is not None:
+        metrics.count("bytes_in", os.path.getsize(job.src))
+        metrics.count("bytes_out", os.path.getsize(out))
+    return out
+
+
+class BatchProgress:
+    """
+    Thread-safe overall progress and ETA for a running batch.
+
+    Jobs are weighted (e.g. by probe.estimated_cost) so a half-done 3-minute clip counts
+    for more than a finished 2-second one; the ETA extrapolates the measured throughput
+    (weighted work per second since start) over the remaining work.
+    """
+
+    def __init__(self, weights: Dict[int, float]):
+        self._weights = {k: (w if w > 0 else 1.0) for k, w in weights.items()}
+        self._total = sum(self._weights.values()) or 1.0
+        self._fractions: Dict[int, float] = {}
+        self._completed = 0
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+    def update(self, index: int, fraction: float) -> None:
+        with self._lock:
+            self._fractions[index] = max(self._fractions.get(index, 0.0), min(1.0, fraction))
+
+    def finish(self, index: int) -> None:
+        with self._lock:
+            self._fractions[index] = 1.0
+            self._completed += 1
+
+    def snapshot(self) -> Tuple[float, int, Optional[float]]:
+        """(fraction of total work done, jobs completed, ETA seconds or None while unknown)."""
+        with self._lock:
+            done = sum(self._weights.get(i, 1.0) * f for i, f in self._fractions.items()) / self._total
+            completed = self._completed
+        elapsed = time.perf_counter() - self._t0
+        eta = elapsed * (1.0 - done) / done if done > 0.01 and elapsed > 2.0 else None
+        return min(1.0, done), completed, eta
+
+
+def _call(cb, *args) -> None:
+    if cb:
+        try:
+            cb(*args)
+        except Exception:
+            # Never let a reporting callback take down the batch
+            pass
+
+
+def run_batch(
+    jobs: Sequence[Job],
+    convert: Callable[[Job], str],
+    max_workers: Optional[int] = None,
+    cancel_event: Optional[threading.Event] = None,
+    on_start: Optional[Callable[[Job], None]] = None,
+    on_done: Optional[Callable[[JobResult, int], None]] = None,
+) -> List[JobResult]:
+    """
+    Run `convert(job)` for every job on a bounded thread pool.
+
+    At most `max_workers` jobs are in flight at once (default: CPU count); new jobs
+    are only submitted as running ones finish, so cancelling stops the batch without
+    a backlog of queued work. Each job is isolated: an exception marks that job as
+    failed and the batch carries on.
+
+    `on_done(result, completed)` is called from the calling thread in submission
+    order, even when jobs finish out of order, with the number of jobs reported so far.
+    Jobs not started before `cancel_event` is set are reported as skipped; jobs whose
+    converter stopped on it (ConversionCancelled) are reported as cancelled. Pass the same
+    event to the converters so running jobs stop immediately instead of finishing.
+    Returns the results in submission order.
+    """
+    workers = max(1, max_workers or default_workers())
+    results: List[Optional[JobResult]] = [None] * len(jobs)
+    finished: Dict[int, JobResult] = {}
+    next_report = 0
+
+    def run_one(pos: int) -> JobResult:
+        job = jobs[pos]
+        res = JobResult(job=job)
+        if cancel_event is not None and cancel_event.is_set():
+            res.skipped = True
+            return res
+        _call(on_start, job)
+        t0 = time.perf_counter()
+        try:
+            res.output = convert(job)
+            res.ok = True
+        except ConversionCancelled:
+            res.cancelled = True
+        except Exception as e:
+            res.error = str(e) or e.__class__.__name__
+        res.elapsed = time.perf_counter() - t0
+        return res
+
+    def report_ready() -> None:
+        nonlocal next_report
+        while next_report in finished:
+            res = finished.pop(next_report)
+            results[next_report] = res
+            next_report += 1
+            _call(on_done, res, next_report)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="convert") as pool:
+        pending: Dict[Future, int] = {}
+        submitted = 0
+        try:
+            while submitted < len(jobs) or pending:
+                cancelled = cancel_event is not None and cancel_event.is_set()
+                while not cancelled and submitted < len(jobs) and len(pending) < workers:
+                    pending[pool.submit(run_one, submitted)] = submitted
+                    submitted += 1
+                if cancelled:
+                    # Mark everything not yet submitted as skipped
+                    while submitted < len(jobs):
+                        finished[submitted] = JobResult(job=jobs[submitted], skipped=True)
+                        submitted += 1
+                if pending:
+                    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        finished[pending.pop(fut)] = fut.result()
+                report_ready()
+        except KeyboardInterrupt:
+            # Let in-flight jobs see the cancellation before the pool waits for them
+            if cancel_event is not None:
+                cancel_event.set()
+            raise
+
+    report_ready()
+    return [r for r in results if r is not None]
+
+
+@dataclass
+class ImageBatchResult:
+    results: List[JobResult] = field(default_factory=list)  # in job order
+    seconds: float = 0.0
+
+    @property
+    def files_per_sec(self) -> float:
+        done = sum(1 for r in self.results if not r.skipped)
+        return done / self.seconds if self.seconds > 0 else 0.0
+
+
+_worker_caches: Dict[str, object] = {}
+_worker_cancel = None  # a worker process's multiprocessing.Event, set when the batch is cancelled
+
+
+def _init_image_worker(cancel) -> None:
+    global _worker_cancel
+    _worker_cancel = cancel
+
+
+def _convert_image_chunk(
+    jobs: List[Job],
+    cache=None,
+    cache_dir: Optional[str] = None,
+    png_profile: str = DEFAULT_PNG_PROFILE,
+    ico_sizes: Union[None, str, Sequence[int]] = None,
+    on_start: Optional[Callable[[Job], None]] = None,
+    job_logger: Optional[Callable[[Job], Optional[Callable[[str], None]]]] = None,
+    keep_log: bool = False,
+    cancel_event: Optional[threading.Event] = None,
+) -> List[JobResult]:
+    """Pool worker: convert a chunk of image jobs. Top-level so process pools can pickle it;
+    worker processes get cache_dir and open their own OutputCache once, report each job's
+    lookup in JobResult.cache_hit, and with keep_log return the converter's log lines in
+    JobResult.log instead of calling a logger. Jobs not started once the cancel event (in
+    processes, the pool's) is set are returned as skipped."""
+    if cancel_event is None:
+        cancel_event = _worker_cancel
+    own_cache = cache is None and bool(cache_dir)
+    if own_cache:
+        cache = _worker_caches.get(cache_dir)
+        if cache is None:
+            try:
+                from cache import OutputCache
+                cache = _worker_caches[cache_dir] = OutputCache(cache_dir)
+            except Exception:
+                cache = None
+    results = []
+    for job in jobs:
+        res = JobResult(job=job)
+        if cancel_event is not None and cancel_event.is_set():
+            res.skipped = True
+            results.append(res)
+            continue
+        _call(on_start, job)
+        logger = res.log.append if keep_log else (job_logger(job) if job_logger else None)
+        before = cache.stats() if own_cache and cache is not None else None
+        t0 = time.perf_counter()
+        try:
+            res.output = convert_job(job, logger=logger, cache=cache, png_profile=png_profile, ico_sizes=ico_sizes,
+                                     outputs=res.outputs)
+            res.ok = True
+        except Exception as e:
+            res.error = str(e) or e.__class__.__name__
+        if before is not None:
+            after = cache.stats()
+            if after["hits"] > before["hits"]:
+                res.cache_hit = True
+            elif after["misses"] > before["misses"]:
+                res.cache_hit = False
+        res.elapsed = time.perf_counter() - t0
+        results.append(res)
+    return results
+
+
+def convert_images_batch(
+    jobs: Sequence[Job],
+    max_workers: Optional[int] = None,
+    chunksize: Optional[int] = None,
+    processes: Optional[bool] = None,
+    cache=None,
+    cancel_event: Optional[threading.Event] = None,
+    on_done: Optional[Callable[[JobResult, int], None]] = None,
+    png_profile: str = DEFAULT_PNG_PROFILE,
+    ico_sizes: Union[None, str, Sequence[int]] = None,
+    on_start: Optional[Callable[[Job], None]] = None,
+    job_logger: Optional[Callable[[Job], Optional[Callable[[str], None]]]] = None,
+) -> ImageBatchResult:
+    """
+    Convert many WEBP/ICO jobs (see plan_jobs) at core-count speed.
+
+    Small per-file work is dominated by dispatch overhead, so jobs are sent to the pool in
+    chunks (default: about four chunks per worker, at most 64 files each). processes=True
+    uses a process pool, which sidesteps the GIL for Pillow's Python-side work; None picks
+    processes for PROCESS_POOL_MIN_FILES files or more on a multi-core machine, threads
+    otherwise. cache (an OutputCache) is used directly by threads; worker processes open
+    their own on the same folder, and their hits and misses are added to cache's counts as
+    their results come back.
+
+    png_profile and ico_sizes are passed on to convert_job.
+
+    `on_start(job)` and the logger `job_logger(job)` returns for each job are the same
+    hooks as run_batch's, called from the worker thread as each file starts and converts.
+    Worker processes cannot call back: their jobs are started when their chunk is handed
+    to the pool, and their log lines are replayed just before each file's on_done.
+
+    `on_done(result, completed)` is called from the calling thread as chunks finish.
+    Once `cancel_event` is set, queued chunks are withdrawn and running ones stop before
+    their next file; every file not started is reported as skipped.
+    Returns the per-file results in job order with the total wall time, so
+    `files_per_sec` gives the throughput.
+    """
+    jobs = list(jobs)
+    workers = max(1, max_workers or default_workers())
+    if processes is None:
+        processes = workers > 1 and len(jobs) >= PROCESS_POOL_MIN_FILES
+    size = chunksize or max(1, min(64, len(jobs) // (workers * 4)))
+    chunks = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+    results: Dict[int, JobResult] = {}
+    completed = 0
+    t0 = time.perf_counter()
+
+    def report(batch: List[JobResult]) -> None:
+        nonlocal completed
+        for res in batch:
+            if res.cache_hit is not None and cache is not None:
+                cache.add_lookups(hits=int(res.cache_hit), misses=int(not res.cache_hit))
+            if res.log:
+                logger = job_logger(res.job) if job_logger else None
+                for line in res.log:
+                    _call(logger, line)
+            results[res.job.index] = res
+            completed += 1
+            _call(on_done, res, completed)
+
+    # Worker processes cannot see cancel_event; they get an Event of their own, set to match
+    process_cancel = multiprocessing.Event() if processes and cancel_event is not None else None
+    pool: Executor = ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_image_worker, initargs=(process_cancel,),
+    ) if processes else ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image")
+    with pool:
+        pending: Dict[Future, int] = {}
+        submitted = 0
+        try:
+            while submitted < len(chunks) or pending:
+                cancelled = cancel_event is not None and cancel_event.is_set()
+                # Keep two chunks per worker queued so no worker idles between chunks
+                while not cancelled and submitted < len(chunks) and len(pending) < workers * 2:
+                    if processes:
+                        for job in chunks[submitted]:
+                            _call(on_start, job)
+                        fut = pool.submit(_convert_image_chunk, chunks[submitted],
+                                          cache_dir=cache.root if cache is not None else None, png_profile=png_profile,
+                                          ico_sizes=ico_sizes, keep_log=job_logger is not None)
+                    else:
+                        fut = pool.submit(_convert_image_chunk, chunks[submitted], cache, png_profile=png_profile,
+                                          ico_sizes=ico_sizes, on_start=on_start, job_logger=job_logger,
+                                          cancel_event=cancel_event)
+                    pending[fut] = submitted
+                    submitted += 1
+                if cancelled:
+                    if process_cancel is not None:
+                        process_cancel.set()
+                    for fut in [f for f in pending if f.cancel()]:
+                        report([JobResult(job=j, skipped=True) for j in chunks[pending.pop(fut)]])
+                    while submitted < len(chunks):
+                        report([JobResult(job=j, skipped=True) for j in chunks[submitted]])
+                        submitted += 1
+                if pending:
+                    # Time out now and then so a cancel is noticed while chunks are running
+                    done, _ = wait(list(pending), timeout=0.1, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        chunk = chunks[pending.pop(fut)]
+                        try:
+                            report(fut.result())
+                        except Exception as e:  # e.g. a worker process died
+                            report([JobResult(job=j, error=str(e) or e.__class__.__name__) for j in chunk])
+        except KeyboardInterrupt:
+            if cancel_event is not None:
+                cancel_event.set()
+            for fut in pending:
+                fut.cancel()
+            raise
+    ordered = [results[j.index] for j in jobs if j.index in results]
+    return ImageBatchResult(results=ordered, seconds=time.perf_counter() - t0)
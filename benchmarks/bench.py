@@ -0,0 +1,365 @@
+"""Benchmark the GIF and PNG conversion paths on locally generated media.
+
+    python benchmarks/bench.py -o results.json
+    python benchmarks/bench.py -o new.json --compare results.json
+
+Test clips are synthesised with ffmpeg's lavfi sources (testsrc2, mandelbrot, noise and a
+mostly static "screen" recording) and
+the WEBP/ICO sets with Pillow, so runs are reproducible on any machine. Each case runs
+in a fresh subprocess through batch.convert_job (the path the GUI and CLI use) with the
+output cache and size model disabled, which isolates CPU time and peak RSS per case.
+Results (with per-stage p50/p95 from metrics.py) are written as JSON; --compare flags
+cases that got slower than a previous run. --gif-diff also runs every video case with the
+frame-difference GIF pipeline (as "<id>+diff") and prints its size and time against the default.
+--chunked adds a 3-minute 1080p clip and runs the clips long enough to be split through the
+chunked parallel GIF encode as well (as "<id>+chunked"), reporting its speedup.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+try:
+    import resource  # Unix only; peak RSS is reported as None elsewhere
+except ImportError:
+    resource = None
+
+RESULTS_VERSION = 1
+DEFAULT_MEDIA_DIR = os.path.join(tempfile.gettempdir(), "file-converter-bench")
+
+# (case id, lavfi source, width, height, seconds, container)
+VIDEO_CASES = [
+    ("testsrc2-360p-5s", "testsrc2", 640, 360, 5, "mp4"),
+    ("testsrc2-720p-12s", "testsrc2", 1280, 720, 12, "mp4"),
+    ("mandelbrot-480p-8s", "mandelbrot", 854, 480, 8, "mov"),
+    ("noise-360p-6s", "noise", 640, 360, 6, "mp4"),
+    ("testsrc2-1080p-30s", "testsrc2", 1920, 1080, 30, "mp4"),
+    ("screen-720p-12s", "screen", 1280, 720, 12, "mp4"),
+]
+QUICK_VIDEO_CASES = {"testsrc2-360p-5s", "noise-360p-6s", "screen-720p-12s"}
+# Only generated with --chunked; a clip is split once it is at least this long
+LONG_VIDEO_CASES = [
+    ("testsrc2-1080p-180s", "testsrc2", 1920, 1080, 180, "mp4"),
+]
+CHUNKED_MIN_SEC = 60
+
+# (case id, width, height, pattern, with alpha)
+WEBP_CASES = [
+    ("webp-gradient-512", 512, 512, "gradient", False),
+    ("webp-noise-alpha-512", 512, 512, "noise", True),
+    ("webp-photo-1920", 1920, 1080, "photo", False),
+]
+ICO_CASES = [
+    ("ico-app-6sizes", (16, 24, 32, 48, 128, 256)),
+    ("ico-favicon-3sizes", (16, 32, 48)),
+]
+IMAGE_SET_SIZE = 8  # files per WEBP/ICO case, converted one after another
+
+
+def _lavfi_source(kind: str, width: int, height: int, seconds: float) -> str:
+    if kind == "noise":
+        return f"color=c=gray:s={width}x{height}:r=30:d={seconds},noise=alls=60:allf=t+u"
+    if kind == "screen":
+        # Static colour bars with a box that moves for two seconds, then rests for two
+        return (f"smptehdbars=s={width}x{height}:r=30:d={seconds}[bg];color=c=red:s=80x80:r=30:d={seconds}[fg];"
+                f"[bg][fg]overlay=x='if(lt(mod(t,4),2),mod(t*300,{width - 80}),{width // 2})':y={height // 2}")
+    if kind == "mandelbrot":
+        return f"mandelbrot=s={width}x{height}:r=30,trim=duration={seconds}"
+    return f"{kind}=s={width}x{height}:r=30:d={seconds}"
+
+
+def _make_video(path: str, kind: str, width: int, height: int, seconds: float) -> None:
+    cmd = [
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", _lavfi_source(kind, width, height, seconds),
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p",
+        path,
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def _synthetic_image(width: int, height: int, pattern: str, alpha: bool, seed: int):
+    from PIL import Image, ImageDraw, ImageFilter  # lazy import
+
+    if pattern == "noise":
+        im = Image.frombytes("RGB", (width, height), random.Random(seed).randbytes(width * height * 3))
+    else:
+        im = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+        draw = ImageDraw.Draw(im)
+        for i in range(24):
+            x = (seed * 97 + i * 131) % width
+            y = (seed * 53 + i * 71) % height
+            r = 20 + (i * 37) % (min(width, height) // 4)
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=((i * 40) % 256, (i * 90) % 256, (seed * 30) % 256))
+        if pattern == "photo":
+            im = im.filter(ImageFilter.GaussianBlur(2))
+    if alpha:
+        mask = Image.linear_gradient("L").rotate(seed * 30).resize((width, height))
+        im.putalpha(mask)
+    return im
+
+
+def generate_media(media_dir: str, quick: bool = False, gif_diff: bool = False, chunked: bool = False) -> List[dict]:
+    """Create (or reuse) the benchmark inputs and return the case list.
+    gif_diff adds a "<id>+diff" case per video that uses the frame-difference GIF pipeline;
+    chunked adds LONG_VIDEO_CASES and a "<id>+chunked" case per video long enough to split."""
+    os.makedirs(media_dir, exist_ok=True)
+    cases = []
+    for case_id, kind, w, h, sec, container in VIDEO_CASES + (LONG_VIDEO_CASES if chunked else []):
+        if quick and case_id not in QUICK_VIDEO_CASES:
+            continue
+        path = os.path.join(media_dir, f"{case_id}.{container}")
+        if not os.path.exists(path):
+            print(f"generating {path}", file=sys.stderr)
+            _make_video(path, kind, w, h, sec)
+        cases.append({"id": case_id, "mode": container, "inputs": [path]})
+        if gif_diff:
+            cases.append({"id": case_id + "+diff", "mode": container, "inputs": [path], "gif_diff": True})
+        if chunked and sec >= CHUNKED_MIN_SEC:
+            cases.append({"id": case_id + "+chunked", "mode": container, "inputs": [path], "chunked": True})
+    for case_id, w, h, pattern, alpha in WEBP_CASES:
+        inputs = []
+        for i in range(2 if quick else IMAGE_SET_SIZE):
+            path = os.path.join(media_dir, case_id, f"{i:02d}.webp")
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                _synthetic_image(w, h, pattern, alpha, i).save(path, "WEBP", quality=85)
+            inputs.append(path)
+        cases.append({"id": case_id, "mode": "webp", "inputs": inputs})
+    for case_id, sizes in ICO_CASES:
+        inputs = []
+        for i in range(2 if quick else IMAGE_SET_SIZE):
+            path = os.path.join(media_dir, case_id, f"{i:02d}.ico")
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                im = _synthetic_image(max(sizes), max(sizes), "gradient", True, i)
+                im.save(path, "ICO", sizes=[(s, s) for s in sizes])
+            inputs.append(path)
+        cases.append({"id": case_id, "mode": "ico", "inputs": inputs})
+    return cases
+
+
+def _peak_rss_kb() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_case(case: dict, out_dir: str, max_size_mb: float, png_profile: Optional[str] = None) -> dict:
+    """Convert every input of one case in this process and measure it."""
+    from batch import Job, convert_job
+    from metrics import BatchMetrics, ConversionMetrics
+
+    attempts: List[int] = []
+    result = {"id": case["id"], "mode": case["mode"], "files": len(case["inputs"]), "max_size_mb": max_size_mb}
+    options = {}
+    if png_profile and case["mode"] not in ("mp4", "mov"):
+        options["png_profile"] = result["png_profile"] = png_profile
+    if case.get("gif_diff"):
+        options["gif_diff"] = result["gif_diff"] = True
+    if case.get("chunked"):
+        options["chunked"] = result["chunked"] = True
+    bytes_in = bytes_out = hits = 0
+    stages = BatchMetrics()
+    t_cpu = os.times()
+    t0 = time.perf_counter()
+    try:
+        for i, src in enumerate(case["inputs"]):
+            dst = os.path.join(out_dir, f"{i:02d}_{os.path.splitext(os.path.basename(src))[0]}"
+                               + (".gif" if case["mode"] in ("mp4", "mov") else ".png"))
+            count = [0]
+
+            def on_event(name: str, fields: dict) -> None:
+                if name == "attempt":
+                    count[0] += 1
+
+            metrics = ConversionMetrics()
+            out = convert_job(Job(index=i, src=src, dst=dst, mode=case["mode"]), max_size_mb=max_size_mb,
+                              on_event=on_event, metrics=metrics, **options)
+            stages.add(metrics)
+            size = os.path.getsize(out)
+            attempts.append(count[0])
+            bytes_in += os.path.getsize(src)
+            bytes_out += size
+            hits += size <= max_size_mb * 1024 * 1024
+    except Exception as e:
+        result["error"] = str(e) or e.__class__.__name__
+    wall = time.perf_counter() - t0
+    t_end = os.times()
+    cpu = (t_end.user - t_cpu.user) + (t_end.system - t_cpu.system)
+    cpu += (t_end.children_user - t_cpu.children_user) + (t_end.children_system - t_cpu.children_system)
+    result.update(
+        wall_sec=round(wall, 3),
+        cpu_sec=round(cpu, 3),
+        attempts=sum(attempts) if case["mode"] in ("mp4", "mov") else None,
+        cap_hit_rate=(hits / len(attempts)) if attempts and case["mode"] in ("mp4", "mov") else None,
+        bytes_in=bytes_in,
+        bytes_out=bytes_out,
+        peak_rss_kb=_peak_rss_kb(),
+        stages=stages.summary()["stages"],
+    )
+    return result
+
+
+def _run_isolated(case: dict, max_size_mb: float, png_profile: Optional[str] = None) -> dict:
+    """Run one case in a fresh interpreter so CPU time, RSS and probe caches are its own."""
+    with tempfile.TemporaryDirectory(prefix="fc-bench-") as out_dir:
+        payload = json.dumps({"case": case, "out_dir": out_dir, "max_size_mb": max_size_mb,
+                              "png_profile": png_profile})
+        res = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-case", payload],
+                             stdout=subprocess.PIPE, text=True)
+    lines = res.stdout.strip().splitlines()
+    if res.returncode != 0 or not lines:
+        return {"id": case["id"], "mode": case["mode"], "error": f"benchmark process exited with {res.returncode}"}
+    return json.loads(lines[-1])
+
+
+def _median_of(runs: List[dict]) -> dict:
+    """Median wall/CPU over repeats; the other fields come from the median-wall run."""
+    ok = [r for r in runs if "error" not in r] or runs
+    ok.sort(key=lambda r: r.get("wall_sec", 0.0))
+    best = dict(ok[len(ok) // 2])
+    if len(ok) > 1 and "wall_sec" in best:
+        best["wall_sec"] = round(statistics.median(r["wall_sec"] for r in ok), 3)
+        best["cpu_sec"] = round(statistics.median(r["cpu_sec"] for r in ok), 3)
+        best["wall_runs"] = [r["wall_sec"] for r in runs if "wall_sec" in r]
+    return best
+
+
+def compare(current: dict, previous: dict, threshold: float, min_delta: float = 0.1) -> List[str]:
+    """
+    Describe cases that got slower by more than `threshold` (a fraction, and by at least
+    min_delta seconds so millisecond-scale image cases do not trip on jitter), started
+    failing, or hit the size cap less often.
+    """
+    prev = {c["id"]: c for c in previous.get("cases", [])}
+    problems = []
+    for case in current.get("cases", []):
+        old = prev.get(case["id"])
+        if not old:
+            continue
+        if "error" in case and "error" not in old:
+            problems.append(f"{case['id']}: now fails ({case['error']})")
+            continue
+        if "wall_sec" in case and old.get("wall_sec"):
+            ratio = case["wall_sec"] / old["wall_sec"]
+            line = f"{case['id']}: wall {old['wall_sec']:.2f}s -> {case['wall_sec']:.2f}s ({ratio - 1:+.0%})"
+            if ratio > 1 + threshold and case["wall_sec"] - old["wall_sec"] >= min_delta:
+                problems.append("SLOWER " + line)
+            else:
+                print(line, file=sys.stderr)
+        if old.get("cap_hit_rate") is not None and (case.get("cap_hit_rate") or 0) < old["cap_hit_rate"]:
+            problems.append(f"{case['id']}: size-cap hit rate {old['cap_hit_rate']:.0%} -> {case.get('cap_hit_rate') or 0:.0%}")
+    return problems
+
+
+def variant_report(results: List[dict], suffix: str, label: str) -> List[str]:
+    """One line per video case run both ways: output size and wall time of "<id><suffix>" vs the default."""
+    by_id = {r["id"]: r for r in results if "error" not in r}
+    lines = []
+    for case_id, other in by_id.items():
+        base = by_id.get(case_id[:-len(suffix)]) if case_id.endswith(suffix) else None
+        if base and base.get("bytes_out") and base.get("wall_sec") and other.get("wall_sec"):
+            lines.append(f"{base['id']}: {label} {other['bytes_out'] / base['bytes_out'] - 1:+.0%} bytes "
+                         f"({base['bytes_out'] / 1024:.0f} -> {other['bytes_out'] / 1024:.0f} KB), "
+                         f"{other['wall_sec'] / base['wall_sec'] - 1:+.0%} wall "
+                         f"({base['wall_sec']:.2f}s -> {other['wall_sec']:.2f}s, "
+                         f"{base['wall_sec'] / other['wall_sec']:.2f}x)")
+    return lines
+
+
+def _host() -> Dict[str, object]:
+    from cache import tool_versions
+
+    return {"platform": platform.platform(), "python": platform.python_version(),
+            "cpu_count": os.cpu_count(), **tool_versions()}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("-o", "--output", default="bench_results.json", help="where to write the JSON results")
+    p.add_argument("--compare", metavar="PREVIOUS", help="previous results file to check for regressions")
+    p.add_argument("--threshold", type=float, default=0.10,
+                   help="slowdown (fraction) that counts as a regression (default: 0.10)")
+    p.add_argument("--min-delta", type=float, default=0.1,
+                   help="ignore slowdowns smaller than this many seconds (default: 0.1)")
+    p.add_argument("--media-dir", default=DEFAULT_MEDIA_DIR, help="where generated inputs are kept between runs")
+    p.add_argument("-s", "--max-size-mb", type=float, default=5.0, help="GIF size cap (default: 5.0)")
+    p.add_argument("--png-profile", help="PNG output profile for WEBP/ICO cases (default: the converter default)")
+    p.add_argument("-r", "--repeat", type=int, default=1, help="runs per case; the median is reported")
+    p.add_argument("--gif-diff", action="store_true",
+                   help="also run each video case with the frame-difference GIF pipeline and compare")
+    p.add_argument("--chunked", action="store_true",
+                   help="add a 3-minute 1080p clip and also run long clips with the chunked parallel GIF encode")
+    p.add_argument("--quick", action="store_true", help="small subset for a fast smoke run")
+    p.add_argument("-k", "--filter", default="", help="only run cases whose id contains this text")
+    p.add_argument("--run-case", help=argparse.SUPPRESS)
+    return p
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.run_case:
+        spec = json.loads(args.run_case)
+        print(json.dumps(run_case(spec["case"], spec["out_dir"], spec["max_size_mb"], spec.get("png_profile"))))
+        return 0
+
+    cases = [c for c in generate_media(args.media_dir, args.quick, args.gif_diff, args.chunked) if args.filter in c["id"]]
+    results = []
+    for case in cases:
+        runs = [_run_isolated(case, args.max_size_mb, args.png_profile) for _ in range(max(1, args.repeat))]
+        res = _median_of(runs)
+        results.append(res)
+        if "error" in res:
+            print(f"{case['id']:<24} ERROR {res['error']}", file=sys.stderr)
+        else:
+            print(f"{case['id']:<24} {res['wall_sec']:7.2f}s wall {res['cpu_sec']:7.2f}s cpu "
+                  f"{res['bytes_out'] / 1024:9.0f} KB out", file=sys.stderr)
+
+    gif = [r for r in results if r.get("cap_hit_rate") is not None]
+    report = {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": _host(),
+        "max_size_mb": args.max_size_mb,
+        "png_profile": args.png_profile,
+        "cases": results,
+        "summary": {
+            "wall_sec": round(sum(r.get("wall_sec", 0.0) for r in results), 3),
+            "gif_cap_hit_rate": (sum(r["cap_hit_rate"] * r["files"] for r in gif) / sum(r["files"] for r in gif))
+            if gif else None,
+            "gif_attempts": sum(r["attempts"] for r in gif),
+            "errors": sum(1 for r in results if "error" in r),
+        },
+    }
+    for line in variant_report(results, "+diff", "diff pipeline") + variant_report(results, "+chunked", "chunked"):
+        print(line, file=sys.stderr)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            problems = compare(report, json.load(f), args.threshold, args.min_delta)
+        for line in problems:
+            print(line, file=sys.stderr)
+        return 1 if problems else 0
+    return 1 if report["summary"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
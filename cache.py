@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".file_converter", "cache")
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Bump when converter output changes in a way the parameters do not capture.
+CACHE_VERSION = 1
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS sources (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        sha256 TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        last_used REAL NOT NULL
+    )
+    """,
+)
+
+_versions: Optional[Dict[str, str]] = None
+_versions_lock = threading.Lock()
+
+
+def tool_versions() -> Dict[str, str]:
+    """ffmpeg and Pillow versions, resolved once per process. Part of every cache key."""
+    global _versions
+    with _versions_lock:
+        if _versions is None:
+            ffmpeg = "none"
+            try:
+                out = subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+                ffmpeg = (out.stdout.splitlines() or ["unknown"])[0].strip()
+            except (OSError, subprocess.SubprocessError):
+                pass
+            try:
+                import PIL  # lazy import
+                pillow = PIL.__version__
+            except Exception:
+                pillow = "none"
+            _versions = {"ffmpeg": ffmpeg, "pillow": pillow}
+        return dict(_versions)
+
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class OutputCache:
+    """
+    Persistent, content-addressed cache of conversion outputs.
+
+    Keys combine the SHA-256 of the input (re-hashed only when its size or mtime changed),
+    the converter name, its parameters and the ffmpeg/Pillow versions. Hits are served by
+    copying the cached object into place. link=True hard-links it instead (copying when
+    linking is not possible, e.g. across drives); only use it when delivered outputs are
+    never edited in place, since an edit would also change the cached object.
+    Least-recently-used objects are evicted once the cache exceeds max_bytes. Safe to
+    share between worker threads; `hits`/`misses` count lookups.
+    """
+
+    def __init__(self, root: str = DEFAULT_DIR, max_bytes: int = DEFAULT_MAX_BYTES, link: bool = False):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.link = link
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        with self._connect() as db:
+            for stmt in _SCHEMA:
+                db.execute(stmt)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(os.path.join(self.root, "index.sqlite3"), timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _object_path(self, key: str) -> str:
+        return os.path.join(self.root, "objects", key[:2], key)
+
+    def content_hash(self, path: str) -> str:
+        """SHA-256 of the file, reusing the stored hash while size and mtime are unchanged."""
+        st = os.stat(path)
+        apath = os.path.abspath(path)
+        with self._connect() as db:
+            row = db.execute("SELECT size, mtime_ns, sha256 FROM sources WHERE path = ?", (apath,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        digest = _sha256_file(path)
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO sources (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                (apath, st.st_size, st.st_mtime_ns, digest),
+            )
+        return digest
+
+    def key(self, src: str, converter: str, params: Dict[str, object]) -> str:
+        material = {
+            "v": CACHE_VERSION,
+            "src": self.content_hash(src),
+            "converter": converter,
+            "params": params,
+            "tools": tool_versions(),
+        }
+        return hashlib.sha256(json.dumps(material, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def fetch(self, key: str, dst: str) -> bool:
+        """Materialise a cached output at dst. Returns False (and counts a miss) if absent."""
+        obj = self._object_path(key)
+        with self._lock:
+            if not os.path.exists(obj):
+                self.misses += 1
+                return False
+            self.hits += 1
+        os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+        tmp = f"{dst}.cache-{os.getpid()}-{threading.get_ident()}"
+        try:
+            if self.link:
+                try:
+                    os.link(obj, tmp)
+                except OSError:
+                    shutil.copy2(obj, tmp)
+            else:
+                shutil.copy2(obj, tmp)
+            os.replace(tmp, dst)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return False
+        with self._connect() as db:
+            db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return True
+
+    def store(self, key: str, output_path: str) -> None:
+        """Copy a finished output into the cache, then evict down to max_bytes."""
+        obj = self._object_path(key)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        tmp = f"{obj}.tmp-{os.getpid()}-{threading.get_ident()}"
+        shutil.copyfile(output_path, tmp)
+        os.replace(tmp, obj)
+        size = os.path.getsize(obj)
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO entries (key, size, last_used) VALUES (?, ?, ?)",
+                (key, size, time.time()),
+            )
+        self.evict()
+
+    def evict(self) -> None:
+        with self._lock, self._connect() as db:
+            (total,) = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+            if total <= self.max_bytes:
+                return
+            for key, size in db.execute("SELECT key, size FROM entries ORDER BY last_used ASC").fetchall():
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(self._object_path(key))
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue  # in use (Windows); try again next time
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+
+    def add_lookups(self, hits: int = 0, misses: int = 0) -> None:
+        """Count lookups made through another OutputCache on this folder, e.g. in a worker process."""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+def cached_convert(
+    cache: Optional[OutputCache],
+    converter: str,
+    params: Dict[str, object],
+    src: str,
+    dst: str,
+    convert: Callable[[], str],
+    logger: Optional[Callable[[str], None]] = None,
+) -> str:
+    """
+    Serve dst from the cache when possible, otherwise run `convert()` and cache its output.
+    Cache problems are logged and never fail the conversion itself.
+    """
+    if cache is None:
+        return convert()
+    key = None
+    try:
+        key = cache.key(src, converter, params)
+        if cache.fetch(key, dst):
+            if logger:
+                logger(f"Cache hit: {dst}")
+            return dst
+    except Exception as e:
+        if logger:
+            logger(f"Cache lookup failed: {e}")
+    # dst is left alone until the conversion succeeds: converters write to a temp file and
+    # os.replace it onto dst, which also gives a dst hard-linked by a link=True hit a new
+    # inode instead of overwriting the cached object through the link
+    out = convert()
+    if key is not None:
+        try:
+            cache.store(key, out)
+        except Exception as e:
+            if logger:
+                logger(f"Could not store in cache: {e}")
+    return out
@@ -0,0 +1,337 @@
+"""Headless batch entry point: `python -m converter [options] PATH...`
+
+Streams one JSON object per line on stdout (job start, attempt, size, done/error and a
+final summary). Never imports tkinter, so it runs on render nodes and in cron.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from typing import List, Optional
+
+from batch import (
+    GIF_MODES, IMAGE_MODES, MODES, BatchProgress, Job, JobResult, convert_images_batch, convert_job, default_workers,
+    chunk_workers, job_cost, plan_jobs, run_batch, should_race,
+)
+from converter import DEFAULT_PNG_PROFILE, PNG_PROFILES, VIDEO_OUTPUT_FORMATS, parse_time_ranges
+from filelist import iter_files
+from journal import DEFAULT_PATH as DEFAULT_JOURNAL, BatchJournal
+from metrics import BatchMetrics, ConversionMetrics
+from probe import probe_many
+
+
+def expand_inputs(paths: List[str], mode: Optional[str]) -> List[str]:
+    """Files, globs and directories (recursive) -> de-duplicated list of matching files."""
+    exts = {MODES[mode][0]} if mode else {in_ext for in_ext, _ in MODES.values()}
+    seen = set()
+    out = []
+    for p in paths:
+        if os.path.isdir(p):
+            matches = iter_files(p, exts)
+        elif glob.has_magic(p):
+            matches = (m for m in sorted(glob.glob(p, recursive=True)) if os.path.splitext(m.lower())[1] in exts)
+        else:
+            matches = iter([p])
+        for m in matches:
+            key = os.path.normcase(os.path.abspath(m))
+            if key not in seen:
+                seen.add(key)
+                out.append(m)
+    return out
+
+
+def _ico_sizes(spec: str):
+    """--ico-sizes value: 'largest' -> None, 'all', or a comma-separated list of edge sizes."""
+    spec = spec.strip().lower()
+    if spec in ("largest", "all"):
+        return None if spec == "largest" else "all"
+    try:
+        sizes = [int(part) for part in spec.split(",") if part.strip()]
+    except ValueError:
+        sizes = []
+    if not sizes or min(sizes) <= 0:
+        raise argparse.ArgumentTypeError("expected 'largest', 'all' or sizes like 16,32,256")
+    return sizes
+
+
+def _formats(spec: str):
+    """--formats value: comma-separated output formats, e.g. 'gif,webp'."""
+    formats = tuple(part.strip().lower() for part in spec.split(",") if part.strip())
+    if not formats or any(f not in VIDEO_OUTPUT_FORMATS for f in formats):
+        raise argparse.ArgumentTypeError(f"expected a comma-separated list of {', '.join(VIDEO_OUTPUT_FORMATS)}")
+    return formats
+
+
+def _time_ranges(spec: str):
+    """--ranges value: comma-separated START-END time ranges."""
+    try:
+        return parse_time_ranges(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"{e} (expected ranges like 0:05-0:10,1:00-1:05 or 30-)")
+
+
+def _time(spec: str) -> str:
+    """--start/--end value: seconds or [h:]m:s, checked here and parsed with the range."""
+    try:
+        parse_time_ranges(f"{spec}-")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected seconds or [h:]m:s, got {spec!r}")
+    return spec
+
+
+class _JsonLines:
+    """Thread-safe JSON-lines writer; worker threads emit events concurrently."""
+
+    def __init__(self, stream) -> None:
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    def __call__(self, event: str, **fields) -> None:
+        line = json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, default=str)
+        with self._lock:
+            self._stream.write(line + "\n")
+            self._stream.flush()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(
+        prog="python -m converter",
+        description="Batch-convert MP4/MOV -> GIF, WEBP/ICO -> PNG and animated WEBP -> GIF/APNG without the GUI.",
+    )
+    p.add_argument("paths", nargs="+", help="input files, globs (quote them) or directories (searched recursively)")
+    p.add_argument("-t", "--type", dest="mode", choices=sorted(MODES),
+                   help="input type; default: detect per file from its extension "
+                        "(animated WEBP needs -t webp_gif or -t webp_apng)")
+    p.add_argument("-o", "--output-dir", default=".", help="output folder (default: current directory)")
+    p.add_argument("-s", "--max-size-mb", type=float, default=5.0, help="GIF/animation size cap in MB (default: 5.0)")
+    p.add_argument("--formats", type=_formats, default=("gif",), metavar="LIST",
+                   help="MP4/MOV output formats to choose from, e.g. gif,webp,apng: the one with the best "
+                        "quality under the size cap is written, with its extension (default: gif)")
+    p.add_argument("--gif-diff", action="store_true",
+                   help="encode GIFs from frame differences (drops duplicate frames, stores only changed "
+                        "rectangles); much smaller for screen recordings and UI demos")
+    p.add_argument("--chunked", action="store_true",
+                   help="split GIFs of long MP4/MOV clips (60 s and more) into 30 s segments encoded in parallel "
+                        "against one palette; the cores are shared between the files converting at once")
+    trim = p.add_mutually_exclusive_group()
+    trim.add_argument("--ranges", type=_time_ranges, metavar="SPEC",
+                      help="MP4/MOV: convert only these time ranges, joined in order, e.g. 0:05-0:10,1:00-1:05 "
+                           "(seconds or [h:]m:s; an open end runs to the end of the clip). Only the ranges are decoded")
+    trim.add_argument("--start", type=_time, metavar="TIME", help="MP4/MOV: start converting at TIME")
+    p.add_argument("--end", type=_time, metavar="TIME", help="MP4/MOV: stop converting at TIME")
+    p.add_argument("--png-profile", choices=tuple(PNG_PROFILES), default=DEFAULT_PNG_PROFILE,
+                   help="PNG output trade-off between speed and size (default: %(default)s)")
+    p.add_argument("--ico-sizes", type=_ico_sizes, default=None, metavar="SPEC",
+                   help="ICO: 'largest' (default), 'all', or sizes like 16,32,256; "
+                        "several sizes are written as NAME_WxH.png")
+    p.add_argument("-j", "--jobs", type=int, default=default_workers(),
+                   help="parallel jobs (default: CPU count)")
+    p.add_argument("--no-cache", action="store_true", help="do not read or write the output cache")
+    p.add_argument("--no-size-model", action="store_true", help="do not use or update the learned size model")
+    p.add_argument("-v", "--verbose", action="store_true", help="also emit converter log lines as 'log' events")
+    p.add_argument("--progress", action="store_true",
+                   help="emit live 'progress' events (per file fraction, fps, speed, batch ETA) while ffmpeg runs")
+    p.add_argument("--race", choices=("auto", "on", "off"), default="auto",
+                   help="run each GIF's predicted and fallback attempts in parallel; "
+                        "auto: only when there are enough idle cores (default)")
+    p.add_argument("--journal", metavar="PATH",
+                   help="record every job's state, output, size and timing in this SQLite journal "
+                        f"(with --resume, default: {DEFAULT_JOURNAL})")
+    p.add_argument("--resume", action="store_true",
+                   help="skip jobs the journal records as done whose output is still there; "
+                        "failed, cancelled and interrupted jobs run again")
+    p.add_argument("--metrics-json", metavar="PATH", help="write per-stage timing (p50/p95) and counters as JSON")
+    p.add_argument("--metrics-prom", metavar="PATH",
+                   help="write the same metrics in Prometheus text format (e.g. for a textfile collector)")
+    return p
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.max_size_mb <= 0 or args.jobs <= 0:
+        print("--max-size-mb and --jobs must be positive", file=sys.stderr)
+        return 2
+    ranges = args.ranges
+    if args.end and ranges:
+        print("--end cannot be combined with --ranges", file=sys.stderr)
+        return 2
+    if args.start or args.end:
+        try:
+            ranges = parse_time_ranges(f"{args.start or ''}-{args.end or ''}")
+        except ValueError as e:
+            print(f"--start/--end: {e}", file=sys.stderr)
+            return 2
+    emit = _JsonLines(sys.stdout)
+
+    files = expand_inputs(args.paths, args.mode)
+    jobs = plan_jobs(files, args.output_dir, args.mode)
+    for job in jobs:
+        if job.mode in GIF_MODES:
+            job.ranges = ranges
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Optional persistent stores; a read-only home folder must not stop the batch
+    cache = size_model = None
+    if not args.no_cache:
+        try:
+            from cache import OutputCache
+            cache = OutputCache()
+        except Exception as e:
+            emit("warning", message=f"output cache disabled: {e}")
+    if not args.no_size_model:
+        try:
+            from size_model import SizeModel
+            size_model = SizeModel()
+        except Exception as e:
+            emit("warning", message=f"size model disabled: {e}")
+    journal = None
+    if args.journal or args.resume:
+        try:
+            journal = BatchJournal(args.journal or DEFAULT_JOURNAL)
+        except Exception as e:
+            emit("warning", message=f"journal disabled: {e}")
+    if journal is not None:
+        # Only settings that change the output; -j, --race etc. do not make a job new
+        settings = {"max_size_mb": args.max_size_mb, "formats": list(args.formats), "gif_diff": args.gif_diff,
+                    "chunked": args.chunked, "png_profile": args.png_profile, "ico_sizes": args.ico_sizes}
+        jobs, already_done = journal.begin(jobs, settings, resume=args.resume)
+        if args.resume:
+            emit("resume", journal=journal.path, done=len(already_done), remaining=len(jobs))
+
+    # Probe videos up front (cached for the converters) and run the most expensive first
+    videos = [j.src for j in jobs if j.mode in GIF_MODES]
+    infos = probe_many(videos, max_workers=args.jobs * 2) if videos else {}
+    if videos:
+        jobs.sort(key=lambda j: job_cost(j, infos.get(j.src)), reverse=True)
+    tracker = BatchProgress({j.index: job_cost(j, infos.get(j.src)) or 1.0 for j in jobs})
+
+    race = args.race == "on" or (args.race == "auto" and should_race(len(videos)))
+    chunk_procs = chunk_workers(len(videos), args.jobs)
+    emit("batch", files=len(jobs), jobs=args.jobs, race=race, output_dir=os.path.abspath(args.output_dir))
+    cancel_event = threading.Event()
+    batch_metrics = BatchMetrics()
+    t0 = time.perf_counter()
+
+    def job_logger(job: Job):
+        return (lambda m: emit("log", index=job.index, message=m)) if args.verbose else None
+
+    def on_start(job: Job) -> None:
+        emit("start", index=job.index, src=job.src, dst=job.dst, mode=job.mode)
+
+    def convert(job: Job) -> str:
+        logger = job_logger(job)
+
+        def on_progress(frac: float, info: dict) -> None:
+            tracker.update(job.index, frac)
+            if args.progress:
+                done, _, eta = tracker.snapshot()
+                emit("progress", index=job.index, fraction=round(frac, 4), **info,
+                     batch_fraction=round(done, 4), eta_sec=round(eta, 1) if eta is not None else None)
+
+        metrics = ConversionMetrics()
+        try:
+            return convert_job(
+                job,
+                max_size_mb=args.max_size_mb,
+                logger=logger,
+                on_event=lambda name, fields: emit(name, index=job.index, **fields),
+                size_model=size_model,
+                cache=cache,
+                on_progress=on_progress,
+                cancel_event=cancel_event,
+                race=race,
+                metrics=metrics,
+                png_profile=args.png_profile,
+                formats=args.formats,
+                gif_diff=args.gif_diff,
+                chunked=args.chunked,
+                chunk_workers=chunk_procs,
+            )
+        finally:
+            batch_metrics.add(metrics)
+
+    def on_done(res: JobResult, _completed: int) -> None:
+        if journal is not None and res.job.mode in IMAGE_MODES:
+            journal.record(res)  # run_batch jobs are recorded by journal.wrap() as they end
+        tracker.finish(res.job.index)
+        _, completed, _ = tracker.snapshot()  # counted across both pools
+        if res.skipped:
+            emit("skipped", index=res.job.index, src=res.job.src)
+        elif res.cancelled:
+            emit("cancelled", index=res.job.index, src=res.job.src, seconds=round(res.elapsed, 3))
+        elif res.ok:
+            try:
+                size = os.path.getsize(res.output)
+            except (OSError, TypeError):
+                size = None
+            emit("done", index=res.job.index, src=res.job.src, output=res.output, bytes=size,
+                 seconds=round(res.elapsed, 3), completed=completed, total=len(jobs))
+        else:
+            emit("error", index=res.job.index, src=res.job.src, error=res.error,
+                 seconds=round(res.elapsed, 3), completed=completed, total=len(jobs))
+
+    # Images are many small files: batch them through chunked pools; videos go one per job
+    image_jobs = [j for j in jobs if j.mode in IMAGE_MODES]
+    other_jobs = [j for j in jobs if j.mode not in IMAGE_MODES]
+    results: List[JobResult] = []
+    try:
+        if image_jobs:
+            images = convert_images_batch(
+                image_jobs,
+                max_workers=args.jobs,
+                cache=cache,
+                cancel_event=cancel_event,
+                on_done=on_done,
+                png_profile=args.png_profile,
+                ico_sizes=args.ico_sizes,
+                on_start=on_start,
+                job_logger=job_logger,
+            )
+            for res in images.results:
+                m = ConversionMetrics()
+                if not res.skipped:
+                    m.add_time("convert", res.elapsed)
+                batch_metrics.add(m)
+            results += images.results
+            emit("images", files=len(images.results), seconds=round(images.seconds, 3),
+                 files_per_sec=round(images.files_per_sec, 1))
+        results += run_batch(
+            other_jobs,
+            journal.wrap(convert) if journal is not None else convert,
+            max_workers=args.jobs,
+            cancel_event=cancel_event,
+            on_start=on_start,
+            on_done=on_done,
+        )
+    except KeyboardInterrupt:
+        cancel_event.set()
+        emit("cancelled")
+        return 130
+
+    ok = sum(1 for r in results if r.ok)
+    failed = sum(1 for r in results if not r.ok and not r.skipped and not r.cancelled)
+    cancelled = sum(1 for r in results if r.cancelled)
+    summary = {"ok": ok, "failed": failed, "cancelled": cancelled,
+               "skipped": len(results) - ok - failed - cancelled,
+               "seconds": round(time.perf_counter() - t0, 3)}
+    if journal is not None:
+        summary["journal"] = {"path": journal.path, "resumed": len(already_done)}
+    if cache is not None:
+        summary["cache"] = cache.stats()
+    summary["metrics"] = batch_metrics.summary()
+    emit("summary", **summary)
+    try:
+        if args.metrics_json:
+            batch_metrics.write_json(args.metrics_json)
+        if args.metrics_prom:
+            batch_metrics.write_prometheus(args.metrics_prom)
+    except OSError as e:
+        emit("warning", message=f"could not write metrics: {e}")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,19 @@
+import io
 import os
 import subprocess
+import math
+import struct
 import tempfile
-from typing import Callable, Optional, Tuple
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from metrics import ConversionMetrics
+from probe import probe_video
 
 
 def _log(logger: Optional[Callable[[str], None]], message: str) -> None:
@@ -13,11 +25,28 @@ def _log(logger: Optional[Callable[[str], None]], message: str) -> None:
             pass
 
 
+def _emit(on_event: Optional[Callable[[str, dict], None]], event: str, **fields) -> None:
+    """Structured counterpart of _log for machine consumers (CLI JSON lines, metrics)."""
+    if on_event:
+        try:
+            on_event(event, fields)
+        except Exception:
+            pass
+
+
+_ffmpeg_found = False
+
+
 def check_ffmpeg_available() -> bool:
-    """Return True if ffmpeg is available on PATH."""
+    """Return True if ffmpeg is available on PATH. A positive result is remembered for the
+    rest of the process, so per-file checks in a batch do not spawn two processes each."""
+    global _ffmpeg_found
+    if _ffmpeg_found:
+        return True
     try:
         subprocess.run(["ffmpeg", "-version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
         subprocess.run(["ffprobe", "-version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        _ffmpeg_found = True
         return True
     except FileNotFoundError:
         return False
@@ -37,118 +66,1289 @@ def _filesize_mb(path: str) -> float:
         return 0.0
 
 
-def _attempt_encode(
-    src: str,
-    dst: str,
-    width: int,
-    fps: int,
-    max_colors: int,
-    palette_sample_sec: Optional[float] = None,
-    logger: Optional[Callable[[str], None]] = None,
-) -> Tuple[bool, Optional[str]]:
+ENCODE_MODES = ("single", "two-pass", "diff", "chunked")
+
+
+ProgressCallback = Callable[[float, dict], None]
+
+
+def _scaled(on_progress: Optional[ProgressCallback], lo: float, hi: float) -> Optional[ProgressCallback]:
+    """Map a 0..1 progress callback onto the [lo, hi] slice of a parent callback."""
+    if on_progress is None:
+        return None
+    return lambda frac, info: on_progress(lo + (hi - lo) * frac, info)
+
+
+class _FileProgress:
     """
-    Run a single ffmpeg encode using palettegen/paletteuse pipeline for high-quality, web-optimized GIFs.
-    Returns (success, error_message)
+    Folds the fractions of the individual ffmpeg runs of one conversion into a single
+    monotonic 0..1 value. Each phase gets a share of whatever is still left, so retries
+    keep moving forward instead of jumping back to zero.
     """
-    # Ensure even width as some codecs/filters require this
-    width = _even(width)
 
-    # Create a temp palette path
-    with tempfile.TemporaryDirectory() as tmpdir:
-        palette_path = os.path.join(tmpdir, "palette.png")
+    def __init__(self, on_progress: Optional[ProgressCallback]) -> None:
+        self._cb = on_progress
+        self.value = 0.0
 
-        # 1) Generate palette
-        palette_cmd = [
+    def phase(self, share: float) -> Optional[ProgressCallback]:
+        if self._cb is None:
+            return None
+        start = self.value
+        span = (1.0 - start) * share
+
+        def report(frac: float, info: dict) -> None:
+            value = start + span * min(1.0, max(0.0, frac))
+            if value > self.value:
+                self.value = value
+                try:
+                    self._cb(value, info)
+                except Exception:
+                    pass
+
+        return report
+
+
+class ConversionCancelled(RuntimeError):
+    """Raised when a conversion is stopped through its cancel_event. Running ffmpeg
+    processes have been terminated and partial outputs removed by then."""
+
+
+# How long a terminated ffmpeg may take to exit before it is killed
+_TERMINATE_GRACE_SEC = 0.5
+
+
+def _stop_process(proc: subprocess.Popen) -> None:
+    if proc.poll() is not None:
+        return
+    proc.terminate()
+    try:
+        proc.wait(_TERMINATE_GRACE_SEC)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def _watch_cancel(proc: subprocess.Popen, cancel_event: threading.Event) -> None:
+    while proc.poll() is None:
+        if cancel_event.wait(0.1):
+            _stop_process(proc)
+            return
+
+
+def _run_ffmpeg(
+    cmd,
+    on_progress: Optional[ProgressCallback] = None,
+    total_sec: Optional[float] = None,
+    stage: str = "encode",
+    cancel_event: Optional[threading.Event] = None,
+    metrics: Optional[ConversionMetrics] = None,
+) -> subprocess.CompletedProcess:
+    """
+    Run an ffmpeg command. `.stdout` of the result holds ffmpeg's messages either way.
+
+    With on_progress, ffmpeg's machine-readable `-progress` stream is read while it runs
+    and on_progress(fraction, {"stage", "fps", "speed", "out_sec"}) is called for every
+    update (about twice a second); fraction is output time / total_sec.
+
+    With cancel_event, a watcher terminates the process within ~0.1 s of the event being
+    set (killing it if it has not exited after a short grace period) and
+    ConversionCancelled is raised.
+
+    With metrics, the run's wall time is added to the `stage` timer.
+    """
+    if metrics is not None:
+        with metrics.timer(stage):
+            return _run_ffmpeg(cmd, on_progress, total_sec, stage, cancel_event)
+    if on_progress is None and cancel_event is None:
+        return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if cancel_event is not None and cancel_event.is_set():
+        raise ConversionCancelled("Cancelled")
+
+    if on_progress is not None:
+        cmd = [cmd[0], "-progress", "pipe:1", "-nostats"] + [c for c in cmd[1:] if c != "-stats"]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    else:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if cancel_event is not None:
+        threading.Thread(target=_watch_cancel, args=(proc, cancel_event), daemon=True).start()
+
+    messages: List[str] = []
+    if on_progress is None:
+        messages.append(proc.stdout.read())
+    else:
+        # Drain stderr on the side so a chatty ffmpeg can never block on a full pipe
+        drain = threading.Thread(target=lambda: messages.extend(proc.stderr), daemon=True)
+        drain.start()
+        block: dict = {}
+        for line in proc.stdout:
+            key, _, value = line.strip().partition("=")
+            if key != "progress":
+                block[key] = value
+                continue
+            try:
+                out_sec = int(block.get("out_time_us") or block.get("out_time_ms") or 0) / 1_000_000
+            except ValueError:
+                out_sec = 0.0
+            frac = 1.0 if value == "end" else (min(1.0, out_sec / total_sec) if total_sec else 0.0)
+            info = {"stage": stage, "out_sec": round(out_sec, 3)}
+            for name, raw in (("fps", block.get("fps")), ("speed", (block.get("speed") or "").rstrip("x"))):
+                try:
+                    info[name] = float(raw)
+                except (TypeError, ValueError):
+                    pass
+            try:
+                on_progress(frac, info)
+            except Exception:
+                pass
+            block = {}
+        drain.join()
+    proc.wait()
+    if cancel_event is not None and cancel_event.is_set():
+        raise ConversionCancelled("Cancelled")
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout="".join(messages))
+
+
+def _input_args(src: str, start: Optional[float] = None, duration: Optional[float] = None) -> List[str]:
+    """`-i src`, optionally limited to a time window. Input-side -ss seeks to the nearest
+    keyframe before decoding, so only the window (plus a GOP at most) is decoded."""
+    args: List[str] = []
+    if start and start > 0:
+        args += ["-ss", f"{start:.3f}"]
+    if duration and duration > 0:
+        args += ["-t", f"{duration:.3f}"]
+    return args + ["-i", src]
+
+
+def _gif_filters(width: int, fps: int, max_colors: int, diff: bool) -> Tuple[str, str, str, List[str]]:
+    """
+    (scale chain, palettegen, paletteuse, output args) shared by both GIF pipelines.
+
+    diff (encode_mode "diff") suits mostly static content such as UI recordings:
+    mpdecimate drops frames that barely change and the GIF keeps variable frame timing,
+    the palette is built from changed pixels only, and each frame stores just the
+    rectangle that changed, with unchanged pixels inside it transparent.
+    """
+    chain = f"fps={fps},scale={width}:-1:flags=lanczos"
+    if not diff:
+        return (
+            chain,
+            f"palettegen=stats_mode=full:reserve_transparent=0:max_colors={max_colors}",
+            "paletteuse=new=1:dither=sierra2_4a",
+            ["-gifflags", "-offsetting"],
+        )
+    return (
+        chain + ",mpdecimate",
+        f"palettegen=stats_mode=diff:reserve_transparent=1:max_colors={max_colors}",
+        "paletteuse=dither=sierra2_4a:diff_mode=rectangle",
+        ["-gifflags", "+offsetting+transdiff", "-fps_mode", "vfr"],
+    )
+
+
+def _spread_starts(duration: float, windows: int, window_sec: float) -> List[float]:
+    """Start times of `windows` windows of window_sec, centred on equal slices of duration."""
+    return [max(0.0, duration * (i + 0.5) / windows - window_sec / 2) for i in range(windows)]
+
+
+def _palette_windows(
+    span: Optional[float], palette_sample_sec: Optional[float], palette_windows: int,
+) -> List[Tuple[float, float]]:
+    """
+    (offset, length) of the palette sample windows for an encode of `span` seconds:
+    palette_sample_sec split into palette_windows windows spread across it. Empty when
+    the head of the clip is sampled instead (one window, no sample limit, unknown span,
+    or a span no longer than the sample).
+    """
+    if palette_windows <= 1 or not palette_sample_sec or not span or span <= palette_sample_sec:
+        return []
+    length = palette_sample_sec / palette_windows
+    return [(offset, length) for offset in _spread_starts(span, palette_windows, length)]
+
+
+def _palette_samples(
+    src: str,
+    start: Optional[float],
+    windows: List[Tuple[float, float]],
+    chain: str,
+    tmpdir: str,
+    on_progress: Optional[ProgressCallback] = None,
+    cancel_event: Optional[threading.Event] = None,
+    metrics: Optional[ConversionMetrics] = None,
+) -> Tuple[List[str], Optional[str]]:
+    """
+    Decode each palette window into a small lossless RGB clip (FFV1) at output size and
+    return ([paths], None), or ([], error). -noaccurate_seek starts a window at the keyframe
+    before its offset, so only the window itself is decoded. The windows are decoded one
+    after another: as inputs of one ffmpeg run every source decoder would be alive at once.
+    Converting to RGB here, with the source's colour metadata at hand, keeps the palette's
+    colours identical to the ones paletteuse sees.
+    """
+    paths: List[str] = []
+    for i, (offset, length) in enumerate(windows):
+        path = os.path.join(tmpdir, f"palette_sample{i}.mkv")
+        cmd = [
             "ffmpeg", "-v", "error", "-stats",
             "-y",
+            "-noaccurate_seek", "-ss", f"{(start or 0) + offset:.3f}", "-t", f"{length:.3f}", "-i", src,
+            # The keyframe lead-in keeps negative timestamps, which the muxer would drop
+            "-vf", f"setpts=PTS-STARTPTS,{chain},format=bgra",
+            "-an", "-c:v", "ffv1",
+            path,
         ]
-        # Optionally limit palette sampling time for speed
-        if palette_sample_sec and palette_sample_sec > 0:
-            palette_cmd += ["-t", str(palette_sample_sec)]
+        res = _run_ffmpeg(
+            cmd, _scaled(on_progress, i / len(windows), (i + 1) / len(windows)), length, "palette",
+            cancel_event, metrics,
+        )
+        if res.returncode != 0 or not os.path.exists(path):
+            return [], f"Palette sampling failed: {res.stdout.strip()}"
+        paths.append(path)
+    return paths, None
+
+
+def _concat_inputs(first_input: int, count: int) -> str:
+    """Filter chain joining inputs first_input.. (palette samples) into one stream."""
+    return "".join(f"[{first_input + i}:v]" for i in range(count)) + f"concat=n={count}:v=1:a=0"
+
+
+def _gif_header_end(data: bytes) -> int:
+    """Offset just past the GIF header, logical screen descriptor and global colour table
+    (0 if data is not a GIF)."""
+    if data[:3] != b"GIF" or len(data) < 13:
+        return 0
+    return 13 + ((3 << ((data[10] & 7) + 1)) if data[10] & 0x80 else 0)
+
+
+def _gif_blocks(data: bytes) -> Iterator[Tuple[int, int]]:
+    """(start, end) of each extension and image block of a GIF, up to the trailer."""
+
+    def skip_sub_blocks(pos: int) -> int:
+        while pos < len(data) and data[pos]:
+            pos += data[pos] + 1
+        return pos + 1
+
+    pos = _gif_header_end(data)
+    while 0 < pos < len(data):
+        block = data[pos]
+        if block == 0x21:  # extension
+            end = skip_sub_blocks(pos + 2)
+        elif block == 0x2C:  # image descriptor
+            flags = data[pos + 9]
+            end = pos + 10 + ((3 << ((flags & 7) + 1)) if flags & 0x80 else 0)
+            end = skip_sub_blocks(end + 1)  # after the LZW minimum code size
+        else:  # trailer (or anything unexpected)
+            return
+        yield pos, end
+        pos = end
+
+
+def _extend_gif_tail(path: str, total_sec: float) -> None:
+    """
+    mpdecimate drops a static tail together with its display time (with variable frame
+    timing a frame lasts until the next one, and there is none), so a "diff" GIF would end
+    early. Stretch the last frame's delay, in place, until the frames cover total_sec.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    last_delay_at, total_cs = None, 0
+    for pos, end in _gif_blocks(data):
+        if data[pos] == 0x21 and data[pos + 1] == 0xF9 and pos + 6 <= end:  # graphic control: delay at +4
+            last_delay_at = pos + 4
+            total_cs += struct.unpack_from("<H", data, last_delay_at)[0]
+    missing = int(round(total_sec * 100)) - total_cs
+    if last_delay_at is None or missing <= 0:
+        return
+    delay = struct.unpack_from("<H", data, last_delay_at)[0]
+    with open(path, "r+b") as f:
+        f.seek(last_delay_at)
+        f.write(struct.pack("<H", min(delay + missing, 0xFFFF)))
+
+
+# (start, end) in seconds of the source; end None runs to the end of the clip
+TimeRange = Tuple[float, Optional[float]]
+
+
+def _parse_time(text: str) -> float:
+    """Seconds from '75', '75.5', '1:15' or '0:01:15.5'."""
+    parts = text.strip().split(":")
+    if len(parts) > 3 or not all(p.strip() for p in parts):
+        raise ValueError(f"bad time {text.strip()!r}")
+    try:
+        values = [float(p) for p in parts]
+    except ValueError:
+        raise ValueError(f"bad time {text.strip()!r}") from None
+    seconds = 0.0
+    for value in values:
+        seconds = seconds * 60 + value
+    return seconds
+
+
+def parse_time_ranges(spec: str) -> List[TimeRange]:
+    """
+    Time ranges like '0:05-0:10, 1:00-1:05' (seconds or [h:]m:s). An empty start means 0
+    and an empty end runs to the end of the clip ('30-'). Raises ValueError.
+    """
+    ranges: List[TimeRange] = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        start_text, sep, end_text = part.partition("-")
+        if not sep:
+            raise ValueError(f"expected START-END, got {part.strip()!r}")
+        start = _parse_time(start_text) if start_text.strip() else 0.0
+        end = _parse_time(end_text) if end_text.strip() else None
+        if end is not None and end <= start:
+            raise ValueError(f"range {part.strip()!r} ends before it starts")
+        ranges.append((start, end))
+    if not ranges:
+        raise ValueError("no time range given")
+    return ranges
+
+
+def format_time_ranges(ranges: Sequence[TimeRange]) -> str:
+    """Inverse of parse_time_ranges, e.g. '0:05-0:10, 1:00-'."""
+    def fmt(sec: float) -> str:
+        m, s = divmod(sec, 60)
+        return f"{int(m)}:{s:0{5 if s % 1 else 2}.{2 if s % 1 else 0}f}"
+
+    return ", ".join(f"{fmt(start)}-{fmt(end) if end is not None else ''}" for start, end in ranges)
+
+
+def _clip_ranges(ranges: Sequence[TimeRange], duration: Optional[float]) -> List[Tuple[float, float]]:
+    """(start, length) per range, cut to the clip's duration; ranges past its end are dropped."""
+    spans = []
+    for start, end in ranges:
+        if start < 0 or (end is not None and end <= start):
+            raise ValueError(f"Invalid time range: {start}-{end}")
+        if duration:
+            if start >= duration:
+                continue
+            end = duration if end is None else min(end, duration)
+        elif end is None:
+            raise RuntimeError("The clip's duration is unknown, so a time range needs an end.")
+        spans.append((start, end - start))
+    if not spans:
+        raise RuntimeError(f"The selected time ranges are outside the clip ({duration:.1f}s long).")
+    return spans
+
+
+def selected_duration(ranges: Optional[Sequence[TimeRange]], duration: Optional[float]) -> Optional[float]:
+    """Seconds that converting `ranges` of a clip of `duration` covers (the whole clip without ranges)."""
+    if not ranges:
+        return duration
+    try:
+        return sum(length for _, length in _clip_ranges(ranges, duration))
+    except (ValueError, RuntimeError):
+        return duration
+
+
+def _join_gifs(parts: Sequence[str], dst: str) -> None:
+    """
+    Concatenate the frames of GIFs of the same size into dst without re-encoding: the
+    first part's header, screen descriptor and loop extension, then every part's frames.
+    Frames of a part whose global colour table differs from the first get it as a local
+    colour table, so each frame keeps exactly the colours it was encoded with.
+    """
+    with open(dst, "wb") as out:
+        head = b""
+        for i, part in enumerate(parts):
+            with open(part, "rb") as f:
+                data = f.read()
+            header_end = _gif_header_end(data)
+            if not header_end:
+                raise RuntimeError(f"Not a GIF: {part}")
+            table = data[13:header_end]
+            if i == 0:
+                head = table
+                out.write(data[:header_end])
+            for pos, end in _gif_blocks(data):
+                block = data[pos:end]
+                if block[0] == 0x21 and block[1] == 0xFF and i:  # application extension (loop count)
+                    continue
+                if block[0] == 0x2C and table != head and not block[9] & 0x80:
+                    block = block[:9] + bytes([block[9] | 0x80 | (data[10] & 7)]) + table + block[10:]
+                out.write(block)
+        out.write(b"\x3b")  # trailer
+
+
+def _chunk_spans(span: float, chunk_sec: float, fps: int) -> List[Tuple[float, Optional[float]]]:
+    """
+    (offset, length) of the segments a chunked encode splits `span` seconds into: about
+    chunk_sec each, with boundaries on the output frame grid so every frame lands in
+    exactly one segment. The last one runs to the end (length None). Depends only on the
+    arguments, never on the worker count, so the output is the same on every machine.
+    """
+    count = max(1, int(round(span / chunk_sec)))
+    frames = max(1, int(round(span / count * fps)))
+    return [(i * frames / fps, frames / fps if i < count - 1 else None) for i in range(count)]
+
+
+def _build_palette(
+    src: str,
+    palette_path: str,
+    chain: str,
+    palettegen: str,
+    windows: List[Tuple[float, float]],
+    palette_sample_sec: Optional[float],
+    start: Optional[float],
+    duration: Optional[float],
+    total_sec: Optional[float],
+    tmpdir: str,
+    on_progress: Optional[ProgressCallback] = None,
+    cancel_event: Optional[threading.Event] = None,
+    metrics: Optional[ConversionMetrics] = None,
+) -> Optional[str]:
+    """Write the palette PNG for an encode (from the palette windows, else the head of the
+    clip); progress runs 0..1 over sampling and palettegen. Returns an error message or None."""
+    palette_cmd = [
+        "ffmpeg", "-v", "error", "-stats",
+        "-y",
+    ]
+    # Optionally limit palette sampling time for speed
+    pal_duration = duration
+    if palette_sample_sec and palette_sample_sec > 0:
+        pal_duration = min(palette_sample_sec, duration) if duration else palette_sample_sec
+    if windows:
+        samples, err = _palette_samples(
+            src, start, windows, chain, tmpdir, _scaled(on_progress, 0.0, 0.75), cancel_event, metrics,
+        )
+        if not samples:
+            return err
+        for path in samples:
+            palette_cmd += ["-i", path]
+        palette_cmd += ["-filter_complex", f"{_concat_inputs(0, len(samples))},{palettegen}", palette_path]
+    else:
+        palette_cmd += _input_args(src, start, pal_duration)
         palette_cmd += [
-            "-i", src,
             "-vf",
-            f"fps={fps},scale={width}:-1:flags=lanczos,palettegen=stats_mode=full:reserve_transparent=0:max_colors={max_colors}",
+            f"{chain},{palettegen}",
             palette_path,
         ]
-        _log(logger, f"Generating palette (fps={fps}, width={width}, colors={max_colors})...")
-        pal = subprocess.run(palette_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-        if pal.returncode != 0 or not os.path.exists(palette_path):
-            return False, f"Palette generation failed: {pal.stdout.strip()}"
+    pal = _run_ffmpeg(
+        palette_cmd, _scaled(on_progress, 0.75 if windows else 0.0, 1.0),
+        palette_sample_sec if windows else (pal_duration or total_sec), "palette", cancel_event, metrics,
+    )
+    if pal.returncode != 0 or not os.path.exists(palette_path):
+        return f"Palette generation failed: {pal.stdout.strip()}"
+    return None
+
+
+def _encode_two_pass(
+    src: str,
+    dst: str,
+    width: int,
+    fps: int,
+    max_colors: int,
+    palette_sample_sec: Optional[float],
+    logger: Optional[Callable[[str], None]],
+    start: Optional[float] = None,
+    duration: Optional[float] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    total_sec: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
+    metrics: Optional[ConversionMetrics] = None,
+    diff: bool = False,
+    palette_windows: int = 1,
+) -> Tuple[bool, Optional[str]]:
+    """Palette to a temp PNG (from the head of the clip, or from palette_windows windows
+    spread across it), then a second decode of the source for paletteuse."""
+    chain, palettegen, paletteuse, out_args = _gif_filters(width, fps, max_colors, diff)
+    windows = _palette_windows(duration or total_sec, palette_sample_sec, palette_windows)
+    # Create a temp palette path
+    with tempfile.TemporaryDirectory() as tmpdir:
+        palette_path = os.path.join(tmpdir, "palette.png")
+
+        # 1) Generate palette
+        where = f", from {len(windows)} windows" if windows else ""
+        _log(logger, f"Generating palette (fps={fps}, width={width}, colors={max_colors}{where})...")
+        err = _build_palette(
+            src, palette_path, chain, palettegen, windows, palette_sample_sec, start, duration, total_sec, tmpdir,
+            _scaled(on_progress, 0.0, 0.2), cancel_event, metrics,
+        )
+        if err:
+            return False, err
 
         # 2) Use palette to create gif
         # Use sierra2_4a dithering for good perceptual quality
         gif_cmd = [
             "ffmpeg", "-v", "error", "-stats",
             "-y",
-            "-i", src,
+            *_input_args(src, start, duration),
             "-i", palette_path,
             "-filter_complex",
-            f"fps={fps},scale={width}:-1:flags=lanczos[x];[x][1:v]paletteuse=new=1:dither=sierra2_4a",
-            "-gifflags", "-offsetting",
+            f"{chain}[x];[x][1:v]{paletteuse}",
+            *out_args,
             "-loop", "0",
             dst,
         ]
         _log(logger, "Encoding GIF...")
-        enc = subprocess.run(gif_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        enc = _run_ffmpeg(gif_cmd, _scaled(on_progress, 0.2, 1.0), total_sec, cancel_event=cancel_event, metrics=metrics)
         if enc.returncode != 0:
             return False, f"GIF encoding failed: {enc.stdout.strip()}"
 
     return True, None
 
 
-def _probe_video(input_path: str) -> Tuple[Optional[int], Optional[int], Optional[float], Optional[float]]:
-    """Return (width, height, fps, duration) if available, else Nones."""
-    try:
+def _encode_single_pass(
+    src: str,
+    dst: str,
+    width: int,
+    fps: int,
+    max_colors: int,
+    palette_sample_sec: Optional[float],
+    logger: Optional[Callable[[str], None]],
+    start: Optional[float] = None,
+    duration: Optional[float] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    total_sec: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
+    metrics: Optional[ConversionMetrics] = None,
+    diff: bool = False,
+    palette_windows: int = 1,
+) -> Tuple[bool, Optional[str]]:
+    """
+    Decode and scale the source once; split the stream into palettegen and paletteuse
+    inside one filter graph, so no palette file is written.
+
+    The palette branch is trimmed to palette_sample_sec (same sampling as two-pass).
+    That also bounds memory: split only buffers frames for paletteuse until the palette
+    exists, i.e. the sampled seconds, not the whole clip.
+
+    With palette_windows > 1 the palette comes from that many short windows spread across
+    the clip instead (_palette_samples, decoded first); they join the graph as extra
+    inputs, and paletteuse buffers the main stream until they are read.
+    """
+    chain, palettegen, paletteuse, out_args = _gif_filters(width, fps, max_colors, diff)
+    windows = _palette_windows(duration or total_sec, palette_sample_sec, palette_windows)
+    with tempfile.TemporaryDirectory() if windows else nullcontext() as tmpdir:
+        sample_inputs: List[str] = []
+        if windows:
+            samples, err = _palette_samples(
+                src, start, windows, chain, tmpdir, _scaled(on_progress, 0.0, 0.15), cancel_event, metrics,
+            )
+            if not samples:
+                return False, err
+            for path in samples:
+                sample_inputs += ["-i", path]
+            on_progress = _scaled(on_progress, 0.15, 1.0)
+            graph = (
+                f"[0:v]{chain}[b];"
+                f"{_concat_inputs(1, len(samples))},{palettegen}[p];"
+                f"[b][p]{paletteuse}"
+            )
+        else:
+            pal_branch = "[a]"
+            if palette_sample_sec and palette_sample_sec > 0:
+                pal_branch = f"[a]trim=duration={palette_sample_sec},"
+            graph = (
+                f"[0:v]{chain},split[a][b];"
+                f"{pal_branch}{palettegen}[p];"
+                f"[b][p]{paletteuse}"
+            )
         cmd = [
-            "ffprobe", "-v", "error",
-            "-select_streams", "v:0",
-            "-show_entries", "stream=width,height,r_frame_rate,format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            input_path,
+            "ffmpeg", "-v", "error", "-stats",
+            "-y",
+            *_input_args(src, start, duration),
+            *sample_inputs,
+            "-filter_complex", graph,
+            *out_args,
+            "-loop", "0",
+            dst,
         ]
-        out = subprocess.check_output(cmd, text=True, stderr=subprocess.STDOUT)
-        lines = [l.strip() for l in out.strip().splitlines() if l.strip()]
-        # Expecting: width, height, r_frame_rate, duration (order may vary across ffprobe versions)
-        w = h = None
-        fps = None
-        dur = None
-        # Heuristically parse by looking for non-fraction ints for width/height, fraction for fps, float for duration
-        for l in lines:
-            if "/" in l and fps is None:
-                try:
-                    num, den = l.split("/", 1)
-                    num = float(num); den = float(den) if float(den) != 0 else 1.0
-                    fps = num / den if den else None
-                    continue
-                except Exception:
-                    pass
-            if "." in l and dur is None:
-                try:
-                    dur = float(l)
-                    continue
-                except Exception:
-                    pass
-            if w is None:
-                try:
-                    w = int(l)
-                    continue
-                except Exception:
-                    pass
-            if h is None:
+        where = f", palette from {len(windows)} windows" if windows else ""
+        _log(logger, f"Encoding GIF in one pass (fps={fps}, width={width}, colors={max_colors}{where})...")
+        enc = _run_ffmpeg(cmd, on_progress, total_sec, cancel_event=cancel_event, metrics=metrics)
+    if enc.returncode != 0:
+        return False, f"GIF encoding failed: {enc.stdout.strip()}"
+    return True, None
+
+
+def _encode_chunked(
+    src: str,
+    dst: str,
+    width: int,
+    fps: int,
+    max_colors: int,
+    palette_sample_sec: Optional[float],
+    logger: Optional[Callable[[str], None]],
+    start: Optional[float] = None,
+    duration: Optional[float] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    total_sec: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
+    metrics: Optional[ConversionMetrics] = None,
+    palette_windows: int = 1,
+    chunk_sec: float = 30.0,
+    chunk_workers: int = 0,
+) -> Tuple[bool, Optional[str]]:
+    """
+    One palette for the whole span (as in two-pass), then the span cut into chunk_sec
+    segments (_chunk_spans) that are encoded against it by up to chunk_workers ffmpeg
+    processes at once (0: one per CPU core) and joined frame by frame (_join_gifs).
+    paletteuse dithers each frame on its own, so the frames are the ones a single process
+    would write; only each segment's first frame is stored whole.
+    """
+    span = duration or total_sec
+    chain, palettegen, paletteuse, out_args = _gif_filters(width, fps, max_colors, False)
+    windows = _palette_windows(span, palette_sample_sec, palette_windows)
+    segments = _chunk_spans(span, chunk_sec, fps)
+    workers = min(len(segments), chunk_workers or os.cpu_count() or 1)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        palette_path = os.path.join(tmpdir, "palette.png")
+        where = f", from {len(windows)} windows" if windows else ""
+        _log(logger, f"Generating palette (fps={fps}, width={width}, colors={max_colors}{where})...")
+        err = _build_palette(
+            src, palette_path, chain, palettegen, windows, palette_sample_sec, start, duration, span, tmpdir,
+            _scaled(on_progress, 0.0, 0.1), cancel_event, metrics,
+        )
+        if err:
+            return False, err
+
+        _log(logger, f"Encoding GIF in {len(segments)} chunks, {workers} at a time...")
+        parts = [os.path.join(tmpdir, f"chunk{i}.gif") for i in range(len(segments))]
+        lengths = [length or span - offset for offset, length in segments]
+        done_sec = [0.0] * len(segments)
+        lock = threading.Lock()
+        encode_progress = _scaled(on_progress, 0.1, 1.0)
+        # One event stops every chunk: set on cancel or as soon as one chunk fails
+        stop = threading.Event()
+
+        def encode_chunk(i: int) -> Optional[str]:
+            offset, length = segments[i]
+
+            def report(frac: float, info: dict) -> None:
+                with lock:
+                    done_sec[i] = lengths[i] * min(1.0, frac)
+                    total = sum(done_sec) / span
+                encode_progress(total, info)
+
+            cmd = [
+                "ffmpeg", "-v", "error", "-stats",
+                "-y",
+                *_input_args(src, (start or 0) + offset, length or (duration - offset if duration else None)),
+                "-i", palette_path,
+                "-filter_complex",
+                f"{chain}[x];[x][1:v]{paletteuse}",
+                *out_args,
+                "-loop", "0",
+                parts[i],
+            ]
+            res = _run_ffmpeg(cmd, report if encode_progress else None, lengths[i], cancel_event=stop)
+            if res.returncode != 0 or not os.path.exists(parts[i]):
+                return f"GIF encoding failed (chunk {i + 1}/{len(segments)}): {res.stdout.strip()}"
+            return None
+
+        errors: List[str] = []
+        with metrics.timer("encode") if metrics is not None else nullcontext():
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chunk") as pool:
+                pending = {pool.submit(encode_chunk, i) for i in range(len(segments))}
                 try:
-                    h = int(l)
-                    continue
-                except Exception:
-                    pass
-        return w, h, fps, dur
-    except Exception:
-        return None, None, None, None
+                    while pending:
+                        done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                        if cancel_event is not None and cancel_event.is_set():
+                            stop.set()
+                        for fut in done:
+                            try:
+                                error = fut.result()
+                            except ConversionCancelled:
+                                error = None  # stopped because another chunk failed or on cancel
+                            if error:
+                                errors.append(error)
+                                stop.set()
+                except BaseException:
+                    stop.set()
+                    raise
+            if cancel_event is not None and cancel_event.is_set():
+                raise ConversionCancelled("Cancelled")
+            if errors:
+                return False, errors[0]
+            _join_gifs(parts, dst)
+    return True, None
 
 
-def convert_mp4_to_gif(
+def _attempt_encode(
+    src: str,
+    dst: str,
+    width: int,
+    fps: int,
+    max_colors: int,
+    palette_sample_sec: Optional[float] = None,
+    logger: Optional[Callable[[str], None]] = None,
+    encode_mode: str = "single",
+    start: Optional[float] = None,
+    duration: Optional[float] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    total_sec: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
+    metrics: Optional[ConversionMetrics] = None,
+    palette_windows: int = 1,
+    chunk_sec: float = 30.0,
+    chunk_workers: int = 0,
+) -> Tuple[bool, Optional[str]]:
+    """
+    Run a single encode using palettegen/paletteuse pipeline for high-quality, web-optimized GIFs.
+
+    encode_mode:
+      - "single": one ffmpeg run, one decode (split -> palettegen/paletteuse). If it fails
+        (e.g. an older ffmpeg), the attempt is retried in two-pass mode.
+      - "two-pass": palette to a temp PNG, then a second full decode for paletteuse.
+      - "diff": like "single" (with the same two-pass fallback), using the frame-difference
+        pipeline of _gif_filters; much smaller output for mostly static content.
+      - "chunked": for long clips, segments of chunk_sec encoded in parallel (chunk_workers
+        processes, 0: one per core) against one palette and joined (_encode_chunked).
+        Spans shorter than two chunks, and failed chunked runs, are encoded as "single".
+    palette_sample_sec limits the seconds of video the palette is built from: the head of
+    the clip, or with palette_windows > 1 that many windows spread across the encoded span.
+    start/duration limit the encode to a window of the source (input-side seek).
+    on_progress(fraction, info) streams live progress; total_sec is the expected output
+    length (defaults to duration) used to turn ffmpeg's output time into a fraction.
+    Setting cancel_event stops the running ffmpeg and raises ConversionCancelled.
+    metrics (optional ConversionMetrics) receives "palette" and "encode" stage times.
+    Returns (success, error_message)
+    """
+    if encode_mode not in ENCODE_MODES:
+        raise ValueError(f"Unknown encode_mode: {encode_mode!r} (expected one of {ENCODE_MODES})")
+    # Ensure even width as some codecs/filters require this
+    width = _even(width)
+    total_sec = total_sec or duration
+
+    diff = encode_mode == "diff"
+    ok = False
+    span = duration or total_sec
+    if encode_mode == "chunked" and span and span >= 2 * chunk_sec:
+        ok, err = _encode_chunked(
+            src, dst, width, fps, max_colors, palette_sample_sec, logger, start, duration, on_progress, total_sec,
+            cancel_event, metrics, palette_windows, chunk_sec, chunk_workers,
+        )
+        if ok:
+            return ok, err
+        _log(logger, f"Chunked encode failed, retrying in one process: {err}")
+        if metrics is not None:
+            metrics.count("chunk_fallbacks")
+    if encode_mode != "two-pass":
+        ok, err = _encode_single_pass(
+            src, dst, width, fps, max_colors, palette_sample_sec, logger, start, duration, on_progress, total_sec,
+            cancel_event, metrics, diff, palette_windows,
+        )
+        if not ok:
+            _log(logger, f"Single-pass encode failed, retrying two-pass: {err}")
+            if metrics is not None:
+                metrics.count("two_pass_fallbacks")
+    if not ok:
+        ok, err = _encode_two_pass(
+            src, dst, width, fps, max_colors, palette_sample_sec, logger, start, duration, on_progress, total_sec,
+            cancel_event, metrics, diff, palette_windows,
+        )
+    if ok and diff and total_sec:
+        _extend_gif_tail(dst, total_sec)
+    return ok, err
+
+
+
+# Animated outputs for video sources: format -> file extension
+VIDEO_OUTPUT_FORMATS = {"gif": ".gif", "webp": ".webp", "apng": ".png"}
+
+# Per-format setting searched besides width and fps, best first: GIF palette colours,
+# WebP (libwebp_anim) quality; APNG is lossless and has none.
+_FORMAT_LEVELS = {
+    "gif": (256, 192, 160, 128, 96, 64),
+    "webp": (90, 75, 60, 50, 40),
+    "apng": (0,),
+}
+# Relative WebP bytes by quality (q75 = 1.0), measured on 480 px / 12 fps footage
+_WEBP_QUALITY_BYTES = {90: 1.62, 75: 1.0, 60: 0.88, 50: 0.8, 40: 0.72}
+# Output bytes grow with (width / ref) ** exponent; WebP's inter-frame coding grows slower than area
+_WIDTH_EXPONENT = {"gif": 2.0, "webp": 1.3, "apng": 2.0}
+_LEVEL_NAMES = {"gif": "colors", "webp": "quality"}
+
+
+def _encode_webp(
+    src: str,
+    dst: str,
+    width: int,
+    fps: int,
+    quality: int,
+    logger: Optional[Callable[[str], None]] = None,
+    start: Optional[float] = None,
+    duration: Optional[float] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    total_sec: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
+    metrics: Optional[ConversionMetrics] = None,
+) -> Tuple[bool, Optional[str]]:
+    """Lossy animated WebP through libwebp_anim, looping forever."""
+    cmd = [
+        "ffmpeg", "-v", "error", "-stats",
+        "-y",
+        *_input_args(src, start, duration),
+        "-vf", f"fps={fps},scale={width}:-2:flags=lanczos",
+        "-an",
+        "-c:v", "libwebp_anim", "-lossless", "0", "-quality", str(quality),
+        "-loop", "0",
+        dst,
+    ]
+    _log(logger, f"Encoding WebP (fps={fps}, width={width}, quality={quality})...")
+    enc = _run_ffmpeg(cmd, on_progress, total_sec or duration, cancel_event=cancel_event, metrics=metrics)
+    if enc.returncode != 0:
+        return False, f"WebP encoding failed: {enc.stdout.strip()}"
+    return True, None
+
+
+def _encode_apng(
+    src: str,
+    dst: str,
+    width: int,
+    fps: int,
+    logger: Optional[Callable[[str], None]] = None,
+    start: Optional[float] = None,
+    duration: Optional[float] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    total_sec: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
+    metrics: Optional[ConversionMetrics] = None,
+) -> Tuple[bool, Optional[str]]:
+    """Lossless APNG, looping forever."""
+    cmd = [
+        "ffmpeg", "-v", "error", "-stats",
+        "-y",
+        *_input_args(src, start, duration),
+        "-vf", f"fps={fps},scale={width}:-2:flags=lanczos",
+        "-an",
+        "-c:v", "apng", "-pred", "mixed",
+        "-plays", "0", "-f", "apng",
+        dst,
+    ]
+    _log(logger, f"Encoding APNG (fps={fps}, width={width})...")
+    enc = _run_ffmpeg(cmd, on_progress, total_sec or duration, cancel_event=cancel_event, metrics=metrics)
+    if enc.returncode != 0:
+        return False, f"APNG encoding failed: {enc.stdout.strip()}"
+    return True, None
+
+
+def _encode_format(
+    fmt: str,
+    src: str,
+    dst: str,
+    width: int,
+    fps: int,
+    level: int,
+    palette_sample_sec: Optional[float] = None,
+    logger: Optional[Callable[[str], None]] = None,
+    encode_mode: str = "single",
+    start: Optional[float] = None,
+    duration: Optional[float] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    total_sec: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
+    metrics: Optional[ConversionMetrics] = None,
+    palette_windows: int = 1,
+    chunk_sec: float = 30.0,
+    chunk_workers: int = 0,
+) -> Tuple[bool, Optional[str]]:
+    """One encode in a VIDEO_OUTPUT_FORMATS format; level is its _FORMAT_LEVELS setting.
+    Arguments and result as for _attempt_encode (palette and encode_mode apply to GIF only)."""
+    if fmt == "gif":
+        return _attempt_encode(
+            src, dst, width, fps, level, palette_sample_sec, logger, encode_mode, start, duration, on_progress,
+            total_sec, cancel_event, metrics, palette_windows, chunk_sec, chunk_workers,
+        )
+    if fmt == "webp":
+        return _encode_webp(
+            src, dst, _even(width), fps, level, logger, start, duration, on_progress, total_sec, cancel_event, metrics,
+        )
+    return _encode_apng(src, dst, _even(width), fps, logger, start, duration, on_progress, total_sec, cancel_event, metrics)
+
+
+def _describe_params(fmt: str, width: int, fps: int, level: int) -> str:
+    text = f"width={width}, fps={fps}"
+    return text + f", {_LEVEL_NAMES[fmt]}={level}" if fmt in _LEVEL_NAMES else text
+
+
+def _format_score(fmt: str, width: int, fps: float, level: int) -> float:
+    """
+    _quality_score across formats. Colour fidelity is expressed as an equivalent GIF
+    palette size: WebP q50 counts as 256 colours and doubles every 25 quality points,
+    lossless APNG as 2048. Rough, but it ranks resolution and frame rate first, as GIF does.
+    """
+    if fmt == "webp":
+        level = 256 * 2 ** ((level - 50) / 25)
+    elif fmt == "apng":
+        level = 2048
+    return _quality_score(width, fps, level)
+
+
+def _extrapolate_bpf(fmt: str, bpf: float, ref: Tuple[int, int, int], width: int, level: int) -> float:
+    """Bytes per frame at (width, level), from bpf measured at ref = (width, fps, level)."""
+    w_ref, _, level_ref = ref
+    scaled = bpf * (width / w_ref) ** _WIDTH_EXPONENT[fmt]
+    if fmt == "gif":
+        return scaled * (math.log2(level) / math.log2(level_ref))
+    if fmt == "webp":
+        return scaled * _WEBP_QUALITY_BYTES.get(level, 1.0) / _WEBP_QUALITY_BYTES.get(level_ref, 1.0)
+    return scaled
+
+
+def _fallback_level(fmt: str, level: int) -> int:
+    """A clearly cheaper setting for a fallback attempt."""
+    if fmt == "gif":
+        return max(64, level // 2)
+    lower = [lv for lv in _FORMAT_LEVELS[fmt] if lv < level]
+    return lower[min(1, len(lower) - 1)] if lower else level
+
+
+def _quality_score(width: int, fps: float, colors: int) -> float:
+    """Rough perceptual ranking of GIF settings: width matters most, then fps, then palette size."""
+    return 2.0 * math.log(width) + math.log(max(fps, 1)) + 0.5 * math.log(colors)
+
+
+def _model_params(
+    size_model,
+    src_width: Optional[int],
+    src_height: Optional[int],
+    src_bytes: Optional[int],
+    duration: float,
+    widths: Sequence[int],
+    fps_candidates: Sequence[int],
+    color_candidates: Sequence[int],
+    max_size_mb: float,
+    diff: bool = False,
+) -> Optional[Tuple[int, int, int]]:
+    """Highest-quality (width, fps, colors) from the grid that the size model expects to fit the cap.
+    diff selects the model fitted on "diff" encodes."""
+    cap = max_size_mb * 1024 * 1024
+    usable = [w for w in widths if not src_width or w <= src_width] or [min(widths)]
+    best = None
+    for width in usable:
+        for fps in fps_candidates:
+            for colors in color_candidates:
+                pred = size_model.predict_bytes(
+                    src_width, src_height, src_bytes, duration, width, fps, colors, diff=diff,
+                )
+                if pred is None:
+                    return None  # not enough history yet
+                if pred <= cap:
+                    score = _quality_score(width, fps, colors)
+                    if best is None or score > best[0]:
+                        best = (score, (width, fps, colors))
+    return best[1] if best else None
+
+
+class _DiskBudget:
+    """Process-wide byte reservations, so concurrent jobs share one intermediate budget."""
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._used = 0
+
+    def reserve(self, nbytes: int, limit: int, wait: bool = False,
+                cancel_event: Optional[threading.Event] = None) -> bool:
+        """
+        Reserve nbytes if they fit under limit. With wait, block until other jobs release
+        enough instead, so only a request larger than the whole limit returns False; a set
+        cancel_event raises ConversionCancelled while waiting.
+        """
+        with self._cond:
+            while self._used + nbytes > limit:
+                if not wait or nbytes > limit:
+                    return False
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ConversionCancelled("Cancelled")
+                self._cond.wait(timeout=0.25)  # wake up now and then to notice a cancel
+            self._used += nbytes
+            return True
+
+    def release(self, nbytes: int) -> None:
+        with self._cond:
+            self._used = max(0, self._used - nbytes)
+            self._cond.notify_all()
+
+
+_INTERMEDIATE_BUDGET = _DiskBudget()
+
+
+@contextmanager
+def _intermediate_source(
+    src: str,
+    enabled: bool,
+    width: int,
+    fps: int,
+    src_width: Optional[int],
+    src_height: Optional[int],
+    duration: float,
+    budget_mb: float,
+    workdir: Optional[str],
+    logger: Optional[Callable[[str], None]],
+    on_progress: Optional[ProgressCallback] = None,
+    cancel_event: Optional[threading.Event] = None,
+    metrics: Optional[ConversionMetrics] = None,
+    ranges: Optional[List[Tuple[float, float]]] = None,
+    required: bool = False,
+) -> Iterator[str]:
+    """
+    Yield the path encode attempts should read from.
+
+    When enabled, the source is decoded once into a lossless FFV1 intermediate at the
+    largest candidate width and fps, and that file is yielded instead. Every later
+    attempt (and probe window) then decodes cheap intra-only FFV1 frames instead of the
+    original, which is what dominates retry cost on high-bitrate HEVC inputs. FFV1 is
+    all-keyframe, so window seeks are exact too.
+
+    ranges ((start, length) pairs; duration is their total) limit it to those parts of the
+    source, joined in order. Each is decoded in its own run from an input-side seek, so the
+    rest of the source is never decoded.
+
+    The estimated size is reserved against a process-wide budget of budget_mb; if it does
+    not fit, or the real file outgrows it (`-fs`), the original source is used. With
+    `required` (several ranges, which only exist joined) the job instead waits for other
+    jobs to free the budget, and it is a RuntimeError only when the estimate alone exceeds
+    the budget or the real file outgrows it. The intermediate is always removed on exit.
+    """
+    if not enabled:
+        yield src
+        return
+    height = int(width * (src_height / src_width)) if src_width and src_height else width * 9 // 16
+    # yuv420p raw size; FFV1 rarely gets worse than ~60% of raw on real footage
+    estimate = int(width * height * 1.5 * fps * duration * 0.6)
+    limit = int(budget_mb * 1024 * 1024)
+    reserved = _INTERMEDIATE_BUDGET.reserve(estimate, limit)
+    if not reserved and required and estimate <= limit:
+        _log(logger, "Waiting for other files' intermediates to free the disk budget...")
+        reserved = _INTERMEDIATE_BUDGET.reserve(estimate, limit, wait=True, cancel_event=cancel_event)
+    if not reserved:
+        message = f"~{estimate / (1024 * 1024):.0f} MB exceeds the {budget_mb:.0f} MB budget"
+        if required:
+            raise RuntimeError(f"Cannot join the selected time ranges: {message}.")
+        _log(logger, f"Intermediate skipped: {message}.")
+        yield src
+        return
+    try:
+        with tempfile.TemporaryDirectory(prefix="fc-intermediate-", dir=workdir) as tmpdir:
+            inter = os.path.join(tmpdir, "intermediate.mkv")
+            segments = ranges or [(None, None)]
+            parts = [inter] if len(segments) == 1 else [
+                os.path.join(tmpdir, f"part{i}.mkv") for i in range(len(segments))
+            ]
+            _log(logger, f"Decoding once to intermediate (width={_even(width)}, fps={fps})...")
+            error = None
+            done = 0.0
+            for (start, length), part in zip(segments, parts):
+                share = (length or duration) / duration if duration else 1.0
+                part_limit = int(estimate * share) + 1
+                cmd = [
+                    "ffmpeg", "-v", "error", "-stats",
+                    "-y",
+                    *_input_args(src, start, length),
+                    "-an", "-sn",
+                    "-vf", f"fps={fps},scale={_even(width)}:-2:flags=lanczos",
+                    "-c:v", "ffv1", "-level", "3", "-g", "1",
+                    "-fs", str(part_limit),
+                    part,
+                ]
+                res = _run_ffmpeg(
+                    cmd, _scaled(on_progress, done, min(1.0, done + share)), length or duration, "intermediate",
+                    cancel_event, metrics,
+                )
+                done += share
+                # Failed or hit the -fs cap (truncated)
+                if res.returncode != 0 or not os.path.exists(part) or os.path.getsize(part) >= part_limit * 0.98:
+                    error = res.stdout.strip() if res.returncode != 0 else "larger than estimated"
+                    break
+            if error is None and len(parts) > 1:
+                # FFV1 is all-keyframe, so the parts join losslessly by stream copy
+                list_path = os.path.join(tmpdir, "parts.ffconcat")
+                with open(list_path, "w", encoding="utf-8") as f:
+                    f.write("ffconcat version 1.0\n" + "".join(f"file {os.path.basename(p)}\n" for p in parts))
+                res = _run_ffmpeg(
+                    ["ffmpeg", "-v", "error", "-y", "-f", "concat", "-i", list_path, "-c", "copy", inter],
+                    cancel_event=cancel_event, metrics=metrics, stage="intermediate",
+                )
+                if res.returncode != 0 or not os.path.exists(inter):
+                    error = res.stdout.strip()
+            if error is None:
+                yield inter
+            elif required:
+                raise RuntimeError(f"Could not decode the selected time ranges: {error}")
+            else:
+                _log(logger, "Intermediate unavailable; encoding from the original source.")
+                yield src
+    finally:
+        _INTERMEDIATE_BUDGET.release(estimate)
+
+
+# Approximate per-file GIF overhead (header, global palette, loop extension) in bytes,
+# kept out of per-frame estimates so short sample windows extrapolate cleanly.
+_GIF_OVERHEAD_BYTES = 1024
+
+
+def _sample_bytes_per_frame(
+    src: str,
+    duration: float,
+    width: int,
+    fps: int,
+    level: int,
+    windows: int,
+    window_sec: float,
+    encode_mode: str,
+    on_progress: Optional[ProgressCallback] = None,
+    cancel_event: Optional[threading.Event] = None,
+    fmt: str = "gif",
+    offset: float = 0.0,
+) -> Optional[float]:
+    """Encode `windows` short windows spread across the clip (the `duration` seconds from
+    `offset`) and return mean output bytes per frame."""
+    total_bytes = 0
+    total_frames = 0.0
+    starts = [offset + s for s in _spread_starts(duration, windows, window_sec)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for i in range(windows):
+            start = starts[i]
+            dst = os.path.join(tmpdir, f"sample{i}{VIDEO_OUTPUT_FORMATS[fmt]}")
+            ok, _ = _encode_format(
+                fmt, src, dst, width, fps, level,
+                palette_sample_sec=None,
+                encode_mode=encode_mode,
+                start=start,
+                duration=window_sec,
+                on_progress=_scaled(on_progress, i / windows, (i + 1) / windows),
+                cancel_event=cancel_event,
+            )
+            if not ok or not os.path.exists(dst):
+                return None
+            total_bytes += max(0, os.path.getsize(dst) - _GIF_OVERHEAD_BYTES)
+            total_frames += max(1.0, window_sec * fps)
+    return total_bytes / total_frames if total_frames else None
+
+
+def _choose_by_probe(
+    src: str,
+    duration: float,
+    start_params: Tuple[int, int, int],
+    widths: Sequence[int],
+    fps_candidates: Sequence[int],
+    color_candidates: Sequence[int],
+    max_size_mb: float,
+    encode_mode: str,
+    windows: int = 3,
+    window_sec: float = 1.0,
+    rounds: int = 2,
+    logger: Optional[Callable[[str], None]] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    cancel_event: Optional[threading.Event] = None,
+    fmt: str = "gif",
+    offset: float = 0.0,
+) -> Optional[Tuple[Tuple[int, int, int], int]]:
+    """
+    Pick the highest-quality grid point whose extrapolated full-length size fits the cap.
+    Returns ((width, fps, level), estimated bytes), or None if the probe encodes failed.
+    If nothing fits, the smallest measured point is returned (its estimate is over the cap).
+
+    Each round encodes the sample windows at the current choice and measures bytes per
+    frame. Other grid points are extrapolated from that measurement (bytes per frame scale
+    with pixel count and the format's level, see _extrapolate_bpf); the best one that
+    fits becomes the next choice. A second round re-measures at that choice if it moved,
+    so the estimate used for the decision always comes from a nearby setting.
+    color_candidates are the levels searched (GIF palette sizes by default).
+    The clip is the `duration` seconds of src from `offset`.
+    """
+    cap = max_size_mb * 1024 * 1024 * 0.95  # leave headroom for extrapolation error
+    current = start_params
+    measured = {}
+    rounds = max(1, rounds)
+
+    def estimate(params: Tuple[int, int, int], ref: Tuple[int, int, int]) -> int:
+        bpf = _extrapolate_bpf(fmt, measured[ref], ref, params[0], params[2])
+        return int(bpf * params[1] * duration + _GIF_OVERHEAD_BYTES)
+
+    for rnd in range(rounds):
+        if current not in measured:
+            w, f, c = current
+            suffix = "" if fmt == "gif" else f" ({fmt})"
+            _log(logger, f"Probe encode: {windows}x{window_sec:g}s windows at {_describe_params(fmt, w, f, c)}{suffix}")
+            bpf = _sample_bytes_per_frame(
+                src, duration, w, f, c, windows, window_sec, encode_mode,
+                on_progress=_scaled(on_progress, rnd / rounds, (rnd + 1) / rounds),
+                cancel_event=cancel_event,
+                fmt=fmt,
+                offset=offset,
+            )
+            if bpf is None:
+                return None
+            measured[current] = bpf
+            _log(logger, f"Probe estimate: {estimate(current, current) / (1024 * 1024):.2f} MB full length")
+        ref = current
+        best = None
+        for width in widths:
+            for fps in fps_candidates:
+                for colors in color_candidates:
+                    if estimate((width, fps, colors), ref) <= cap:
+                        score = _format_score(fmt, width, fps, colors)
+                        if best is None or score > best[0]:
+                            best = (score, (width, fps, colors))
+        if best is None:
+            smallest = min(measured, key=lambda p: estimate(p, p))
+            return smallest, estimate(smallest, smallest)
+        if best[1] == current:
+            break
+        current = best[1]
+    return current, estimate(current, current if current in measured else ref)
+
+
+def _race_attempts(
+    count: int,
+    run: Callable[[int, threading.Event], Optional[float]],
+    fits: Callable[[float], bool],
+    cancel_event: Optional[threading.Event] = None,
+) -> Dict[int, Optional[float]]:
+    """
+    Run attempts 0..count-1 (in decreasing quality) concurrently; run(n, stop) returns
+    the output size or None. As soon as an attempt fits and every better one has
+    finished without fitting, the worse ones are stopped through their events.
+    Setting cancel_event stops them all and raises ConversionCancelled.
+    Returns {attempt: size or None} for the attempts that ran to an end.
+    """
+    stops = [threading.Event() for _ in range(count)]
+    sizes: Dict[int, Optional[float]] = {}
+    with ThreadPoolExecutor(max_workers=count, thread_name_prefix="race") as pool:
+        futures = {pool.submit(run, n, stops[n]): n for n in range(count)}
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                if cancel_event is not None and cancel_event.is_set():
+                    for stop in stops:
+                        stop.set()
+                for fut in done:
+                    sizes[futures[fut]] = fut.result()
+                for n in range(count):
+                    if n not in sizes:
+                        break
+                    if sizes[n] is not None and fits(sizes[n]):
+                        for stop in stops[n + 1:]:
+                            stop.set()
+                        break
+        except BaseException:
+            for stop in stops:
+                stop.set()
+            raise
+    if cancel_event is not None and cancel_event.is_set():
+        raise ConversionCancelled("Cancelled")
+    return sizes
+
+
+@dataclass(frozen=True)
+class AnimationResult:
+    """What convert_video_animation wrote: the chosen format and its settings."""
+
+    path: str
+    format: str  # a VIDEO_OUTPUT_FORMATS key
+    width: int
+    fps: int
+    level: int  # GIF palette colours, WebP quality; 0 for APNG
+    bytes: int
+    fits: bool  # within max_size_mb
+
+
+def convert_video_animation(
     input_path: str,
     output_path: str,
+    formats: Sequence[str] = ("gif", "webp"),
     max_size_mb: float = 5.0,
     initial_width: int = 480,
     initial_fps: int = 12,
@@ -156,13 +1356,100 @@ def convert_mp4_to_gif(
     max_attempts: int = 3,
     palette_sample_sec: float = 6.0,
     logger: Optional[Callable[[str], None]] = None,
-) -> str:
+    encode_mode: str = "single",
+    size_model=None,
+    probe_encode: bool = False,
+    probe_windows: int = 3,
+    probe_window_sec: float = 1.0,
+    intermediate: bool = False,
+    intermediate_max_mb: float = 2048.0,
+    intermediate_dir: Optional[str] = None,
+    on_event: Optional[Callable[[str, dict], None]] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    cancel_event: Optional[threading.Event] = None,
+    race: bool = False,
+    metrics: Optional[ConversionMetrics] = None,
+    palette_windows: int = 4,
+    ranges: Optional[Sequence[TimeRange]] = None,
+    chunk_sec: float = 30.0,
+    chunk_workers: int = 0,
+) -> AnimationResult:
     """
-    Convert MP4 to GIF optimized for web. Iteratively compress to not exceed max_size_mb.
+    Convert a video to the animation format (out of `formats`, VIDEO_OUTPUT_FORMATS keys)
+    that gives the best quality within max_size_mb: GIF, lossy animated WebP or lossless
+    APNG. Iteratively compress to not exceed max_size_mb.
 
-    Returns the path to the generated GIF.
-    Raises RuntimeError on failure.
+    With more than one format, each one is probe-encoded (below; a clip shorter than twice
+    the sampled windows is encoded whole instead) and its best fitting settings are extrapolated. The
+    format whose settings score highest (_format_score: width, then fps, then colour
+    fidelity) is encoded, and output_path gets that format's extension. A "format" event
+    (format, width, fps, level, est_bytes, fits) is sent for each candidate.
+    GIF-only conversion (convert_mp4_to_gif) skips this step and keeps output_path as is.
+
+    The GIF palette is built from palette_sample_sec seconds of video: palette_windows
+    windows spread across the clip (input-side keyframe seeks, so only they are decoded),
+    which catches colours that appear late at about the cost of sampling the first seconds.
+    palette_windows=1 samples the head of the clip instead (the previous behaviour).
+
+    encode_mode selects the GIF pipeline per attempt: "single" (one decode, default),
+    "two-pass" (separate palette run, the previous behaviour), "diff" (frame-difference
+    encoding for mostly static content such as screen recordings; see _gif_filters) or
+    "chunked" (long clips: chunk_sec segments encoded by up to chunk_workers ffmpeg processes
+    at once, 0 meaning one per CPU core, against one shared palette and joined losslessly;
+    clips shorter than two chunks are encoded as "single"). The chunk layout depends only
+    on the clip and chunk_sec, so the output does not depend on the worker count.
+
+    size_model: optional size_model.SizeModel. Once it has enough history its prediction
+    seeds the first attempt (otherwise the duration buckets are used), and every encode
+    is recorded back into it. "diff" encodes are fitted separately from the others.
+
+    probe_encode: before the real encode, encode `probe_windows` short windows spread across
+    the clip, extrapolate the full-length size and pick the best settings that fit. Costs a
+    small fraction of a full encode and avoids most full-length retries on long clips.
+
+    intermediate: decode the source once into a lossless FFV1 file (at the largest candidate
+    width/fps) that all probes and attempts read from. intermediate_max_mb is the disk budget
+    shared by concurrent conversions; intermediate_dir defaults to the system temp folder.
+
+    ranges: optional (start, end) seconds (end None: to the end of the clip; see
+    parse_time_ranges) to convert instead of the whole clip. Ranges are cut to the clip's
+    duration, and the size prediction, probes and progress use the selected length. A
+    single range is read with input-side keyframe seeks, so the rest of the source is never
+    decoded; several are decoded one after another into a joined intermediate (as above,
+    within intermediate_max_mb) and played back to back.
+
+    Every attempt encodes to its own temp file; the best-quality result that fits the cap
+    (else the smallest one) is moved onto output_path at the end.
+
+    race: run the predicted attempt and its fallbacks at the same time instead of one
+    after another (use when cores are idle). Worse attempts are stopped as soon as a better
+    one is known to fit, so the worst case costs one encode of wall time instead of several.
+
+    on_event(name, fields): optional structured callback, called with "attempt"
+    (attempt, format, width, fps, colors or quality, predictor) before each encode, "size" (attempt, bytes,
+    limit_bytes, fits, seconds) after each successful one and "attempt_cancelled" (attempt)
+    when racing stops a losing attempt.
+
+    on_progress(fraction, info): optional live progress for the whole file, fed from
+    ffmpeg's -progress stream while it runs. fraction only ever increases (retries continue
+    from where the previous attempt left off); info carries stage, fps, speed and out_sec.
+
+    cancel_event: optional threading.Event. Setting it stops the running ffmpeg process
+    straight away, removes temp files (output_path is left untouched) and raises
+    ConversionCancelled.
+
+    metrics: optional metrics.ConversionMetrics that receives stage times (probe,
+    intermediate, probe_encode, palette, encode, size_check) and counters (attempts,
+    retries, cap_misses, bytes_in, bytes_out). Each timed stage is also reported as a
+    "stage" event (stage, seconds), and a timing summary is logged when the file is done.
+
+    Returns an AnimationResult.
+    Raises RuntimeError on failure (ConversionCancelled, a subclass, when cancelled).
     """
+    formats = tuple(dict.fromkeys(formats))
+    unknown = [f for f in formats if f not in VIDEO_OUTPUT_FORMATS]
+    if not formats or unknown:
+        raise ValueError(f"Unknown output format(s): {unknown} (expected some of {tuple(VIDEO_OUTPUT_FORMATS)})")
     if not os.path.isfile(input_path):
         raise RuntimeError(f"Input file not found: {input_path}")
 
@@ -182,7 +1469,19 @@ def convert_mp4_to_gif(
     pred_fps = initial_fps
     pred_colors = 128
 
-    w0, h0, fps0, dur = _probe_video(input_path)
+    stats = ConversionMetrics(on_stage=lambda stage, sec: _emit(on_event, "stage", stage=stage, seconds=round(sec, 4)))
+    with stats.timer("probe"):
+        info = probe_video(input_path)
+    w0 = info.width if info else None
+    h0 = info.height if info else None
+    dur = info.duration if info else None
+    spans: Optional[List[Tuple[float, float]]] = None
+    if ranges:
+        spans = _clip_ranges(ranges, dur)
+        full_dur = dur
+        dur = sum(length for _, length in spans)
+        _log(logger, f"Converting {format_time_ranges([(s, s + n) for s, n in spans])} ({dur:.1f}s"
+                     + (f" of {full_dur:.1f}s)." if full_dur else ")."))
     if dur is None:
         dur = 8.0  # assume short clip if unknown
 
@@ -224,56 +1523,260 @@ def convert_mp4_to_gif(
 
     color_candidates = [256, 192, 160, 128, 96, 64]
 
+    predictor = "heuristic"
+    try:
+        src_bytes: Optional[int] = os.path.getsize(input_path)
+    except OSError:
+        src_bytes = None
+    stats.count("bytes_in", src_bytes or 0)
+    # The model's bitrate feature: bytes of the selected part, not the whole file
+    model_bytes = src_bytes
+    if spans and src_bytes and info and info.duration:
+        model_bytes = int(src_bytes * dur / info.duration)
+    if size_model is not None:
+        try:
+            choice = _model_params(
+                size_model, w0, h0, model_bytes, dur, widths, fps_candidates, color_candidates, max_size_mb,
+                diff=encode_mode == "diff",
+            )
+        except Exception as e:
+            choice = None
+            _log(logger, f"Size model unavailable: {e}")
+        if choice:
+            pred_width, pred_fps, pred_colors = choice
+            predictor = "model"
+
+    progress = _FileProgress(on_progress)
+    grid_widths = [w for w in widths if not w0 or w <= w0] or [min(widths)]
     last_error = None
-    attempts_done = 0
+    # Each attempt writes its own temp file next to the output; the chosen one is moved
+    # into place at the end, so a failed or oversized later attempt never clobbers a
+    # better earlier result (nor the previous output_path when cancelled).
+    base, ext = os.path.splitext(output_path)
+    attempt_paths: List[str] = []
+    # Several ranges are only playable joined, so they always go through the intermediate
+    joined = spans is not None and len(spans) > 1
+    use_intermediate = intermediate or joined
+    try:
+        with _intermediate_source(
+            input_path, use_intermediate, max(grid_widths), max(fps_candidates), w0, h0, dur,
+            intermediate_max_mb, intermediate_dir, logger,
+            on_progress=progress.phase(0.3) if use_intermediate else None,
+            cancel_event=cancel_event, metrics=stats, ranges=spans, required=joined,
+        ) as encode_src:
+            # The intermediate holds just the selection; the source needs a seek to it
+            clip_start, clip_sec = (spans[0][0], dur) if spans and encode_src == input_path else (None, None)
+            fmt = formats[0]
+            # Start of the probe search per format: the GIF prediction's width and fps, the
+            # predicted palette size for GIF, the second-best level for the other formats
+            start_level = {
+                f: pred_colors if f == "gif" else _FORMAT_LEVELS[f][min(1, len(_FORMAT_LEVELS[f]) - 1)]
+                for f in formats
+            }
+            pred_level = start_level[fmt]
+            sampled_sec = probe_windows * probe_window_sec
+            # Probe encodes only pay off when a full encode is much longer than the samples;
+            # choosing between formats always needs them (a short clip is encoded whole)
+            if len(formats) > 1 or (probe_encode and dur >= 4 * sampled_sec):
+                windows, window_sec = (probe_windows, probe_window_sec) if dur >= 2 * sampled_sec else (1, dur)
+                probe_progress = progress.phase(min(0.5, 0.1 * len(formats)))
+                options = []
+                with stats.timer("probe_encode"):
+                    for i, cand in enumerate(formats):
+                        got = _choose_by_probe(
+                            encode_src, dur, (_even(pred_width), pred_fps, start_level[cand]),
+                            grid_widths, fps_candidates, color_candidates if cand == "gif" else _FORMAT_LEVELS[cand],
+                            max_size_mb, encode_mode, windows=windows, window_sec=window_sec, logger=logger,
+                            on_progress=_scaled(probe_progress, i / len(formats), (i + 1) / len(formats)),
+                            cancel_event=cancel_event, fmt=cand, offset=clip_start or 0.0,
+                        )
+                        if got is None:
+                            if len(formats) > 1:
+                                _log(logger, f"Probe encode failed for {cand}; not considered.")
+                            continue
+                        params, est = got
+                        fits = est <= max_size_mb * 1024 * 1024
+                        if len(formats) > 1:
+                            _log(logger, f"Candidate {cand}: {_describe_params(cand, *params)}, ~{est / (1024 * 1024):.2f} MB")
+                            _emit(on_event, "format", format=cand, width=params[0], fps=params[1], level=params[2],
+                                  est_bytes=est, fits=fits)
+                        # Best score among those that fit, else the smallest estimate
+                        options.append(((fits, _format_score(cand, *params) if fits else -est), cand, params))
+                if options:
+                    _, fmt, (pred_width, pred_fps, pred_level) = max(options, key=lambda o: o[0])
+                    predictor = "probe"
+            if len(formats) > 1:
+                ext = VIDEO_OUTPUT_FORMATS[fmt]
+                output_path = base + ext
+            suffix = "" if fmt == "gif" else f" ({fmt})"
+            _log(logger, f"Predicted ({predictor}): {_describe_params(fmt, pred_width, pred_fps, pred_level)}{suffix}")
 
-    def try_encode(width: int, fps: int, colors: int) -> Optional[float]:
-        nonlocal last_error, attempts_done
-        if attempts_done >= max_attempts:
-            return None
-        attempts_done += 1
-        _log(logger, f"Attempt: width={width}, fps={fps}, colors={colors}")
-        success, err = _attempt_encode(
-            src=input_path,
-            dst=output_path,
-            width=width,
-            fps=fps,
-            max_colors=colors,
-            palette_sample_sec=palette_sample_sec,
-            logger=logger,
-        )
-        if not success:
-            last_error = err
-            _log(logger, f"Encode failed: {err}")
-            return None
-        size_mb = _filesize_mb(output_path)
-        _log(logger, f"Result size: {size_mb:.2f} MB (limit {max_size_mb:.2f} MB)")
-        return size_mb
-
-    # Fast first attempt
-    if fast_first:
-        size_mb = try_encode(pred_width, pred_fps, pred_colors)
-        if size_mb is not None and size_mb <= max_size_mb:
-            _log(logger, "Success within size limit.")
-            return output_path
-
-    # Fallback attempts (at most max_attempts total)
-    # 1) Reduce fps then width, with colors min at 64
-    for (wf, ff, cf) in [
-        (int(pred_width * 0.85), max(6, pred_fps - 2), max(64, pred_colors // 2)),
-        (240, 6, 64),
-    ]:
-        size_mb = try_encode(max(240, _even(wf)), ff, cf)
-        if size_mb is not None and size_mb <= max_size_mb:
+            # Attempt plan in decreasing quality: the prediction (fast-first), then fallbacks
+            # reducing fps, width and colors (min 64) or quality, at most max_attempts in total
+            levels = color_candidates if fmt == "gif" else _FORMAT_LEVELS[fmt]
+            plan: List[Tuple[int, int, int]] = []
+            if fast_first:
+                plan.append((_even(pred_width), pred_fps, pred_level))
+            for (wf, ff, cf) in [
+                (int(pred_width * 0.85), max(6, pred_fps - 2), _fallback_level(fmt, pred_level)),
+                (240, 6, levels[-1]),
+            ]:
+                params = (max(240, _even(wf)), ff, cf)
+                if params not in plan:
+                    plan.append(params)
+            plan = plan[:max(1, max_attempts)]
+            attempt_paths.extend(f"{base}.attempt{n + 1}-{os.getpid()}{ext}" for n in range(len(plan)))
+            encode_progress = progress.phase(0.9)
+
+            def try_encode(n: int, stop: Optional[threading.Event]) -> Optional[float]:
+                nonlocal last_error
+                width, fps, level = plan[n]
+                label = predictor if n == 0 and fast_first else "fallback"
+                _log(logger, f"Attempt: {_describe_params(fmt, width, fps, level)}{suffix}")
+                level_field = {_LEVEL_NAMES[fmt]: level} if fmt in _LEVEL_NAMES else {}
+                _emit(on_event, "attempt", attempt=n + 1, format=fmt, width=width, fps=fps, **level_field,
+                      predictor=label)
+                stats.count("attempts")
+                if n:
+                    stats.count("retries")
+                t0 = time.perf_counter()
+                try:
+                    success, err = _encode_format(
+                        fmt,
+                        src=encode_src,
+                        dst=attempt_paths[n],
+                        width=width,
+                        fps=fps,
+                        level=level,
+                        palette_sample_sec=palette_sample_sec,
+                        palette_windows=palette_windows,
+                        chunk_sec=chunk_sec,
+                        chunk_workers=chunk_workers,
+                        logger=logger,
+                        encode_mode=encode_mode,
+                        start=clip_start,
+                        duration=clip_sec,
+                        on_progress=encode_progress,
+                        total_sec=dur,
+                        cancel_event=stop,
+                        metrics=stats,
+                    )
+                except ConversionCancelled:
+                    if stop is cancel_event or (cancel_event is not None and cancel_event.is_set()):
+                        raise
+                    # A racing attempt lost: a better one already fits
+                    _log(logger, f"Attempt {n + 1} stopped: a better result already fits.")
+                    _emit(on_event, "attempt_cancelled", attempt=n + 1)
+                    return None
+                if not success:
+                    last_error = err
+                    _log(logger, f"Encode failed: {err}")
+                    return None
+                seconds = time.perf_counter() - t0
+                with stats.timer("size_check"):
+                    size_mb = _filesize_mb(attempt_paths[n])
+                    _log(logger, f"Result size: {size_mb:.2f} MB (limit {max_size_mb:.2f} MB)")
+                    _emit(on_event, "size", attempt=n + 1, bytes=int(size_mb * 1024 * 1024),
+                          limit_bytes=int(max_size_mb * 1024 * 1024), fits=size_mb <= max_size_mb,
+                          seconds=round(seconds, 3))
+                    if size_mb > max_size_mb:
+                        stats.count("cap_misses")
+                    # The size model describes GIF output only
+                    if size_model is not None and fmt == "gif":
+                        try:
+                            size_model.record(
+                                w0, h0, model_bytes, dur, width, fps, level,
+                                out_bytes=int(size_mb * 1024 * 1024),
+                                first_attempt=n == 0,
+                                hit=size_mb <= max_size_mb,
+                                predictor=label,
+                                diff=encode_mode == "diff",
+                            )
+                        except Exception as e:
+                            _log(logger, f"Could not record size sample: {e}")
+                return size_mb
+
+            if race and len(plan) > 1:
+                _log(logger, f"Racing {len(plan)} attempts in parallel.")
+                sizes = _race_attempts(len(plan), try_encode, lambda mb: mb <= max_size_mb, cancel_event)
+            else:
+                sizes = {}
+                for n in range(len(plan)):
+                    sizes[n] = try_encode(n, cancel_event)
+                    if sizes[n] is not None and sizes[n] <= max_size_mb:
+                        break
+
+        # Best quality that fits (plan order), else the genuinely smallest result
+        done = [n for n, mb in sizes.items() if mb is not None]
+        fitting = [n for n in done if sizes[n] <= max_size_mb]
+        if fitting:
+            best = min(fitting)
             _log(logger, "Success within size limit.")
-            return output_path
+        elif done:
+            best = min(done, key=lambda n: sizes[n])
+            _log(logger, f"Warning: Could not reach size target. Keeping the most compressed version ({sizes[best]:.2f} MB).")
+        else:
+            raise RuntimeError(last_error or f"Failed to encode {fmt.upper()}.")
+        os.replace(attempt_paths[best], output_path)
+        out_bytes = os.path.getsize(output_path)
+        stats.count("bytes_out", out_bytes)
+        width, fps, level = plan[best]
+        return AnimationResult(output_path, fmt, width, fps, level, out_bytes, bool(fitting))
+    except ConversionCancelled:
+        _log(logger, "Cancelled.")
+        raise
+    finally:
+        for path in attempt_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        _log(logger, f"Timing: {stats.describe()}")
+        if metrics is not None:
+            metrics.merge(stats)
 
-    # If we reach here, best we could do still exceeds size; keep the smallest result if any, else error
-    if os.path.exists(output_path):
-        _log(logger, "Warning: Could not reach size target. Keeping the most compressed version.")
-        return output_path
 
-    raise RuntimeError(last_error or "Failed to encode GIF.")
+def convert_mp4_to_gif(
+    input_path: str,
+    output_path: str,
+    max_size_mb: float = 5.0,
+    initial_width: int = 480,
+    initial_fps: int = 12,
+    fast_first: bool = True,
+    max_attempts: int = 3,
+    palette_sample_sec: float = 6.0,
+    logger: Optional[Callable[[str], None]] = None,
+    encode_mode: str = "single",
+    size_model=None,
+    probe_encode: bool = False,
+    probe_windows: int = 3,
+    probe_window_sec: float = 1.0,
+    intermediate: bool = False,
+    intermediate_max_mb: float = 2048.0,
+    intermediate_dir: Optional[str] = None,
+    on_event: Optional[Callable[[str, dict], None]] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    cancel_event: Optional[threading.Event] = None,
+    race: bool = False,
+    metrics: Optional[ConversionMetrics] = None,
+    palette_windows: int = 4,
+    ranges: Optional[Sequence[TimeRange]] = None,
+    chunk_sec: float = 30.0,
+    chunk_workers: int = 0,
+) -> str:
+    """
+    Convert MP4 to GIF optimized for web. Iteratively compress to not exceed max_size_mb.
+    This is convert_video_animation restricted to GIF; see there for the parameters.
+
+    Returns the path to the generated GIF.
+    Raises RuntimeError on failure (ConversionCancelled, a subclass, when cancelled).
+    """
+    return convert_video_animation(
+        input_path, output_path, ("gif",), max_size_mb, initial_width, initial_fps, fast_first, max_attempts,
+        palette_sample_sec, logger, encode_mode, size_model, probe_encode, probe_windows, probe_window_sec,
+        intermediate, intermediate_max_mb, intermediate_dir, on_event, on_progress, cancel_event, race, metrics,
+        palette_windows, ranges, chunk_sec, chunk_workers,
+    ).path
 
 
 # -----------------------------
@@ -284,58 +1787,566 @@ def _ensure_dir(path: str) -> None:
     os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
 
 
-def convert_webp_to_png(input_path: str, output_path: str, logger: Optional[Callable[[str], None]] = None) -> str:
-    """Convert WEBP to PNG using Pillow.
+_pil_image = None
+
+
+def _require_pil(conversion: str):
+    """PIL.Image, imported once per process (lazy, so video-only use never loads Pillow)."""
+    global _pil_image
+    if _pil_image is None:
+        try:
+            from PIL import Image  # lazy import
+        except Exception as e:
+            raise RuntimeError(f"Pillow is required for {conversion}. Install with: pip install Pillow") from e
+        _pil_image = Image
+    return _pil_image
+
+
+# PNG output profiles: zlib level, Pillow's extra optimize pass, and whether to also try
+# a lossless palette (P) PNG and keep the smaller file. Measured trade-offs are in the README ("PNG profiles").
+PNG_PROFILES = {
+    "fast": {"compress_level": 1, "optimize": False, "quantize": False},
+    "balanced": {"compress_level": 6, "optimize": False, "quantize": False},
+    "smallest": {"compress_level": 9, "optimize": True, "quantize": True},
+}
+DEFAULT_PNG_PROFILE = "balanced"
+
+
+def _png_ready(im):
+    """
+    Image to hand to the PNG encoder: keep the source mode where PNG supports it and drop
+    an alpha channel that is fully opaque (a quarter of the pixel data for RGBA).
+    """
+    if im.mode in ("RGBA", "LA") and im.getchannel("A").getextrema() == (255, 255):
+        return im.convert(im.mode[:-1])
+    if im.mode == "P" and "transparency" in im.info:
+        im = im.convert("RGBA")
+        return im.convert("RGB") if im.getchannel("A").getextrema() == (255, 255) else im
+    if im.mode not in ("1", "L", "LA", "P", "RGB", "RGBA", "I;16"):
+        return im.convert("RGBA" if "A" in im.getbands() else "RGB")
+    return im
+
+
+def _lossless_palette(im):
+    """Palette (P) version of an RGB/RGBA image with at most 256 colours, or None if the
+    image has more colours or quantizing would change any pixel."""
+    if im.mode not in ("RGB", "RGBA") or im.getcolors(256) is None:
+        return None
+    Image = _require_pil("PNG output")
+    from PIL import ImageChops  # lazy import
+
+    method = Image.Quantize.FASTOCTREE if im.mode == "RGBA" else Image.Quantize.MEDIANCUT
+    pal = im.quantize(colors=256, method=method, dither=Image.Dither.NONE)
+    return pal if ImageChops.difference(pal.convert(im.mode), im).getbbox() is None else None
+
+
+def _save_png(im, output_path: str, profile: str) -> None:
+    try:
+        opts = PNG_PROFILES[profile]
+    except KeyError:
+        raise ValueError(f"Unknown PNG profile: {profile!r} (expected one of {tuple(PNG_PROFILES)})") from None
+    im = _png_ready(im)
+    save = {"format": "PNG", "compress_level": opts["compress_level"], "optimize": opts["optimize"]}
+    pal = _lossless_palette(im) if opts["quantize"] else None
+    # Written next to the output and renamed into place, so output_path is never half-written
+    tmp = f"{output_path}.part-{os.getpid()}-{threading.get_ident()}"
+    try:
+        if pal is None:
+            im.save(tmp, **save)
+        else:
+            # A palette PNG is not always smaller (tRNS chunk, filter choice); keep whichever is
+            encoded = []
+            for candidate in (im, pal):
+                buf = io.BytesIO()
+                candidate.save(buf, **save)
+                encoded.append(buf.getvalue())
+            with open(tmp, "wb") as f:
+                f.write(min(encoded, key=len))
+        os.replace(tmp, output_path)
+    finally:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def convert_webp_to_png(
+    input_path: str,
+    output_path: str,
+    logger: Optional[Callable[[str], None]] = None,
+    profile: str = DEFAULT_PNG_PROFILE,
+) -> str:
+    """Convert WEBP to PNG using Pillow. profile is a PNG_PROFILES key.
     Returns output_path. Raises RuntimeError on failure.
     """
     _ensure_dir(output_path)
-    try:
-        from PIL import Image  # lazy import
-    except Exception as e:
-        raise RuntimeError("Pillow is required for WEBP -> PNG. Install with: pip install Pillow") from e
+    Image = _require_pil("WEBP -> PNG")
 
     try:
         with Image.open(input_path) as im:
-            if im.mode in ("P", "LA", "RGBA"):
-                im = im.convert("RGBA")
-            else:
-                # Preserve colors; convert to RGBA to keep transparency if present
-                im = im.convert("RGBA")
-            im.save(output_path, format="PNG", optimize=True)
+            _save_png(im, output_path, profile)
         _log(logger, f"Converted WEBP -> PNG: {output_path}")
         return output_path
     except Exception as e:
         raise RuntimeError(f"Failed WEBP -> PNG: {e}")
 
 
-def convert_ico_to_png(input_path: str, output_path: str, logger: Optional[Callable[[str], None]] = None) -> str:
-    """Convert ICO to PNG using Pillow. Picks the largest icon size available.
+def _ico_best_entries(ico) -> Dict[Tuple[int, int], int]:
+    """Directory index of the deepest-colour entry for each icon size."""
+    best: Dict[Tuple[int, int], int] = {}
+    for idx, header in enumerate(ico.entry):
+        cur = best.get(header.dim)
+        if cur is None or header.color_depth > ico.entry[cur].color_depth:
+            best[header.dim] = idx
+    return best
+
+
+@contextmanager
+def _open_ico(input_path: str, conversion: str) -> Iterator[object]:
+    """
+    Parse only the icon directory. Image.open would also decode the largest frame up
+    front; frames are decoded on demand with ico.frame(index) instead.
+    """
+    _require_pil(conversion)
+    from PIL import IcoImagePlugin  # lazy import
+
+    with open(input_path, "rb") as f:
+        try:
+            ico = IcoImagePlugin.IcoFile(f)
+        except SyntaxError as e:
+            raise RuntimeError(f"Not an ICO file: {input_path}") from e
+        yield ico
+
+
+def _ico_frame(ico, index: int):
+    im = ico.frame(index)
+    im.load()  # frames share the file handle; decode before seeking elsewhere
+    return im
+
+
+def ico_sizes(input_path: str) -> List[Tuple[int, int]]:
+    """Icon sizes stored in an ICO file, largest first, read from its directory only."""
+    with _open_ico(input_path, "ICO -> PNG") as ico:
+        return sorted(_ico_best_entries(ico), key=lambda s: s[0] * s[1], reverse=True)
+
+
+def convert_ico_to_png(
+    input_path: str,
+    output_path: str,
+    logger: Optional[Callable[[str], None]] = None,
+    profile: str = DEFAULT_PNG_PROFILE,
+) -> str:
+    """Convert ICO to PNG using Pillow. Decodes only the largest icon (deepest colour
+    depth when a size is stored more than once). profile is a PNG_PROFILES key.
     Returns output_path. Raises RuntimeError on failure.
     """
     _ensure_dir(output_path)
     try:
-        from PIL import Image  # lazy import
+        with _open_ico(input_path, "ICO -> PNG") as ico:
+            entries = _ico_best_entries(ico)
+            if not entries:
+                raise RuntimeError("icon directory is empty")
+            largest = max(entries, key=lambda s: s[0] * s[1])
+            _save_png(_ico_frame(ico, entries[largest]), output_path, profile)
+        _log(logger, f"Converted ICO -> PNG: {output_path}")
+        return output_path
     except Exception as e:
-        raise RuntimeError("Pillow is required for ICO -> PNG. Install with: pip install Pillow") from e
+        raise RuntimeError(f"Failed ICO -> PNG: {e}")
 
+
+def convert_ico_to_pngs(
+    input_path: str,
+    output_path: str,
+    sizes: Optional[Iterable[int]] = None,
+    logger: Optional[Callable[[str], None]] = None,
+    profile: str = DEFAULT_PNG_PROFILE,
+) -> List[str]:
+    """
+    Write several icon sizes from one open of the ICO file: `<stem>_<w>x<h>.png` next to
+    output_path for each size (the square edge, e.g. [16, 32, 256]; None = every size
+    in the file). Only the selected frames are decoded. Sizes the file does not contain
+    are logged and skipped. Returns the written paths, largest first.
+    Raises RuntimeError on failure or if none of the sizes exist.
+    """
+    _ensure_dir(output_path)
+    stem, ext = os.path.splitext(output_path)
+    written = []
     try:
+        with _open_ico(input_path, "ICO -> PNG") as ico:
+            entries = _ico_best_entries(ico)
+            wanted = sorted(entries, key=lambda s: s[0] * s[1], reverse=True)
+            if sizes is not None:
+                edges = set(sizes)
+                missing = edges - {w for w, h in wanted if w == h}
+                if missing:
+                    _log(logger, f"ICO has no {', '.join(str(m) for m in sorted(missing))} px icon: {input_path}")
+                wanted = [s for s in wanted if s[0] == s[1] and s[0] in edges]
+            for w, h in wanted:
+                path = f"{stem}_{w}x{h}{ext or '.png'}"
+                _save_png(_ico_frame(ico, entries[(w, h)]), path, profile)
+                written.append(path)
+    except Exception as e:
+        raise RuntimeError(f"Failed ICO -> PNG: {e}")
+    if not written:
+        raise RuntimeError(f"Failed ICO -> PNG: none of the requested sizes are in {input_path}")
+    _log(logger, f"Converted ICO -> PNG ({len(written)} sizes): {', '.join(written)}")
+    return written
+
+
+# -----------------------------
+# Animated WEBP -> GIF / APNG (streaming)
+# -----------------------------
+
+ANIMATION_FORMATS = ("gif", "apng")
+
+# Frames sampled (as thumbnails) to build the shared GIF palette
+_PALETTE_SAMPLE_FRAMES = 8
+# Pixels with less alpha than this become the GIF's transparent index
+_GIF_ALPHA_CUTOFF = 128
+_GIF_ALPHA_MASK = [255] * _GIF_ALPHA_CUTOFF + [0] * (256 - _GIF_ALPHA_CUTOFF)
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _anim_mode(im) -> str:
+    return "RGBA" if "A" in im.getbands() or "transparency" in im.info else "RGB"
+
+
+def _anim_frames(im, size: Tuple[int, int], step: int) -> Iterator[Tuple[object, int]]:
+    """
+    Composited frames of an open animation as (frame, duration_ms), decoded one at a time
+    with seek(). Every `step`-th frame is kept and also covers the display time of the
+    frames dropped after it; kept frames are resized to `size`.
+    """
+    Image = _require_pil("animations")
+    mode = _anim_mode(im)
+    pending, pending_ms = None, 0
+    for i in range(getattr(im, "n_frames", 1)):
+        im.seek(i)
+        im.load()  # a frame's duration is only known once it is decoded
+        if i % step == 0:
+            if pending is not None:
+                yield pending, pending_ms
+            pending, pending_ms = im.convert(mode), 0
+            if pending.size != size:
+                pending = pending.resize(size, Image.Resampling.LANCZOS)
+        pending_ms += int(im.info.get("duration") or 0)
+    if pending is not None:
+        yield pending, pending_ms
+
+
+def _shared_palette(im, colors: int, transparent: bool):
+    """
+    One palette for the whole animation, as a P image to quantize every frame against.
+    Built from up to _PALETTE_SAMPLE_FRAMES frames spread over the clip, stacked as small
+    thumbnails into one sheet. One entry is left free for the transparent index.
+    Seeking decodes every frame up to the target, so this costs one decode pass.
+    """
+    Image = _require_pil("animations")
+    n = getattr(im, "n_frames", 1)
+    picks = sorted({round(k * (n - 1) / max(1, _PALETTE_SAMPLE_FRAMES - 1)) for k in range(_PALETTE_SAMPLE_FRAMES)})
+    tw = min(im.width, 160)
+    th = max(1, round(im.height * tw / im.width))
+    sheet = Image.new("RGB", (tw, th * len(picks)))
+    for row, idx in enumerate(picks):
+        im.seek(idx)
+        sheet.paste(im.convert("RGB").resize((tw, th), Image.Resampling.BILINEAR), (0, row * th))
+    q = sheet.quantize(colors=max(2, min(256, colors) - (1 if transparent else 0)), method=Image.Quantize.MEDIANCUT)
+    palette = Image.new("P", (1, 1))
+    palette.putpalette(q.getpalette())
+    return palette
+
+
+def _png_chunk(fp, ctype: bytes, data: bytes) -> None:
+    fp.write(struct.pack(">I", len(data)) + ctype + data + struct.pack(">I", zlib.crc32(ctype + data)))
+
+
+def _png_idat(png: bytes) -> List[bytes]:
+    """Payloads of the IDAT chunks of an encoded PNG."""
+    out = []
+    pos = len(_PNG_SIGNATURE)
+    while pos + 8 <= len(png):
+        length, ctype = struct.unpack(">I4s", png[pos:pos + 8])
+        if ctype == b"IDAT":
+            out.append(png[pos + 8:pos + 8 + length])
+        pos += 12 + length
+    return out
+
+
+class _GifStream:
+    """
+    Writes GIF frames as they are added, against one global palette. Animations with
+    transparency get full frames disposed to the background; opaque ones store only the
+    rectangle that changed since the previous frame.
+    """
+
+    def __init__(self, fp, palette, transparent: bool, loop: int, dither: bool) -> None:
+        from PIL import GifImagePlugin, ImageChops  # lazy import
+
+        self._gif, self._chops = GifImagePlugin, ImageChops
+        self._fp = fp
+        self._palette = palette
+        colours = palette.getpalette()
+        self._transparency = len(colours) // 3 if transparent else None
+        self._colours = colours + [0, 0, 0] if transparent else colours
+        self._loop = loop
+        self._dither = dither
+        self._prev = None  # palette indexes of the previous frame, as an L image
+
+    def add(self, frame, ms: int) -> None:
+        Image = _require_pil("animated GIF")
+        dither = Image.Dither.FLOYDSTEINBERG if self._dither else Image.Dither.NONE
+        q = frame.convert("RGB").quantize(palette=self._palette, dither=dither)
+        params = {"duration": ms}
+        if self._transparency is not None:
+            q.putpalette(self._colours)
+            q.paste(self._transparency, mask=frame.getchannel("A").point(_GIF_ALPHA_MASK))
+            params.update(transparency=self._transparency, disposal=2)
+        box = (0, 0) + q.size
+        if self._transparency is None:
+            indexes = Image.frombytes("L", q.size, q.tobytes())
+            if self._prev is not None:
+                box = self._chops.difference(self._prev, indexes).getbbox() or (0, 0, 1, 1)
+                params["disposal"] = 1
+            self._prev = indexes
+        if self._fp.tell() == 0:
+            header, _ = self._gif.getheader(q, info={"loop": self._loop})
+            self._fp.write(b"".join(header))
+        self._fp.write(b"".join(self._gif.getdata(q.crop(box), offset=box[:2], **params)))
+
+    def close(self) -> None:
+        self._fp.write(b";")
+
+
+class _ApngStream:
+    """
+    Writes APNG frames as they are added. Each frame is PNG-encoded by Pillow and its
+    IDAT data re-wrapped as an APNG frame; after the first frame only the rectangle that
+    changed is stored, replacing that area of the canvas.
+    """
+
+    def __init__(self, fp, mode: str, size: Tuple[int, int], frames: int, loop: int, compress_level: int) -> None:
+        from PIL import ImageChops  # lazy import
+
+        self._chops = ImageChops
+        self._fp = fp
+        self._level = compress_level
+        self._seq = 0
+        self._prev = None
+        fp.write(_PNG_SIGNATURE)
+        _png_chunk(fp, b"IHDR", struct.pack(">IIBBBBB", size[0], size[1], 8, 6 if mode == "RGBA" else 2, 0, 0, 0))
+        _png_chunk(fp, b"acTL", struct.pack(">II", frames, loop))
+
+    def add(self, frame, ms: int) -> None:
+        first = self._prev is None
+        box = (0, 0) + frame.size
+        if not first:
+            box = self._chops.difference(self._prev, frame).getbbox(alpha_only=False) or (0, 0, 1, 1)
+        self._prev = frame
+        part = frame.crop(box)
+        buf = io.BytesIO()
+        part.save(buf, format="PNG", compress_level=self._level)
+        _png_chunk(self._fp, b"fcTL", struct.pack(
+            ">IIIIIHHBB", self._seq, part.width, part.height, box[0], box[1], min(ms, 65535), 1000, 0, 0,
+        ))
+        self._seq += 1
+        for data in _png_idat(buf.getvalue()):
+            if first:
+                _png_chunk(self._fp, b"IDAT", data)
+            else:
+                _png_chunk(self._fp, b"fdAT", struct.pack(">I", self._seq) + data)
+                self._seq += 1
+
+    def close(self) -> None:
+        _png_chunk(self._fp, b"IEND", b"")
+
+
+def _encode_animation(
+    im,
+    path: str,
+    fmt: str,
+    size: Tuple[int, int],
+    step: int,
+    palette,
+    dither: bool,
+    compress_level: int,
+    budget: Optional[int],
+    cancel_event: Optional[threading.Event],
+    on_progress: Optional[ProgressCallback],
+) -> Tuple[bool, int]:
+    """
+    Stream one attempt into `path`. Returns (complete, bytes). With a byte budget the
+    encode stops early (complete=False, bytes = projected full size) once the output
+    passes the budget or is projected to end up well above it.
+    """
+    total = -(-getattr(im, "n_frames", 1) // step)
+    loop = int(im.info.get("loop", 0))
+    mode = _anim_mode(im)
+    with open(path, "wb") as fp:
+        if fmt == "gif":
+            writer = _GifStream(fp, palette, mode == "RGBA", loop, dither)
+        else:
+            writer = _ApngStream(fp, mode, size, total, loop, compress_level)
+        first = 0
+        for done, (frame, ms) in enumerate(_anim_frames(im, size, step), 1):
+            if cancel_event is not None and cancel_event.is_set():
+                raise ConversionCancelled("Cancelled")
+            writer.add(frame, ms)
+            written = fp.tell()
+            if done == 1:
+                first = written
+            if budget is not None and done < total:
+                # The first frame is stored whole, later ones mostly as deltas: extrapolate those
+                projected = written if done == 1 else first + (written - first) * (total - 1) / (done - 1)
+                if written > budget or (done >= max(4, total // 10) and projected > 1.5 * budget):
+                    return False, int(max(projected, written))
+            if on_progress is not None:
+                on_progress(done / total, {"stage": "encode", "frame": done, "frames": total})
+        writer.close()
+        return True, fp.tell()
+
+
+def _shrink_animation(
+    width: int, frames: int, scale: float, step: int, ratio: float, min_width: int,
+) -> Tuple[float, int]:
+    """
+    Next (scale, frame step) for an attempt that came out `ratio` times the cap. Bytes grow
+    roughly with area x frame count: shrink the area first (not below min_width), then
+    drop frames for the rest.
+    """
+    need = 0.9 / ratio  # fraction of the current size to aim for, with some headroom
+    new_scale = min(scale, max(scale * math.sqrt(need), min(1.0, min_width / width)))
+    left = need / (new_scale / scale) ** 2
+    new_step = step
+    if left < 1:
+        new_step = min(frames, max(step + 1, math.ceil(step / left)))
+    return new_scale, new_step
+
+
+def convert_animated_webp(
+    input_path: str,
+    output_path: str,
+    fmt: str = "gif",
+    max_size_mb: Optional[float] = None,
+    colors: int = 256,
+    dither: bool = False,
+    max_attempts: int = 4,
+    min_width: int = 160,
+    profile: str = DEFAULT_PNG_PROFILE,
+    logger: Optional[Callable[[str], None]] = None,
+    on_event: Optional[Callable[[str, dict], None]] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    cancel_event: Optional[threading.Event] = None,
+    metrics: Optional[ConversionMetrics] = None,
+) -> str:
+    """
+    Convert an animated WEBP to GIF or APNG (fmt "gif" / "apng") with Pillow, streaming:
+    frames are decoded one at a time with seek() and written out as soon as they are
+    encoded, so memory stays flat however many frames the file has. GIF frames are
+    quantized against one shared palette of `colors` entries built from frames sampled
+    across the clip, undithered unless `dither` is set (dithering noise roughly doubles
+    the size, since it defeats both LZW and the changed-rectangle cropping); APNG keeps
+    full colour at the zlib level of the PNG profile.
+
+    max_size_mb: optional size cap. Like convert_mp4_to_gif, every attempt writes its own
+    temp file. An attempt that is going to miss the cap is stopped part-way and its
+    projected size sets the next attempt's scale, then its frame step once the width
+    would drop below min_width (dropped frames' display time goes to the kept ones). The
+    last attempt always runs to the end; if nothing fits, its result is kept with a warning.
+
+    on_event, on_progress, cancel_event and metrics behave as in convert_mp4_to_gif
+    (stages: palette, encode; counters: attempts, retries, cap_misses, bytes_in, bytes_out).
+
+    Returns output_path. Raises RuntimeError on failure (ConversionCancelled when cancelled).
+    """
+    if fmt not in ANIMATION_FORMATS:
+        raise ValueError(f"Unknown animation format: {fmt!r} (expected one of {ANIMATION_FORMATS})")
+    if profile not in PNG_PROFILES:
+        raise ValueError(f"Unknown PNG profile: {profile!r} (expected one of {tuple(PNG_PROFILES)})")
+    label = f"WEBP -> {fmt.upper()}"
+    Image = _require_pil(label)
+    _ensure_dir(output_path)
+
+    stats = ConversionMetrics(on_stage=lambda stage, sec: _emit(on_event, "stage", stage=stage, seconds=round(sec, 4)))
+    progress = _FileProgress(on_progress)
+    cap = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+    attempts = max(1, max_attempts)
+    base, ext = os.path.splitext(output_path)
+    attempt_paths: List[str] = []
+    try:
+        stats.count("bytes_in", os.path.getsize(input_path))
         with Image.open(input_path) as im:
-            # If multiple sizes, pick the largest frame
-            best = im
-            try:
-                sizes = getattr(im, "icon_sizes", None)
-                if sizes:
-                    best_size = max(sizes, key=lambda s: (s[0] * s[1]))
-                    best = im.copy()
-                    best.size = best_size  # hint; Pillow picks correct frame on save
-            except Exception:
-                pass
-            best = best.convert("RGBA")
-            best.save(output_path, format="PNG", optimize=True)
-        _log(logger, f"Converted ICO -> PNG: {output_path}")
+            w0, h0 = im.size
+            frames = getattr(im, "n_frames", 1)
+            transparent = _anim_mode(im) == "RGBA"
+            palette = None
+            if fmt == "gif":
+                # Scale-independent, so shared by all attempts
+                with stats.timer("palette"):
+                    palette = _shared_palette(im, colors, transparent)
+            scale, step, final = 1.0, 1, cap is None
+            for n in range(attempts):
+                final = final or n == attempts - 1
+                size = (max(1, round(w0 * scale)), max(1, round(h0 * scale)))
+                path = f"{base}.attempt{n + 1}-{os.getpid()}{ext}"
+                attempt_paths.append(path)
+                _log(logger, f"Attempt: {size[0]}x{size[1]}, every {step} of {frames} frame(s)")
+                _emit(on_event, "attempt", attempt=n + 1, width=size[0], height=size[1], step=step,
+                      colors=colors if fmt == "gif" else None)
+                stats.count("attempts")
+                if n:
+                    stats.count("retries")
+                t0 = time.perf_counter()
+                with stats.timer("encode"):
+                    complete, nbytes = _encode_animation(
+                        im, path, fmt, size, step, palette, dither, PNG_PROFILES[profile]["compress_level"],
+                        None if final else cap, cancel_event, progress.phase(1.0 if final else 0.6),
+                    )
+                fits = cap is None or nbytes <= cap
+                size_mb = nbytes / (1024 * 1024)
+                if cap is None:
+                    _log(logger, f"Result size: {size_mb:.2f} MB")
+                else:
+                    state = "" if complete else "projected, stopped early; "
+                    _log(logger, f"Result size: {size_mb:.2f} MB ({state}limit {max_size_mb:.2f} MB)")
+                _emit(on_event, "size", attempt=n + 1, bytes=nbytes, limit_bytes=cap, fits=fits, complete=complete,
+                      seconds=round(time.perf_counter() - t0, 3))
+                if complete and (fits or final):
+                    if not fits:
+                        stats.count("cap_misses")
+                        _log(logger, f"Warning: Could not reach size target. Keeping the most compressed version ({size_mb:.2f} MB).")
+                    os.replace(path, output_path)
+                    break
+                stats.count("cap_misses")
+                next_scale, next_step = _shrink_animation(w0, frames, scale, step, nbytes / cap, min_width)
+                # Nothing left to shrink: run these settings to the end and keep the result
+                final = (next_scale, next_step) == (scale, step)
+                scale, step = next_scale, next_step
+        stats.count("bytes_out", os.path.getsize(output_path))
+        _log(logger, f"Converted {label}: {output_path}")
         return output_path
+    except ConversionCancelled:
+        _log(logger, "Cancelled.")
+        raise
     except Exception as e:
-        raise RuntimeError(f"Failed ICO -> PNG: {e}")
+        raise RuntimeError(f"Failed {label}: {e}") from e
+    finally:
+        for path in attempt_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        _log(logger, f"Timing: {stats.describe()}")
+        if metrics is not None:
+            metrics.merge(stats)
 
 
 ## convert_svg_to_png removed.
+
+
+if __name__ == "__main__":
+    # `python -m converter ...` runs the headless batch CLI
+    import sys
+
+    from cli import main
+
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import os
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+
+def iter_files(root: str, exts: Iterable[str], cancel_event: Optional[threading.Event] = None) -> Iterator[str]:
+    """
+    Files under root (recursively, symlinked folders not followed) whose lower-case
+    extension is in exts: each folder's files in name order, then its subfolders in name
+    order, depth first. os.scandir gives the entry types with the listing, so no file is
+    stat'ed. Stops early once cancel_event is set.
+    """
+    exts = set(exts)
+    stack = [root]
+    while stack:
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        for e in entries:
+            try:
+                if e.is_dir(follow_symlinks=False):
+                    subdirs.append(e.path)
+                    continue
+            except OSError:
+                continue
+            if os.path.splitext(e.name.lower())[1] in exts:
+                yield e.path
+        stack.extend(reversed(subdirs))  # popped from the end, so the first name goes first
+
+
+def scan_folder(
+    root: str,
+    exts: Iterable[str],
+    on_batch: Callable[[List[str]], None],
+    cancel_event: Optional[threading.Event] = None,
+    batch_size: int = 500,
+) -> int:
+    """Run iter_files and hand the matches to on_batch(paths) in batches of batch_size
+    (meant for a background thread). Returns the number of matches."""
+    found = 0
+    batch: List[str] = []
+    for path in iter_files(root, exts, cancel_event):
+        batch.append(path)
+        if len(batch) >= batch_size:
+            found += len(batch)
+            on_batch(batch)
+            batch = []
+    if batch and not (cancel_event is not None and cancel_event.is_set()):
+        found += len(batch)
+        on_batch(batch)
+    return found
+
+
+def index_runs(indices: Iterable[int]) -> List[Tuple[int, int]]:
+    """Sorted (first, last) runs of consecutive indices, e.g. for one Listbox.delete per run."""
+    runs: List[Tuple[int, int]] = []
+    for i in sorted(set(indices)):
+        if runs and runs[-1][1] == i - 1:
+            runs[-1] = (runs[-1][0], i)
+        else:
+            runs.append((i, i))
+    return runs
+
+
+class FileList:
+    """
+    The GUI's input files: insertion-ordered and de-duplicated, with optional time
+    ranges per file (MP4/MOV).
+
+    Rows are addressed by position, like the Listbox that shows them. Membership is a dict
+    lookup, so adding n files costs O(n) however long the list already is. remove_at()
+    drops any number of rows with one pass over the list instead of one per row.
+
+    Not thread-safe: use it from the UI thread (scan_folder batches are handed over).
+    """
+
+    def __init__(self) -> None:
+        self._rows: List[str] = []
+        self._keys: Dict[str, None] = {}
+        self.ranges: Dict[str, list] = {}  # path -> time ranges to convert; absent: whole clip
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._rows)
+
+    def __getitem__(self, index: int) -> str:
+        return self._rows[index]
+
+    def __contains__(self, path: object) -> bool:
+        return isinstance(path, str) and self._key(path) in self._keys
+
+    def add(self, paths: Iterable[str]) -> List[str]:
+        """Append the paths not in the list yet; returns them, in order."""
+        added = []
+        for p in paths:
+            key = self._key(p)
+            if key not in self._keys:
+                self._keys[key] = None
+                added.append(p)
+        self._rows.extend(added)
+        return added
+
+    def remove_at(self, indices: Sequence[int]) -> List[str]:
+        """Remove the rows at these positions; returns their paths."""
+        drop = set(indices)
+        removed = [self._rows[i] for i in sorted(drop)]
+        for p in removed:
+            del self._keys[self._key(p)]
+            self.ranges.pop(p, None)
+        self._rows = [p for i, p in enumerate(self._rows) if i not in drop]
+        return removed
+
+    def clear(self) -> None:
+        self._rows.clear()
+        self._keys.clear()
+        self.ranges.clear()
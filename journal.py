@@ -0,0 +1,258 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from batch import Job, JobResult
+from converter import ConversionCancelled
+
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".file_converter", "journal.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    src TEXT NOT NULL,
+    dst TEXT NOT NULL,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL,
+    output TEXT,
+    bytes INTEGER,
+    seconds REAL,
+    error TEXT,
+    runs INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    outputs TEXT,
+    PRIMARY KEY (src, dst, params)
+)
+"""
+
+# Scratch files conversions leave next to an output while writing it:
+# NAME.attemptN-PID.EXT (GIF/animation attempts), DST.part-PID-TID (PNG), DST.cache-PID-TID
+# (cache hits). Multi-size ICO jobs write NAME_WxH.png next to dst.
+_ATTEMPT_FILE = re.compile(r"^(?P<base>.+)\.attempt\d+-(?P<pid>\d+)\.\w+$")
+_PARTIAL_FILE = re.compile(r"^(?P<path>.+)\.(?:part|cache)-(?P<pid>\d+)-\d+$")
+_ICO_SIZE_SUFFIX = re.compile(r"_\d+x\d+(?=\.\w+$)")
+
+
+class BatchJournal:
+    """
+    Durable record of batch jobs, so an interrupted batch can be resumed.
+
+    One SQLite row per job, keyed on its source, destination and conversion settings
+    (the batch settings plus the job's mode and time ranges), holding its state, output
+    paths and sizes, timing and last error. begin() marks the batch's jobs pending, and each
+    job is marked running and then done, failed or cancelled as it happens (wrap() /
+    record()). Each change is committed on its own, so after a crash, reboot or cancel the
+    journal shows which outputs finished.
+
+    With resume, begin() leaves out jobs that are done in the journal and whose output is
+    still on disk at the recorded sizes (every size of a multi-size ICO job). Everything
+    else runs again: failed, cancelled, and jobs left pending or running by a crash.
+    Outputs are renamed into place only when complete, so a job that died mid-encode
+    leaves no output and no "done" row; its leftover attempt files are deleted before it
+    runs again, unless the process that wrote them is still running.
+
+    Safe to share between worker threads.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._keys: Dict[int, Tuple[str, str, str]] = {}  # job index -> row key
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # One connection shared by the workers (under _lock): every job writes twice, and
+        # opening a connection per write cost more than the write on small image jobs
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # Write-ahead logging: commits are appends. NORMAL sync survives application crashes;
+        # a power cut may lose the last few commits, which only means those jobs run again
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._connect() as db:
+            db.execute(_SCHEMA)
+            columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+            if "outputs" not in columns:  # journals written before multi-output jobs were recorded
+                db.execute("ALTER TABLE jobs ADD COLUMN outputs TEXT")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        with self._lock, self._db:  # commit on success, roll back on error
+            yield self._db
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def _params(job: Job, settings: Dict[str, object]) -> str:
+        params = dict(settings, mode=job.mode)
+        if job.ranges:
+            params["ranges"] = [list(r) for r in job.ranges]
+        return json.dumps(params, sort_keys=True, default=str)
+
+    def begin(self, jobs: Sequence[Job], settings: Dict[str, object], resume: bool = False) -> Tuple[List[Job], List[Job]]:
+        """
+        Record jobs as pending and return (jobs to run, jobs already done). settings are the
+        batch's conversion settings that affect the output (size cap, formats, profiles...),
+        not ones that only change speed. Without resume every job is run.
+        """
+        keys = {job.index: (os.path.abspath(job.src), os.path.abspath(job.dst), self._params(job, settings))
+                for job in jobs}
+        done_rows: Dict[Tuple[str, str, str], List[Tuple[str, Optional[int]]]] = {}
+        with self._connect() as db:
+            if resume:
+                for src, dst, params, output, size, outputs in db.execute(
+                    "SELECT src, dst, params, output, bytes, outputs FROM jobs WHERE state = 'done'"
+                ):
+                    files = [tuple(o) for o in json.loads(outputs)] if outputs else [(output, size)]
+                    done_rows[(src, dst, params)] = files
+        to_run, done = [], []
+        for job in jobs:
+            files = done_rows.get(keys[job.index])
+            if files and all(path and _size(path) == size for path, size in files):
+                done.append(job)
+            else:
+                to_run.append(job)
+        if resume:
+            _remove_scratch([job.dst for job in to_run])
+        now = time.time()
+        with self._connect() as db:
+            db.executemany(
+                "INSERT INTO jobs (src, dst, params, state, updated) VALUES (?, ?, ?, 'pending', ?)"
+                " ON CONFLICT (src, dst, params) DO UPDATE SET state = 'pending', error = NULL, updated = excluded.updated",
+                [(*keys[job.index], now) for job in to_run],
+            )
+            self._keys.update({job.index: keys[job.index] for job in to_run})
+        return to_run, done
+
+    def _update(self, job: Job, state: str, **fields) -> None:
+        key = self._keys.get(job.index)
+        if key is None:
+            return
+        columns = ["state = ?", "updated = ?"] + [f"{name} = ?" for name in fields]
+        if state == "running":
+            columns.append("runs = runs + 1")
+        with self._connect() as db:
+            db.execute(
+                f"UPDATE jobs SET {', '.join(columns)} WHERE src = ? AND dst = ? AND params = ?",
+                (state, time.time(), *fields.values(), *key),
+            )
+
+    def started(self, job: Job) -> None:
+        self._update(job, "running")
+
+    def record(self, res: JobResult) -> None:
+        """Store a finished job's outcome (skipped jobs, never started, stay pending)."""
+        if res.skipped:
+            return
+        if res.ok:
+            files = [(os.path.abspath(p), _size(p)) for p in (res.outputs or [res.output])]
+            self._update(res.job, "done", output=files[0][0], bytes=sum(size or 0 for _, size in files),
+                         outputs=json.dumps(files), seconds=round(res.elapsed, 3), error=None)
+        else:
+            self._update(res.job, "cancelled" if res.cancelled else "failed", seconds=round(res.elapsed, 3),
+                         error=res.error)
+
+    def wrap(self, convert: Callable[[Job], str]) -> Callable[[Job], str]:
+        """
+        Wrap a batch.run_batch convert(job) so each job is recorded from its worker thread the
+        moment it starts and ends (run_batch reports results in submission order, which can
+        lag far behind when one long job is still running).
+        """
+
+        def run(job: Job) -> str:
+            self.started(job)
+            res = JobResult(job=job)
+            t0 = time.perf_counter()
+            try:
+                res.output = convert(job)
+                res.ok = True
+                return res.output
+            except ConversionCancelled:
+                res.cancelled = True
+                raise
+            except Exception as e:
+                res.error = str(e) or e.__class__.__name__
+                raise
+            finally:
+                res.elapsed = time.perf_counter() - t0
+                self.record(res)
+
+        return run
+
+    def counts(self) -> Dict[str, int]:
+        """Jobs per state across the whole journal."""
+        with self._connect() as db:
+            rows = db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: n for state, n in rows}
+
+
+def _remove_scratch(dsts: Sequence[str]) -> None:
+    """
+    Delete the scratch files (see _ATTEMPT_FILE / _PARTIAL_FILE) that killed conversions of
+    dsts left next to them. Files of a process that is still running are left alone, so a
+    batch writing to the same folder is not disturbed. Each folder is listed once.
+    """
+    by_dir: Dict[str, Tuple[set, set]] = {}
+    for dst in dsts:
+        folder, name = os.path.split(os.path.abspath(dst))
+        bases, names = by_dir.setdefault(folder, (set(), set()))
+        bases.add(os.path.splitext(name)[0])
+        names.add(name)
+    for folder, (bases, names) in by_dir.items():
+        try:
+            with os.scandir(folder) as it:
+                entries = [e.name for e in it]
+        except OSError:
+            continue
+        for name in entries:
+            m = _ATTEMPT_FILE.match(name)
+            if m:
+                ours = m["base"] in bases
+            else:
+                m = _PARTIAL_FILE.match(name)
+                ours = bool(m) and (m["path"] in names or _ICO_SIZE_SUFFIX.sub("", m["path"], count=1) in names)
+            if not ours or _pid_alive(int(m["pid"])):
+                continue
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+
+
+def _pid_alive(pid: int) -> bool:
+    """Whether a process with this id is running (or may be: unknown counts as running)."""
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":
+        # os.kill(pid, 0) would terminate the process on Windows; ask for its exit code instead
+        import ctypes
+
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return ctypes.get_last_error() == 5  # ERROR_ACCESS_DENIED: it exists
+        try:
+            code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+                return True
+            return code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # e.g. EPERM: it exists but belongs to another user
+    return True
+
+
+def _size(path: Optional[str]) -> Optional[int]:
+    try:
+        return os.path.getsize(path) if path else None
+    except OSError:
+        return None
@@ -0,0 +1,104 @@
+import logging
+import logging.handlers
+import os
+import queue
+from typing import Optional, Tuple
+
+
+DEFAULT_LOG_PATH = os.path.join(os.path.expanduser("~"), ".file_converter", "logs", "converter.log")
+
+
+class LogPump:
+    """
+    Batches log text from worker threads for the GUI's log view.
+
+    Producers put text on `queue` from any thread (one message per put, usually ending in a
+    newline). On every tick the UI thread calls drain(), which takes at most max_batch
+    messages and returns them as one string to insert, together with the number of lines
+    to delete from the top of the view first. The view thus holds a ring buffer of the newest
+    max_lines lines, and a batch longer than that arrives already cut to its tail.
+
+    Every drained message is also appended to a rotating log file (log_path, rotated at
+    max_bytes with `backups` old files kept), so the full log survives what the view drops.
+    log_path=None, or a folder that cannot be written, keeps no file.
+
+    next_interval() is the delay until the next tick: min_interval_ms while a backlog is
+    left, interval_ms after a tick that drained something, backing off to max_interval_ms
+    while the queue stays empty.
+
+    Not thread-safe apart from `queue`: drain() and next_interval() belong to the UI thread.
+    """
+
+    def __init__(
+        self,
+        max_lines: int = 5000,
+        log_path: Optional[str] = DEFAULT_LOG_PATH,
+        max_bytes: int = 5 * 1024 * 1024,
+        backups: int = 3,
+        max_batch: int = 5000,
+        min_interval_ms: int = 20,
+        interval_ms: int = 100,
+        max_interval_ms: int = 250,
+    ) -> None:
+        self.queue: "queue.SimpleQueue[str]" = queue.SimpleQueue()
+        self.max_lines = max_lines
+        self.max_batch = max_batch
+        self.min_interval_ms = min_interval_ms
+        self.interval_ms = interval_ms
+        self.max_interval_ms = max_interval_ms
+        self._view_lines = 0
+        self._interval = interval_ms
+        self._drained = 0
+        self._backlog = False
+        self._spill: Optional[logging.Handler] = None
+        if log_path:
+            try:
+                os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+                self._spill = logging.handlers.RotatingFileHandler(
+                    log_path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True,
+                )
+                self._spill.setFormatter(logging.Formatter("%(message)s"))
+            except OSError:
+                self._spill = None  # read-only home folder etc.; the view still works
+        self.log_path = log_path if self._spill is not None else None
+
+    def put(self, text: str) -> None:
+        self.queue.put(text)
+
+    def drain(self) -> Tuple[str, int]:
+        """(text to append to the view, lines to delete from its top first); ("", 0) when idle."""
+        batch = []
+        try:
+            for _ in range(self.max_batch):
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        self._drained = len(batch)
+        self._backlog = not self.queue.empty()
+        if not batch:
+            return "", 0
+        text = "".join(batch)
+        if self._spill is not None:
+            # One record per batch: the file sees the same coalesced write as the view
+            self._spill.handle(logging.makeLogRecord({"msg": text[:-1] if text.endswith("\n") else text}))
+        lines = text.count("\n")
+        if lines > self.max_lines:
+            text = "".join(text.splitlines(keepends=True)[-self.max_lines:])
+            lines = self.max_lines
+        trim = max(0, self._view_lines + lines - self.max_lines)
+        self._view_lines += lines - trim
+        return text, trim
+
+    def next_interval(self) -> int:
+        """Milliseconds until the next drain(), from how the last one went."""
+        if self._backlog:
+            self._interval = self.min_interval_ms
+        elif self._drained:
+            self._interval = self.interval_ms
+        else:
+            self._interval = min(self.max_interval_ms, int(self._interval * 1.5))
+        return self._interval
+
+    def close(self) -> None:
+        if self._spill is not None:
+            self._spill.close()
@@ -7,15 +7,27 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 
 from converter import (
-    convert_mp4_to_gif,
-    check_ffmpeg_available,
-    convert_webp_to_png,
-    convert_ico_to_png,
+    DEFAULT_PNG_PROFILE, PNG_PROFILES, check_ffmpeg_available, format_time_ranges, parse_time_ranges,
 )
+from batch import (
+    GIF_MODES, IMAGE_MODES, BatchProgress, Job, chunk_workers, convert_images_batch, convert_job, default_workers,
+    job_cost, plan_jobs, run_batch, should_race,
+)
+from cache import OutputCache
+from filelist import FileList, index_runs, scan_folder
+from journal import BatchJournal
+from logview import LogPump
+from metrics import BatchMetrics, ConversionMetrics
+from probe import probe_many
+from size_model import SizeModel
 
 
 APP_TITLE = "Multi File Converter"
 DEFAULT_SIZE_MB = 5.0
+# Modes (combobox labels) whose output is size-capped by "Max size (MB)"
+SIZE_CAPPED_MODES = ("MP4 -> GIF", "MOV -> GIF", "WEBP -> GIF (animated)", "WEBP -> APNG (animated)")
+# "Video output" choices for MP4/MOV: the formats the best-quality-under-the-cap output is picked from
+VIDEO_OUTPUTS = {"GIF": ("gif",), "GIF or WebP": ("gif", "webp"), "GIF, WebP or APNG": ("gif", "webp", "apng")}
 
 
 class App(tk.Tk):
@@ -25,17 +37,35 @@ class App(tk.Tk):
         self.geometry("900x600")
         self.minsize(800, 520)
 
-        self.file_list = []  # list[str]
+        self.file_list = FileList()  # same order as the listbox rows
+        self._scan_thread = None  # background folder scan started by "Add Folder"
+        self._scan_cancel = threading.Event()
         base_sites = r"E:\\Sites"
         today_folder = time.strftime("%Y-%m-%d")
         self.output_dir = os.path.join(base_sites, today_folder)
         os.makedirs(self.output_dir, exist_ok=True)
 
-        self.log_queue = queue.Queue()
+        # Log lines from any thread go on log_queue; the UI thread inserts them in batches,
+        # keeps the newest lines in view and spills everything to a rotating log file
+        self.log_pump = LogPump()
+        self.log_queue = self.log_pump.queue
         self.cancel_event = threading.Event()
         self.worker_thread = None
+        self.batch_progress = None  # BatchProgress of the running batch, read by the UI pump
         self.start_btns = []  # track multiple Convert buttons
         self.cancel_btns = []  # track multiple Cancel buttons
+        try:
+            self.size_model = SizeModel()
+        except Exception:
+            self.size_model = None  # read-only home folder etc.; fall back to heuristics
+        try:
+            self.output_cache = OutputCache()
+        except Exception:
+            self.output_cache = None
+        try:
+            self.journal = BatchJournal()  # per-file record of every batch, for "Resume"
+        except Exception:
+            self.journal = None
 
         self._build_ui()
         self._schedule_log_pump()
@@ -76,6 +106,17 @@ class App(tk.Tk):
         btn_add_folder = ttk.Button(file_controls, text="Add Folder", command=self.add_folder)
         btn_add_folder.grid(row=0, column=3, padx=5, sticky="w")
 
+        # Per-file trimming for MP4/MOV: applies to the selected rows
+        range_row = ttk.Frame(file_controls)
+        range_row.grid(row=1, column=0, columnspan=4, sticky="w", pady=(8, 0))
+        ttk.Label(range_row, text="Time range(s):").pack(side=tk.LEFT)
+        self.range_var = tk.StringVar()
+        ttk.Entry(range_row, textvariable=self.range_var, width=24).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Button(range_row, text="Set on Selected", command=self.set_selected_ranges).pack(side=tk.LEFT, padx=5)
+        ttk.Button(range_row, text="Whole Clip", command=lambda: self.set_selected_ranges(clear=True)).pack(
+            side=tk.LEFT
+        )
+
         # Output controls
         out_controls = ttk.LabelFrame(top, text="Output", padding=10)
         out_controls.pack(side=tk.RIGHT, fill=tk.Y)
@@ -86,7 +127,8 @@ class App(tk.Tk):
         mode_combo = ttk.Combobox(
             out_controls,
             textvariable=self.mode_var,
-            values=["MP4 -> GIF", "MOV -> GIF", "WEBP -> PNG", "ICO -> PNG"],
+            values=["MP4 -> GIF", "MOV -> GIF", "WEBP -> PNG", "ICO -> PNG", "WEBP -> GIF (animated)",
+                    "WEBP -> APNG (animated)"],
             state="readonly",
             width=20,
         )
@@ -100,18 +142,60 @@ class App(tk.Tk):
         ttk.Button(out_controls, text="Browse", command=self.choose_output_dir).grid(row=2, column=1, padx=5)
         ttk.Button(out_controls, text="Open", command=self.open_output_dir).grid(row=2, column=2)
 
-        ttk.Label(out_controls, text="Max GIF size (MB):").grid(row=3, column=0, sticky="w", pady=(8, 0))
+        ttk.Label(out_controls, text="Max size (MB):").grid(row=3, column=0, sticky="w", pady=(8, 0))
         self.size_var = tk.StringVar(value=str(DEFAULT_SIZE_MB))
         self.size_entry = ttk.Entry(out_controls, textvariable=self.size_var, width=10)
         self.size_entry.grid(row=4, column=0, sticky="w")
 
+        ttk.Label(out_controls, text="Parallel jobs:").grid(row=3, column=1, sticky="w", pady=(8, 0))
+        self.jobs_var = tk.StringVar(value=str(default_workers()))
+        ttk.Spinbox(out_controls, from_=1, to=256, textvariable=self.jobs_var, width=6).grid(row=4, column=1, sticky="w")
+
+        png_row = ttk.Frame(out_controls)
+        png_row.grid(row=3, column=2, sticky="w", pady=(8, 0))
+        ttk.Label(png_row, text="PNG profile:").pack(side=tk.LEFT)
+        self.png_profile_var = tk.StringVar(value=DEFAULT_PNG_PROFILE)
+        self.png_profile_combo = ttk.Combobox(
+            png_row, textvariable=self.png_profile_var, values=list(PNG_PROFILES), state="disabled", width=9
+        )
+        self.png_profile_combo.pack(side=tk.LEFT, padx=(5, 0))
+
+        self.use_cache_var = tk.BooleanVar(value=self.output_cache is not None)
+        ttk.Checkbutton(out_controls, text="Reuse cached outputs", variable=self.use_cache_var).grid(
+            row=4, column=2, sticky="w"
+        )
+
+        video_row = ttk.Frame(out_controls)
+        video_row.grid(row=5, column=0, columnspan=2, sticky="w", pady=(8, 0))
+        ttk.Label(video_row, text="Video output:").pack(side=tk.LEFT)
+        self.video_output_var = tk.StringVar(value="GIF")
+        self.video_output_combo = ttk.Combobox(
+            video_row, textvariable=self.video_output_var, values=list(VIDEO_OUTPUTS), state="readonly", width=18
+        )
+        self.video_output_combo.pack(side=tk.LEFT, padx=(5, 0))
+        self.gif_diff_var = tk.BooleanVar(value=False)
+        self.gif_diff_check = ttk.Checkbutton(
+            video_row, text="Screen recording (diff GIF)", variable=self.gif_diff_var
+        )
+        self.gif_diff_check.pack(side=tk.LEFT, padx=(10, 0))
+        self.chunked_var = tk.BooleanVar(value=False)
+        self.chunked_check = ttk.Checkbutton(
+            video_row, text="Split long videos across cores", variable=self.chunked_var
+        )
+        self.chunked_check.pack(side=tk.LEFT, padx=(10, 0))
+
         # Extra controls (top-right) for visibility: Convert / Cancel
         top_buttons = ttk.Frame(out_controls)
-        top_buttons.grid(row=5, column=0, columnspan=3, pady=(8, 0), sticky="e")
+        top_buttons.grid(row=6, column=0, columnspan=3, pady=(8, 0), sticky="e")
         top_cancel = ttk.Button(top_buttons, text="Cancel", command=self.cancel_conversion, state=tk.DISABLED)
         top_cancel.pack(side=tk.RIGHT, padx=5)
         top_convert = ttk.Button(top_buttons, text="Convert to GIF", command=self.start_conversion)
         top_convert.pack(side=tk.RIGHT)
+        self.resume_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            top_buttons, text="Resume (skip files already done)", variable=self.resume_var,
+            state=tk.NORMAL if self.journal is not None else tk.DISABLED,
+        ).pack(side=tk.RIGHT, padx=(0, 10))
         self.cancel_btns.append(top_cancel)
         self.start_btns.append(top_convert)
 
@@ -163,17 +247,21 @@ class App(tk.Tk):
             "MOV -> GIF": {".mov"},
             "WEBP -> PNG": {".webp"},
             "ICO -> PNG": {".ico"},
+            "WEBP -> GIF (animated)": {".webp"},
+            "WEBP -> APNG (animated)": {".webp"},
         }.get(mode, set())
 
     def _mode_key(self) -> str:
-        """Return one of: 'mp4', 'mov', 'webp', 'ico' based on current combobox text.
-        This is resilient to minor label text changes.
+        """Return one of: 'mp4', 'mov', 'webp', 'ico', 'webp_gif', 'webp_apng' based on current
+        combobox text. This is resilient to minor label text changes.
         """
         val = (self.mode_var.get() or "").upper()
         if "MOV" in val:
             return "mov"
+        if "APNG" in val:
+            return "webp_apng"
         if "WEBP" in val:
-            return "webp"
+            return "webp_gif" if "GIF" in val else "webp"
         if "ICO" in val:
             return "ico"
         return "mp4"
@@ -187,7 +275,7 @@ class App(tk.Tk):
             filetypes = [("MP4 files", "*.mp4")]
         elif key == "mov":
             filetypes = [("MOV files", "*.mov")]
-        elif key == "webp":
+        elif key.startswith("webp"):
             filetypes = [("WEBP images", "*.webp")]
         else:  # ico
             filetypes = [("ICO files", "*.ico")]
@@ -198,63 +286,120 @@ class App(tk.Tk):
         )
         if not paths:
             return
-        added = 0
         allowed = {f".{key}"} if key in {"mp4", "mov", "webp", "ico"} else self._allowed_exts(mode)
-        for p in paths:
-            ext = os.path.splitext(p.lower())[1]
-            if ext in allowed and p not in self.file_list:
-                self.file_list.append(p)
-                self.files_listbox.insert(tk.END, p)
-                added += 1
+        added = self.file_list.add(p for p in paths if os.path.splitext(p.lower())[1] in allowed)
         if added:
-            self.log(f"Added {added} files.")
+            self.files_listbox.insert(tk.END, *added)
+            self.log(f"Added {len(added)} files.")
 
     def add_folder(self):
         """Add all files from a selected folder that match the current mode's extension.
-        Recurses into subfolders.
+        Recurses into subfolders. The folder is scanned on a background thread and the
+        matches are added in batches, so the window stays responsive on large trees.
         """
+        if self._scan_thread is not None and self._scan_thread.is_alive():
+            messagebox.showinfo("Busy", "A folder is still being scanned.")
+            return
         d = filedialog.askdirectory(title="Select folder containing files")
         if not d:
             return
-        mode = self.mode_var.get()
-        allowed = {
-            "MP4 -> GIF": {".mp4"},
-            "MOV -> GIF": {".mov"},
-            "WEBP -> PNG": {".webp"},
-            "ICO -> PNG": {".ico"},
-        }.get(mode, set())
-        added = 0
-        for root, _, files in os.walk(d):
-            for name in files:
-                ext = os.path.splitext(name.lower())[1]
-                if ext in allowed:
-                    p = os.path.join(root, name)
-                    if p not in self.file_list:
-                        self.file_list.append(p)
-                        self.files_listbox.insert(tk.END, p)
-                        added += 1
+        allowed = self._allowed_exts(self.mode_var.get())
+        batches = queue.SimpleQueue()  # lists of paths, then None when the scan is over
+        self._scan_cancel = cancel = threading.Event()
+
+        def scan():
+            try:
+                scan_folder(d, allowed, batches.put, cancel)
+            finally:
+                batches.put(None)
+
+        self._scan_thread = threading.Thread(target=scan, daemon=True)
+        self._scan_thread.start()
+        self.status_var.set("Scanning folder...")
+        self.after(50, self._pump_scan, batches, cancel, 0)
+
+    def _pump_scan(self, batches, cancel, added: int):
+        """Move scanned paths into the list: one Listbox insert per tick, with a live count."""
+        new = []
+        done = False
+        while not done:
+            try:
+                batch = batches.get_nowait()
+            except queue.Empty:
+                break
+            if batch is None:
+                done = True
+            elif not cancel.is_set():
+                new += self.file_list.add(batch)  # new paths have no time ranges: the label is the path
+        if new:
+            self.files_listbox.insert(tk.END, *new)
+            added += len(new)
+        if cancel.is_set():
+            self.status_var.set("Folder scan stopped.")
+            return
+        if not done:
+            self.status_var.set(f"Scanning folder... {added} file(s) added")
+            self.after(50, self._pump_scan, batches, cancel, added)
+            return
+        self.status_var.set(f"Added {added} file(s) from folder.")
         if added:
             self.log(f"Added {added} files from folder.")
 
     def remove_selected(self):
-        sel = list(self.files_listbox.curselection())
+        sel = self.files_listbox.curselection()
         if not sel:
             return
-        sel.reverse()
-        for idx in sel:
-            path = self.files_listbox.get(idx)
-            self.files_listbox.delete(idx)
-            try:
-                self.file_list.remove(path)
-            except ValueError:
-                pass
-        self.log("Removed selected files.")
+        # Rows may carry a time range suffix, so go by position rather than text; one
+        # Listbox call per run of adjacent rows, last run first so the others keep their place
+        for first, last in reversed(index_runs(sel)):
+            self.files_listbox.delete(first, last)
+        removed = self.file_list.remove_at(sel)
+        self.log(f"Removed {len(removed)} selected file(s).")
 
     def clear_list(self):
+        self._scan_cancel.set()  # a running folder scan adds nothing more
         self.files_listbox.delete(0, tk.END)
         self.file_list.clear()
         self.log("Cleared file list.")
 
+    def _file_label(self, path: str) -> str:
+        ranges = self.file_list.ranges.get(path)
+        return f"{path}  [{format_time_ranges(ranges)}]" if ranges else path
+
+    def set_selected_ranges(self, clear: bool = False):
+        """Set the time range(s) field on the selected MP4/MOV rows (clear: convert them whole)."""
+        sel = list(self.files_listbox.curselection())
+        if not sel:
+            messagebox.showinfo("No selection", "Select the video files to trim in the list first.")
+            return
+        ranges = None
+        if not clear:
+            try:
+                ranges = parse_time_ranges(self.range_var.get())
+            except ValueError as e:
+                messagebox.showerror(
+                    "Invalid time range",
+                    f"{e}\n\nUse START-END in seconds or m:ss, comma-separated, e.g. 0:05-0:10, 1:00-1:05 "
+                    "(leave END empty to run to the end).",
+                )
+                return
+        changed = 0
+        for idx in sel:
+            path = self.file_list[idx]
+            if os.path.splitext(path.lower())[1] not in (".mp4", ".mov"):
+                continue
+            if ranges:
+                self.file_list.ranges[path] = ranges
+            else:
+                self.file_list.ranges.pop(path, None)
+            self.files_listbox.delete(idx)
+            self.files_listbox.insert(idx, self._file_label(path))
+            self.files_listbox.selection_set(idx)
+            changed += 1
+        if changed:
+            what = format_time_ranges(ranges) if ranges else "whole clip"
+            self.log(f"Time range for {changed} file(s): {what}.")
+
     def choose_output_dir(self):
         d = filedialog.askdirectory(title="Choose output folder", initialdir=self.output_var.get())
         if d:
@@ -277,23 +422,39 @@ class App(tk.Tk):
     # Logging utilities
     def log(self, msg: str):
         ts = time.strftime("%H:%M:%S")
-        self._append_log(f"[{ts}] {msg}\n")
+        self.log_queue.put(f"[{ts}] {msg}\n")
 
-    def _append_log(self, msg: str):
+    def _append_log(self, text: str, trim: int = 0):
+        """One insert per pump tick; trim drops that many of the oldest lines first."""
         self.log_text.configure(state=tk.NORMAL)
-        self.log_text.insert(tk.END, msg)
+        if trim:
+            self.log_text.delete("1.0", f"{trim + 1}.0")
+        self.log_text.insert(tk.END, text)
         self.log_text.see(tk.END)
         self.log_text.configure(state=tk.DISABLED)
 
     def _schedule_log_pump(self):
         try:
-            while True:
-                msg = self.log_queue.get_nowait()
-                self._append_log(msg)
-        except queue.Empty:
-            pass
+            text, trim = self.log_pump.drain()
+            if text:
+                self._append_log(text, trim)
         finally:
-            self.after(100, self._schedule_log_pump)
+            self._refresh_progress()
+            self.after(self.log_pump.next_interval(), self._schedule_log_pump)
+
+    def _refresh_progress(self):
+        tracker = self.batch_progress
+        if tracker is None:
+            return
+        done, completed, eta = tracker.snapshot()
+        total = self.progress.cget("maximum")
+        self.progress.configure(value=done * float(total))
+        status = f"Processed {completed}/{int(float(total))} ({done:.0%})"
+        if eta is not None:
+            mins, secs = divmod(int(eta), 60)
+            status += f" - ETA {mins}:{secs:02d}"
+        if not self.cancel_event.is_set():
+            self.status_var.set(status)
 
     def _logger_cb(self, message: str):
         self.log_queue.put(message + "\n")
@@ -308,14 +469,21 @@ class App(tk.Tk):
             return
         mode = self.mode_var.get()
         max_mb = DEFAULT_SIZE_MB
-        if mode in ("MP4 -> GIF", "MOV -> GIF"):
+        if mode in SIZE_CAPPED_MODES:
             try:
                 max_mb = float(self.size_var.get())
                 if max_mb <= 0:
                     raise ValueError
             except ValueError:
-                messagebox.showerror("Invalid size", "Please enter a positive number for Max GIF size (MB).")
+                messagebox.showerror("Invalid size", "Please enter a positive number for Max size (MB).")
                 return
+        try:
+            workers = int(self.jobs_var.get())
+            if workers <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Invalid jobs", "Please enter a positive whole number for Parallel jobs.")
+            return
 
         self.output_dir = self.output_var.get().strip() or self.output_dir
         os.makedirs(self.output_dir, exist_ok=True)
@@ -335,7 +503,10 @@ class App(tk.Tk):
         self._set_buttons_state(start_state=tk.DISABLED, cancel_state=tk.NORMAL)
         self.cancel_event.clear()
 
-        args = (files_to_process, self.output_dir, max_mb, mode)
+        # Tk variables are read here, on the UI thread; the worker only gets plain values
+        args = (files_to_process, self.output_dir, max_mb, mode, self._mode_key(), workers, self.png_profile_var.get(),
+                VIDEO_OUTPUTS.get(self.video_output_var.get(), ("gif",)), self.gif_diff_var.get(), self.chunked_var.get(),
+                self.resume_var.get(), self.use_cache_var.get())
         self.worker_thread = threading.Thread(target=self._run_conversion, args=args, daemon=True)
         self.worker_thread.start()
 
@@ -343,67 +514,163 @@ class App(tk.Tk):
         if self.worker_thread and self.worker_thread.is_alive():
             self.cancel_event.set()
             self.status_var.set("Cancelling...")
-            self.log("Cancellation requested. Waiting for current file to finish...")
+            self.log("Cancellation requested. Stopping running files...")
+
+    def _job_logger(self, job: Job):
+        """Logger callback that tags each line with its file, since parallel jobs interleave."""
+        tag = os.path.basename(job.src)
+        return lambda message: self.log_queue.put(f"[{tag}] {message}\n")
 
-    def _run_conversion(self, files, out_dir, max_mb, mode):
+    def _convert_one(self, job: Job, max_mb: float, tracker: BatchProgress, batch_metrics: BatchMetrics,
+                     race: bool = False, png_profile: str = DEFAULT_PNG_PROFILE, formats=("gif",),
+                     gif_diff: bool = False, chunked: bool = False, chunk_procs: int = 0, cache=None) -> str:
+        metrics = ConversionMetrics()
+        try:
+            return convert_job(
+                job,
+                max_size_mb=max_mb,
+                logger=self._job_logger(job),
+                size_model=self.size_model,
+                cache=cache,
+                on_progress=lambda frac, info: tracker.update(job.index, frac),
+                cancel_event=self.cancel_event,
+                race=race,
+                metrics=metrics,
+                png_profile=png_profile,
+                formats=formats,
+                gif_diff=gif_diff,
+                chunked=chunked,
+                chunk_workers=chunk_procs,
+            )
+        finally:
+            batch_metrics.add(metrics)
+
+    def _run_conversion(self, files, out_dir, max_mb, mode, key, workers, png_profile=DEFAULT_PNG_PROFILE, formats=("gif",),
+                        gif_diff=False, chunked=False, resume=False, use_cache=True):
+        cache = self.output_cache if use_cache else None
+        jobs = plan_jobs(files, out_dir, key)
+        if key in GIF_MODES:
+            for job in jobs:
+                job.ranges = self.file_list.ranges.get(job.src)
+        journal = self.journal
+        if journal is not None:
+            # Same settings key as the CLI's --journal, so either can resume the other's batch
+            settings = {"max_size_mb": max_mb, "formats": list(formats), "gif_diff": gif_diff, "chunked": chunked,
+                        "png_profile": png_profile, "ico_sizes": None}
+            try:
+                jobs, done = journal.begin(jobs, settings, resume=resume)
+            except Exception as e:
+                self.log_queue.put(f"Batch journal unavailable: {e}\n")
+                journal = None
+            else:
+                if resume:
+                    self.log_queue.put(f"Resuming: {len(done)} file(s) already done, {len(jobs)} to convert.\n")
+        total = len(jobs)
+        # start_conversion sized the bar for every file; a resume may have dropped some
+        self.after(0, lambda: self.progress.configure(maximum=max(total, 1)))
         successes = 0
-        for idx, src in enumerate(files, start=1):
-            if self.cancel_event.is_set():
-                break
-            base = os.path.splitext(os.path.basename(src))[0]
-            if mode in ("MP4 -> GIF", "MOV -> GIF"):
-                dst = os.path.join(out_dir, f"{base}.gif")
-                self.log_queue.put(f"Converting: {src} -> {dst}\n")
-                try:
-                    convert_mp4_to_gif(
-                        input_path=src,
-                        output_path=dst,
-                        max_size_mb=max_mb,
-                        fast_first=True,
-                        max_attempts=2,
-                        palette_sample_sec=6.0,
-                        logger=self._logger_cb,
+        weights = {j.index: 1.0 for j in jobs}
+        if key in GIF_MODES:
+            # Probe the whole batch up front (results are cached for the converters) and
+            # start the most expensive clips first so one long file does not finish last alone.
+            self.log_queue.put(f"Probing {total} file(s)...\n")
+            infos = probe_many([j.src for j in jobs], max_workers=workers * 2)
+            jobs.sort(key=lambda j: job_cost(j, infos.get(j.src)), reverse=True)
+            weights = {j.index: job_cost(j, infos.get(j.src)) for j in jobs}
+        tracker = BatchProgress(weights)
+        self.batch_progress = tracker
+        batch_metrics = BatchMetrics()
+        # Few files on a many-core machine: race each file's attempts on the idle cores
+        race = key in GIF_MODES and should_race(total)
+        if race:
+            self.log_queue.put("Idle cores available: racing encode attempts in parallel.\n")
+        chunk_procs = chunk_workers(total, workers)
+
+        def on_start(job):
+            self.log_queue.put(f"Converting: {job.src} -> {job.dst}\n")
+
+        def on_done(res, completed):
+            nonlocal successes
+            if journal is not None and key in IMAGE_MODES:
+                journal.record(res)  # run_batch jobs are recorded by journal.wrap() as they end
+            if res.ok:
+                successes += 1
+                self.log_queue.put(f"Done: {res.output} ({res.elapsed:.1f}s)\n")
+            elif res.cancelled:
+                self.log_queue.put(f"Cancelled: {res.job.src}\n")
+            elif not res.skipped:
+                self.log_queue.put(f"Error: {res.job.src}: {res.error}\n")
+            # The UI pump renders the bar and ETA from the tracker
+            tracker.finish(res.job.index)
+
+        self.log_queue.put(f"Running {total} file(s) with up to {workers} parallel job(s).\n")
+        cache_before = cache.stats() if cache is not None else None
+        if key in IMAGE_MODES:
+            # Many small files: chunked pool (processes for big sets), per-file results as chunks finish
+            images = convert_images_batch(
+                jobs,
+                max_workers=workers,
+                cache=cache,
+                cancel_event=self.cancel_event,
+                on_done=on_done,
+                png_profile=png_profile,
+                on_start=on_start,
+                job_logger=self._job_logger,
+            )
+            for res in images.results:
+                m = ConversionMetrics()
+                if not res.skipped:
+                    m.add_time("convert", res.elapsed)
+                batch_metrics.add(m)
+            self.log_queue.put(
+                f"Images: {len(images.results)} file(s) in {images.seconds:.1f}s "
+                f"({images.files_per_sec:.1f} files/s).\n"
+            )
+        else:
+            convert = lambda job: self._convert_one(
+                job, max_mb, tracker, batch_metrics, race, png_profile, formats, gif_diff, chunked, chunk_procs, cache,
+            )
+            run_batch(
+                jobs,
+                journal.wrap(convert) if journal is not None else convert,
+                max_workers=workers,
+                cancel_event=self.cancel_event,
+                on_start=on_start,
+                on_done=on_done,
+            )
+        self.log_queue.put(f"Stage timing (p50/p95 per file): {batch_metrics.describe()}\n")
+        if cache_before is not None:
+            after = cache.stats()
+            self.log_queue.put(
+                f"Cache: {after['hits'] - cache_before['hits']} hit(s), "
+                f"{after['misses'] - cache_before['misses']} miss(es).\n"
+            )
+        if self.size_model is not None and mode in ("MP4 -> GIF", "MOV -> GIF"):
+            try:
+                st = self.size_model.stats(recent=200)
+                if st["first_attempt_hit_rate"] is not None:
+                    self.log_queue.put(
+                        f"Size model: first-attempt hit rate {st['first_attempt_hit_rate']:.0%} "
+                        f"over the last {st['files']} file(s) ({st['samples']} samples).\n"
                     )
-                    self.log_queue.put(f"Done: {dst}\n")
-                    successes += 1
-                except Exception as e:
-                    self.log_queue.put(f"Error: {e}\n")
-            elif mode == "WEBP -> PNG":
-                dst = os.path.join(out_dir, f"{base}.png")
-                self.log_queue.put(f"Converting: {src} -> {dst}\n")
-                try:
-                    convert_webp_to_png(src, dst, logger=self._logger_cb)
-                    self.log_queue.put(f"Done: {dst}\n")
-                    successes += 1
-                except Exception as e:
-                    self.log_queue.put(f"Error: {e}\n")
-            else:  # ICO -> PNG
-                dst = os.path.join(out_dir, f"{base}.png")
-                self.log_queue.put(f"Converting: {src} -> {dst}\n")
-                try:
-                    convert_ico_to_png(src, dst, logger=self._logger_cb)
-                    self.log_queue.put(f"Done: {dst}\n")
-                    successes += 1
-                except Exception as e:
-                    self.log_queue.put(f"Error: {e}\n")
-
-            # Progress update back on UI thread
-            self.after(0, lambda v=idx: self.progress.configure(value=v))
-            self.after(0, lambda s=f"Processed {idx}/{len(files)}": self.status_var.set(s))
+            except Exception:
+                pass
 
         def finalize():
+            self.batch_progress = None
             self._set_buttons_state(start_state=tk.NORMAL, cancel_state=tk.DISABLED)
             if self.cancel_event.is_set():
-                self.status_var.set(f"Cancelled. {successes}/{len(files)} completed")
+                self.status_var.set(f"Cancelled. {successes}/{total} completed")
             else:
-                self.status_var.set(f"Finished. {successes}/{len(files)} completed")
+                self.progress.configure(value=self.progress.cget("maximum"))
+                self.status_var.set(f"Finished. {successes}/{total} completed")
 
         self.after(0, finalize)
 
     def on_mode_change(self):
         mode = self.mode_var.get()
-        # Toggle GIF size inputs
-        if mode in ("MP4 -> GIF", "MOV -> GIF"):
+        # Toggle the size cap input
+        if mode in SIZE_CAPPED_MODES:
             try:
                 self.size_entry.configure(state=tk.NORMAL)
             except Exception:
@@ -413,8 +680,16 @@ class App(tk.Tk):
                 self.size_entry.configure(state=tk.DISABLED)
             except Exception:
                 pass
+        try:
+            self.png_profile_combo.configure(state="readonly" if "PNG" in mode.upper() else "disabled")
+            video = mode in ("MP4 -> GIF", "MOV -> GIF")
+            self.video_output_combo.configure(state="readonly" if video else "disabled")
+            self.gif_diff_check.configure(state=tk.NORMAL if video else tk.DISABLED)
+            self.chunked_check.configure(state=tk.NORMAL if video else tk.DISABLED)
+        except Exception:
+            pass
         # Update Convert button labels
-        label = "Convert to GIF" if mode in ("MP4 -> GIF", "MOV -> GIF") else "Convert to PNG"
+        label = "Convert to " + mode.split("->")[-1].split("(")[0].strip()
         for b in self.start_btns:
             try:
                 b.configure(text=label)
@@ -436,5 +711,9 @@ class App(tk.Tk):
 
 
 if __name__ == "__main__":
+    # Image batches may use a process pool; needed for the frozen (PyInstaller) .exe
+    import multiprocessing
+
+    multiprocessing.freeze_support()
     app = App()
     app.mainloop()
@@ -0,0 +1,147 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+
+# Stage names recorded by the converters, in pipeline order (used for stable reporting)
+STAGES = ("probe", "intermediate", "probe_encode", "palette", "encode", "size_check", "convert")
+
+
+class ConversionMetrics:
+    """
+    Stage timings and counters for one conversion.
+
+    Stages accumulate wall seconds (an attempt that runs twice adds up); counters are
+    plain integers such as attempts, retries, cap_misses, bytes_in and bytes_out.
+    Safe to update from several threads (racing attempts). `on_stage(stage, seconds)`
+    is called after each timed section.
+    """
+
+    def __init__(self, on_stage: Optional[Callable[[str, float], None]] = None) -> None:
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self._on_stage = on_stage
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - t0)
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        if self._on_stage:
+            try:
+                self._on_stage(stage, seconds)
+            except Exception:
+                pass
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other: "ConversionMetrics") -> None:
+        for stage, seconds in other.stages.items():
+            with self._lock:
+                self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        for name, n in other.counters.items():
+            self.count(name, n)
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {"stages": {k: round(v, 4) for k, v in self.stages.items()}, "counters": dict(self.counters)}
+
+    def describe(self) -> str:
+        """One-line timing summary for the log, e.g. 'probe 0.04s, encode 3.10s (total 3.20s)'."""
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda kv: _stage_order(kv[0]))
+        parts = [f"{name} {sec:.2f}s" for name, sec in stages]
+        return ", ".join(parts) + f" (total {sum(sec for _, sec in stages):.2f}s)" if parts else "no timed stages"
+
+
+def _stage_order(stage: str) -> int:
+    return STAGES.index(stage) if stage in STAGES else len(STAGES)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class BatchMetrics:
+    """Collects ConversionMetrics of a batch and summarises them per stage (p50/p95). Thread-safe."""
+
+    def __init__(self) -> None:
+        self._files: List[ConversionMetrics] = []
+        self._lock = threading.Lock()
+
+    def add(self, metrics: ConversionMetrics) -> None:
+        with self._lock:
+            self._files.append(metrics)
+
+    def summary(self) -> Dict[str, object]:
+        with self._lock:
+            files = [m.as_dict() for m in self._files]
+        per_stage: Dict[str, List[float]] = {}
+        counters: Dict[str, int] = {}
+        for f in files:
+            for stage, sec in f["stages"].items():
+                per_stage.setdefault(stage, []).append(sec)
+            for name, n in f["counters"].items():
+                counters[name] = counters.get(name, 0) + n
+        stages = {
+            stage: {
+                "count": len(values),
+                "total_sec": round(sum(values), 3),
+                "p50_sec": round(_percentile(values, 0.50), 3),
+                "p95_sec": round(_percentile(values, 0.95), 3),
+            }
+            for stage, values in sorted(per_stage.items(), key=lambda kv: _stage_order(kv[0]))
+        }
+        return {"files": len(files), "stages": stages, "counters": counters}
+
+    def describe(self) -> str:
+        """Log line with p50/p95 per stage."""
+        stages = self.summary()["stages"]
+        if not stages:
+            return "no timed stages"
+        return ", ".join(f"{name} {s['p50_sec']:.2f}s/{s['p95_sec']:.2f}s" for name, s in stages.items())
+
+    def write_json(self, path: str) -> None:
+        _write_atomic(path, json.dumps(self.summary(), indent=2) + "\n")
+
+    def write_prometheus(self, path: str, prefix: str = "file_converter") -> None:
+        """Prometheus text exposition format, e.g. for node_exporter's textfile collector."""
+        summary = self.summary()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Per-file seconds spent in each conversion stage.",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for stage, s in summary["stages"].items():
+            lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="0.5"}} {s["p50_sec"]}')
+            lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="0.95"}} {s["p95_sec"]}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {s["total_sec"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {s["count"]}')
+        lines += [f"# TYPE {prefix}_files_total counter", f"{prefix}_files_total {summary['files']}"]
+        for name, n in sorted(summary["counters"].items()):
+            lines += [f"# TYPE {prefix}_{name}_total counter", f"{prefix}_{name}_total {n}"]
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+
+def _write_atomic(path: str, text: str) -> None:
+    # Scrapers and dashboards may read the file at any moment; never expose a half-written one
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
@@ -0,0 +1,139 @@
+import json
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class VideoInfo:
+    """ffprobe metadata for the first video stream. Width/height are display dimensions
+    (rotation applied), which is what ffmpeg's filters see with autorotate on."""
+
+    width: Optional[int] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    duration: Optional[float] = None
+    rotation: int = 0
+    pix_fmt: Optional[str] = None
+    nb_frames: Optional[int] = None
+    codec: Optional[str] = None
+    has_audio: bool = False
+
+
+_cache: Dict[Tuple[str, int, int], VideoInfo] = {}
+_cache_lock = threading.Lock()
+
+
+def _rate(value: Optional[str]) -> Optional[float]:
+    """Parse an ffprobe rational like '30000/1001'; '0/0' and junk give None."""
+    if not value:
+        return None
+    try:
+        num, _, den = str(value).partition("/")
+        n, d = float(num), float(den or 1)
+        return n / d if n > 0 and d > 0 else None
+    except ValueError:
+        return None
+
+
+def _float(value) -> Optional[float]:
+    try:
+        f = float(value)
+        return f if f > 0 else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _rotation(stream: dict) -> int:
+    # Newer ffprobe reports a display matrix in side data, older ones a "rotate" tag
+    for side in stream.get("side_data_list") or []:
+        if "rotation" in side:
+            try:
+                return int(round(float(side["rotation"]))) % 360
+            except (TypeError, ValueError):
+                pass
+    try:
+        return int((stream.get("tags") or {}).get("rotate", 0)) % 360
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_ffprobe_json(data: dict) -> VideoInfo:
+    streams = data.get("streams") or []
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    if video is None:
+        raise ValueError("no video stream")
+    has_audio = any(s.get("codec_type") == "audio" for s in streams)
+    rotation = _rotation(video)
+    w, h = video.get("width"), video.get("height")
+    if rotation in (90, 270) and w and h:
+        w, h = h, w
+    # avg_frame_rate is the real rate for VFR phone footage; r_frame_rate can be a timebase like 90000/1
+    fps = _rate(video.get("avg_frame_rate")) or _rate(video.get("r_frame_rate"))
+    duration = _float((data.get("format") or {}).get("duration")) or _float(video.get("duration"))
+    try:
+        nb_frames: Optional[int] = int(video["nb_frames"])
+    except (KeyError, TypeError, ValueError):
+        nb_frames = int(round(fps * duration)) if fps and duration else None
+    return VideoInfo(
+        width=int(w) if w else None,
+        height=int(h) if h else None,
+        fps=fps,
+        duration=duration,
+        rotation=rotation,
+        pix_fmt=video.get("pix_fmt"),
+        nb_frames=nb_frames,
+        codec=video.get("codec_name"),
+        has_audio=has_audio,
+    )
+
+
+def probe_video(path: str) -> Optional[VideoInfo]:
+    """
+    Probe a media file with ffprobe's keyed JSON output. Returns None if it cannot be probed.
+
+    Results are cached per file identity (absolute path, size, mtime), so repeated calls
+    during a batch, or an unchanged file in a later batch, cost nothing.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    ident = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _cache_lock:
+        hit = _cache.get(ident)
+    if hit is not None:
+        return hit
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_streams", "-show_format",
+        "-of", "json",
+        path,
+    ]
+    try:
+        out = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True).stdout
+        info = parse_ffprobe_json(json.loads(out))
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+    with _cache_lock:
+        _cache[ident] = info
+    return info
+
+
+def probe_many(paths: Iterable[str], max_workers: Optional[int] = None) -> Dict[str, Optional[VideoInfo]]:
+    """Probe a whole batch concurrently (ffprobe is I/O and process bound). Returns {path: info}."""
+    paths = list(paths)
+    workers = max(1, min(len(paths) or 1, max_workers or (os.cpu_count() or 1) * 2))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="probe") as pool:
+        return dict(zip(paths, pool.map(probe_video, paths)))
+
+
+def estimated_cost(info: Optional[VideoInfo]) -> float:
+    """Relative encode cost used to schedule long jobs first: duration x source pixels."""
+    if info is None:
+        return 0.0
+    pixels = (info.width or 1280) * (info.height or 720)
+    return (info.duration or 8.0) * pixels
@@ -0,0 +1,217 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".file_converter", "size_model.sqlite3")
+
+# Fit only once there is enough history; below this the caller keeps its heuristics.
+MIN_SAMPLES = 12
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS encodes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    src_width INTEGER,
+    src_height INTEGER,
+    src_bytes INTEGER,
+    duration REAL NOT NULL,
+    width INTEGER NOT NULL,
+    fps REAL NOT NULL,
+    colors INTEGER NOT NULL,
+    out_bytes INTEGER NOT NULL,
+    first_attempt INTEGER NOT NULL,
+    hit INTEGER NOT NULL,
+    predictor TEXT NOT NULL,
+    diff INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+def _features(src_width: Optional[int], src_height: Optional[int], src_bytes: Optional[int],
+              duration: float, width: int, fps: float, colors: int) -> List[float]:
+    """Log-space regressors: output geometry/rate/palette, clip length and source bitrate.
+
+    Source bytes per second per pixel is a cheap proxy for how busy the content is:
+    camera footage carries far more bits per pixel than a screen recording.
+    """
+    dur = max(duration, 0.1)
+    pixels = (src_width or width) * (src_height or width * 9 // 16) or 1
+    bitrate = max(src_bytes or 1, 1) / dur / pixels
+    return [1.0, math.log(width), math.log(max(fps, 1.0)), math.log(colors), math.log(dur), math.log(bitrate)]
+
+
+def _solve(a: List[List[float]], b: List[float]) -> Optional[List[float]]:
+    """Solve a small dense system by Gaussian elimination with partial pivoting."""
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        piv = max(range(col, n), key=lambda r: abs(m[r][col]))
+        if abs(m[piv][col]) < 1e-12:
+            return None
+        m[col], m[piv] = m[piv], m[col]
+        for r in range(col + 1, n):
+            f = m[r][col] / m[col][col]
+            for c in range(col, n + 1):
+                m[r][c] -= f * m[col][c]
+    x = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        x[r] = (m[r][n] - sum(m[r][c] * x[c] for c in range(r + 1, n))) / m[r][r]
+    return x
+
+
+class SizeModel:
+    """
+    Persistent GIF size predictor.
+
+    Every finished encode is recorded (probed source, chosen parameters, resulting bytes)
+    in a small SQLite file. A ridge-regularised log-linear fit over that history predicts
+    the output size of a candidate parameter set, so the first attempt can be seeded with
+    the best settings expected to fit the cap instead of fixed duration buckets.
+
+    "diff" encodes (frame-difference GIFs) shrink by a content-dependent factor, so they
+    are fitted separately from the regular pipeline and each needs its own MIN_SAMPLES.
+
+    Safe to share between worker threads.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, max_rows: int = 5000):
+        self.path = path
+        self.max_rows = max_rows  # newest rows used for fitting
+        self._lock = threading.Lock()
+        self._fits: Dict[bool, Tuple[List[float], float]] = {}  # diff -> (coefficients, residual std)
+        self._fitted_rows = -1
+        self._checked_at = 0.0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute(_SCHEMA)
+            columns = {row[1] for row in db.execute("PRAGMA table_info(encodes)")}
+            if "diff" not in columns:  # stores written before diff encodes existed
+                db.execute("ALTER TABLE encodes ADD COLUMN diff INTEGER NOT NULL DEFAULT 0")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:  # commit on success, roll back on error
+                yield db
+        finally:
+            db.close()
+
+    def record(
+        self,
+        src_width: Optional[int],
+        src_height: Optional[int],
+        src_bytes: Optional[int],
+        duration: float,
+        width: int,
+        fps: float,
+        colors: int,
+        out_bytes: int,
+        first_attempt: bool,
+        hit: bool,
+        predictor: str,
+        diff: bool = False,
+    ) -> None:
+        """Store one finished encode. `predictor` names what chose the parameters ("model", "heuristic", ...);
+        `diff` marks a frame-difference encode."""
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT INTO encodes (ts, src_width, src_height, src_bytes, duration, width, fps, colors,"
+                " out_bytes, first_attempt, hit, predictor, diff) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), src_width, src_height, src_bytes, duration, width, fps, colors,
+                 out_bytes, int(first_attempt), int(hit), predictor, int(diff)),
+            )
+
+    def _fit(self) -> None:
+        # Predictions come in bursts (a whole parameter grid per file); re-check the store
+        # for new rows at most once a second instead of on every call.
+        now = time.monotonic()
+        if self._fitted_rows >= 0 and now - self._checked_at < 1.0:
+            return
+        self._checked_at = now
+        with self._connect() as db:
+            (count,) = db.execute("SELECT COUNT(*) FROM encodes").fetchone()
+            if count == self._fitted_rows:
+                return
+            rows = db.execute(
+                "SELECT src_width, src_height, src_bytes, duration, width, fps, colors, out_bytes, diff"
+                " FROM encodes ORDER BY id DESC LIMIT ?", (self.max_rows,)
+            ).fetchall()
+        self._fitted_rows = count
+        self._fits = {}
+        for diff in (False, True):
+            fit = self._fit_rows([r for r in rows if bool(r[8]) == diff])
+            if fit is not None:
+                self._fits[diff] = fit
+
+    @staticmethod
+    def _fit_rows(rows: List[tuple]) -> Optional[Tuple[List[float], float]]:
+        if len(rows) < MIN_SAMPLES:
+            return None
+        xs = [_features(*r[:7]) for r in rows]
+        ys = [math.log(max(r[7], 1)) for r in rows]
+        k = len(xs[0])
+        # Normal equations with a small ridge term to stay stable on narrow histories
+        ata = [[sum(x[i] * x[j] for x in xs) + (1e-3 if i == j and i else 0.0) for j in range(k)] for i in range(k)]
+        aty = [sum(x[i] * y for x, y in zip(xs, ys)) for i in range(k)]
+        coef = _solve(ata, aty)
+        if coef is None:
+            return None
+        resid = [y - sum(c * v for c, v in zip(coef, x)) for x, y in zip(xs, ys)]
+        return coef, math.sqrt(sum(r * r for r in resid) / max(1, len(resid) - k))
+
+    def predict_bytes(
+        self,
+        src_width: Optional[int],
+        src_height: Optional[int],
+        src_bytes: Optional[int],
+        duration: float,
+        width: int,
+        fps: float,
+        colors: int,
+        margin: float = 1.0,
+        diff: bool = False,
+    ) -> Optional[float]:
+        """
+        Predicted output bytes, or None while there is too little history (for `diff`
+        encodes: too few diff samples). `margin` adds that many residual standard deviations,
+        so comparing the result with the cap gives a conservative (roughly one-sided 84%
+        at 1.0) estimate.
+        """
+        with self._lock:
+            self._fit()
+            fit = self._fits.get(diff)
+        if fit is None:
+            return None
+        coef, std = fit
+        x = _features(src_width, src_height, src_bytes, duration, width, fps, colors)
+        return math.exp(sum(c * v for c, v in zip(coef, x)) + margin * std)
+
+    def stats(self, recent: Optional[int] = None) -> Dict[str, object]:
+        """
+        First-attempt hit rate: share of files whose first encode already fit the cap.
+        Reported overall and per predictor; `recent` limits it to the newest N files,
+        which is what shows the rate climbing as history accumulates.
+        """
+        query = "SELECT predictor, hit FROM encodes WHERE first_attempt = 1 ORDER BY id DESC"
+        params: Sequence = ()
+        if recent:
+            query += " LIMIT ?"
+            params = (recent,)
+        with self._lock, self._connect() as db:
+            rows = db.execute(query, params).fetchall()
+            (samples,) = db.execute("SELECT COUNT(*) FROM encodes").fetchone()
+        by_predictor: Dict[str, List[int]] = {}
+        for predictor, hit in rows:
+            by_predictor.setdefault(predictor, []).append(hit)
+        return {
+            "samples": samples,
+            "files": len(rows),
+            "first_attempt_hit_rate": (sum(h for _, h in rows) / len(rows)) if rows else None,
+            "by_predictor": {p: sum(h) / len(h) for p, h in by_predictor.items()},
+        }